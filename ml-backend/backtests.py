@@ -0,0 +1,149 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+
+from pymongo import ReplaceOne
+
+from forecasting import BACKTEST_WINDOWS, backtest_matrix
+from metrics import MODEL_FIT_SECONDS, MODEL_FIT_SERIES, timed_fit
+from sales_store import series_matrix
+from workers import get_process_pool
+
+TOTALS_ID = "global"
+RECOMPUTE_CHUNK_SIZE = 10000
+WINDOW_KEYS = [f"w{window}" for window in BACKTEST_WINDOWS]
+
+_recompute_lock = asyncio.Lock()
+
+
+def window_results(matrix, lengths):
+    """Backtest each row over every window, shaped as the stored ``windows`` field.
+
+    Top-level so it can run in a worker process.
+    """
+    results = backtest_matrix(matrix, lengths)
+    rows = []
+    for i in range(len(lengths)):
+        windows = {}
+        for window, (accuracy_sum, points, mape) in results.items():
+            count = int(points[i])
+            windows[f"w{window}"] = {
+                "accuracy_sum": float(accuracy_sum[i]),
+                "points": count,
+                "accuracy": round(float(accuracy_sum[i]) / count, 2) if count else None,
+                "mape": round(float(mape[i]), 2) if count else None,
+            }
+        rows.append(windows)
+    return rows
+
+
+def totals_increment(before, after):
+    inc = {}
+    for key in WINDOW_KEYS:
+        for field in ("accuracy_sum", "points"):
+            delta = (after or {}).get(key, {}).get(field, 0) - (before or {}).get(key, {}).get(field, 0)
+            if delta:
+                inc[f"{key}.{field}"] = delta
+    return inc
+
+
+async def apply_totals(repo, before, after):
+    inc = totals_increment(before, after)
+    if inc:
+        await repo.backtest_totals.update_one({"_id": TOTALS_ID}, {"$inc": inc}, upsert=True)
+
+
+async def refresh_backtest(repo, product_id, series):
+    """Recompute one product's backtests after its stored sales series changed."""
+    matrix, lengths = series_matrix([series])
+    windows = timed_fit("backtest", 1, window_results, matrix, lengths)[0]
+    previous = await repo.backtests.find_one_and_replace(
+        {"_id": product_id},
+        {"windows": windows, "updated_at": datetime.now(timezone.utc)},
+        projection={"windows": 1},
+        upsert=True,
+    )
+    await apply_totals(repo, previous and previous["windows"], windows)
+
+
+async def remove_backtest(repo, product_id):
+    previous = await repo.backtests.delete_and_get(product_id, {"windows": 1})
+    if previous:
+        await apply_totals(repo, previous["windows"], None)
+
+
+async def recompute_all(repo, progress=None):
+    """Rebuild every backtest and the global totals, fanning chunks out to the process pool.
+
+    ``progress(done, total)`` is called with the number of series backtested so far.
+    """
+    async with _recompute_lock:
+        loop = asyncio.get_running_loop()
+        pool = get_process_pool()
+        started = datetime.now(timezone.utc)
+        totals = {key: {"accuracy_sum": 0.0, "points": 0} for key in WINDOW_KEYS}
+        # Bounds how many chunks are held in memory at once
+        in_flight = asyncio.Semaphore(os.cpu_count() or 1)
+        query = {"length": {"$gt": 0}}
+        total = await repo.sales_series.count_documents(query) if progress else 0
+        done = 0
+
+        async def process(ids, docs):
+            nonlocal done
+            try:
+                matrix, lengths = series_matrix(docs)
+                # Timed around the executor, so it includes moving the chunk to and from the worker
+                with MODEL_FIT_SECONDS.labels("backtest_recompute").time():
+                    rows = await loop.run_in_executor(pool, window_results, matrix, lengths)
+                MODEL_FIT_SERIES.labels("backtest_recompute").inc(len(rows))
+                now = datetime.now(timezone.utc)
+                await repo.backtests.bulk_write(
+                    [ReplaceOne({"_id": pid}, {"windows": windows, "updated_at": now}, upsert=True) for pid, windows in zip(ids, rows)],
+                    ordered=False,
+                )
+                for windows in rows:
+                    for key in WINDOW_KEYS:
+                        totals[key]["accuracy_sum"] += windows[key]["accuracy_sum"]
+                        totals[key]["points"] += windows[key]["points"]
+                done += len(rows)
+                if progress:
+                    progress(done, total)
+            finally:
+                in_flight.release()
+
+        tasks = []
+        ids, docs = [], []
+        products = 0
+        async for series in repo.sales_series.find(query, {"dtype": 1, "sales": 1}):
+            ids.append(series["_id"])
+            docs.append(series)
+            products += 1
+            if len(ids) >= RECOMPUTE_CHUNK_SIZE:
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(process(ids, docs)))
+                ids, docs = [], []
+        if ids:
+            await in_flight.acquire()
+            tasks.append(asyncio.create_task(process(ids, docs)))
+        await asyncio.gather(*tasks)
+
+        # Products deleted or stripped of history since the last run
+        await repo.backtests.delete_many({"updated_at": {"$lt": started}})
+        await repo.backtest_totals.replace_one(
+            {"_id": TOTALS_ID}, {**totals, "complete": True, "updated_at": datetime.now(timezone.utc)}, upsert=True
+        )
+        return {"products": products, "accuracy": {key: accuracy_from(totals[key]) for key in WINDOW_KEYS}}
+
+
+def accuracy_from(window_totals):
+    points = window_totals.get("points", 0)
+    return round(window_totals.get("accuracy_sum", 0) / points, 2) if points else 0
+
+
+async def read_accuracy(repo, window, progress=None):
+    totals = await repo.backtest_totals.find_one({"_id": TOTALS_ID})
+    if not totals or not totals.get("complete"):
+        # Running totals only start from a full recompute
+        await recompute_all(repo, progress)
+        totals = await repo.backtest_totals.find_one({"_id": TOTALS_ID})
+    return accuracy_from(totals.get(f"w{window}", {}))
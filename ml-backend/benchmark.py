@@ -0,0 +1,470 @@
+"""Drive every API route under concurrent load and record latency, throughput and memory.
+
+Run it against a server backed by a local mongod, usually after loading data
+with populate_sample_data.py::
+
+    python populate_sample_data.py --products 1e5 --orders 5e5 --history-months 36 --drop
+    python benchmark.py --spawn --concurrency 32 --requests 500 --output bench.json
+    python benchmark.py --spawn --baseline bench.json --output bench-new.json
+
+``--spawn`` starts uvicorn itself so the server's peak RSS can be sampled;
+otherwise pass ``--url`` (and ``--server-pid`` for RSS). Documents the
+benchmark writes are tagged and deleted again at the end. Needs ``httpx``;
+``psutil`` is used when installed so RSS includes worker processes.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+
+import httpx
+import numpy as np
+import pymongo
+
+from repository import COLLECTIONS, DB_NAME, MONGO_URI
+
+BENCH = "BENCH"
+HEAVY_REQUESTS = 5
+# Items per request in the bulk write scenarios
+BULK_ITEMS = 200
+RSS_SAMPLE_SECONDS = 0.02
+STARTUP_TIMEOUT_SECONDS = 60
+
+
+def rss_bytes(pid):
+    """Resident memory of ``pid`` (plus its children when psutil is available), or None."""
+    try:
+        import psutil
+    except ImportError:
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+    try:
+        process = psutil.Process(pid)
+        return process.memory_info().rss + sum(child.memory_info().rss for child in process.children(recursive=True))
+    except psutil.Error:
+        return None
+
+
+class Context:
+    """Ids and payloads the request builders draw from."""
+
+    def __init__(self, db, throwaway_count):
+        self.today = date.today().isoformat()
+        self.run_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+        sample = db[COLLECTIONS["sales_series"]].aggregate([
+            {"$match": {"length": {"$gte": 2}}},
+            {"$sample": {"size": 200}},
+            {"$project": {"_id": 1}},
+        ])
+        self.product_ids = [str(doc["_id"]) for doc in sample]
+        if not self.product_ids:
+            sys.exit("No products with sales history found; load data with populate_sample_data.py first")
+        # Orders reserve stock, so they draw from products that can cover the run
+        stocked = db[COLLECTIONS["products"]].aggregate([
+            {"$match": {"stock": {"$gte": throwaway_count}}},
+            {"$sample": {"size": 200}},
+            {"$project": {"_id": 1}},
+        ])
+        self.stocked_ids = [str(doc["_id"]) for doc in stocked] or self.product_ids
+        depot = db[COLLECTIONS["warehouses"]].find_one({"location": {"$exists": True}}, {"_id": 1})
+        self.warehouse_id = str(depot["_id"]) if depot else BENCH
+        # Documents for the PUT and DELETE scenarios, inserted directly so setup isn't timed
+        self.throwaway = {}
+        for collection, (_, _, body) in ENTITIES.items():
+            docs = [body(self, i) for i in range(throwaway_count)]
+            self.throwaway[collection] = [str(_id) for _id in db[COLLECTIONS[collection]].insert_many(docs).inserted_ids]
+        self.import_file = import_csv(self.run_id)
+
+    def product_id(self, i):
+        return self.product_ids[i % len(self.product_ids)]
+
+    def stocked_id(self, i):
+        return self.stocked_ids[i % len(self.stocked_ids)]
+
+
+def import_csv(run_id, rows=1000):
+    lines = ["name,sku,category,stock,min_stock,price,supplier"]
+    lines += [f"Bench product {i},{BENCH}-{run_id}-import-{i},Bench,{i % 200},50,9.99,{BENCH}" for i in range(rows)]
+    return "\n".join(lines).encode()
+
+
+def product_body(ctx, i):
+    return {"name": "Bench product", "sku": f"{BENCH}-{ctx.run_id}-{i}-{time.perf_counter_ns()}", "category": "Bench",
+            "stock": 40, "min_stock": 20, "price": 9.99, "supplier": BENCH}
+
+
+def supplier_body(ctx, i):
+    return {"name": BENCH, "contact_info": f"bench{i}@example.com", "lead_time_days": 5, "reliability_score": 0.9}
+
+
+def warehouse_body(ctx, i):
+    return {"name": BENCH, "address": f"{i} Bench St"}
+
+
+def purchase_order_body(ctx, i):
+    return {"supplier_id": BENCH, "items": [{"product_id": ctx.product_id(i), "quantity": 10, "price": 9.99}],
+            "status": "pending", "order_date": ctx.today, "expected_delivery": ctx.today}
+
+
+def stock_transfer_body(ctx, i):
+    return {"from_warehouse": BENCH, "to_warehouse": BENCH, "items": [{"product_id": ctx.product_id(i), "quantity": 1}],
+            "status": "pending", "transfer_date": ctx.today}
+
+
+def shipment_body(ctx, i):
+    return {"purchase_order_id": BENCH, "warehouse_id": BENCH, "status": "pending", "expected_delivery": ctx.today,
+            "actual_delivery": ""}
+
+
+def order_body(ctx, i):
+    return {"customer_info": {"name": BENCH, "email": "bench@example.com", "phone": "5550000000"},
+            "items": [{"product_id": ctx.stocked_id(i), "quantity": 1, "price": 9.99}],
+            "status": "pending", "delivery_address": BENCH, "placed_date": ctx.today}
+
+
+def delivery_body(ctx, i):
+    return {"order_id": BENCH, "status": "pending", "delivery_date": ctx.today}
+
+
+def driver_body(ctx, i):
+    return {"name": BENCH, "warehouse_id": BENCH, "capacity": 40}
+
+
+# collection -> (route prefix, filter matching the documents the benchmark wrote, body builder)
+ENTITIES = {
+    "products": ("/products", {"sku": {"$regex": f"^{BENCH}-"}}, product_body),
+    "suppliers": ("/suppliers", {"name": BENCH}, supplier_body),
+    "warehouses": ("/warehouses", {"name": BENCH}, warehouse_body),
+    "purchase_orders": ("/purchase-orders", {"supplier_id": BENCH}, purchase_order_body),
+    "stock_transfers": ("/stock-transfers", {"from_warehouse": BENCH}, stock_transfer_body),
+    "shipments": ("/shipments", {"purchase_order_id": BENCH}, shipment_body),
+    "orders": ("/orders", {"delivery_address": BENCH}, order_body),
+    "deliveries": ("/deliveries", {"order_id": BENCH}, delivery_body),
+    "drivers": ("/drivers", {"name": BENCH}, driver_body),
+}
+
+
+def bulk_builder(prefix, body, ndjson=False):
+    def build(ctx, i):
+        items = [body(ctx, i * BULK_ITEMS + j) for j in range(BULK_ITEMS)]
+        if ndjson:
+            content = "\n".join(json.dumps(item) for item in items).encode()
+            return {"url": f"{prefix}/bulk", "content": content, "headers": {"Content-Type": "application/x-ndjson"}}
+        return {"url": f"{prefix}/bulk", "json": items}
+    return build
+
+
+def get(path, **params):
+    return lambda ctx, i: {"url": path, "params": params}
+
+
+def scenarios():
+    """``(name, method, route path, request builder, request cap)`` in run order; writes come last."""
+    reads = [
+        ("GET /products?limit=100", "GET", "/products", get("/products", limit=100), None),
+        ("GET /products ndjson", "GET", "/products", get("/products", format="ndjson"), HEAVY_REQUESTS),
+        ("GET /products?limit=100 (304)", "GET", "/products",
+         lambda ctx, i: {"url": "/products", "params": {"limit": 100}, "headers": {"If-None-Match": ctx.products_etag}}, None),
+        ("POST /forecast", "POST", "/forecast",
+         lambda ctx, i: {"url": "/forecast", "json": {"product_id": ctx.product_id(i), "periods": 12}}, None),
+        ("POST /forecast/batch (100)", "POST", "/forecast/batch",
+         lambda ctx, i: {"url": "/forecast/batch", "json": {"product_ids": ctx.product_ids[:100], "periods": 12}}, None),
+        ("POST /forecast/batch (all)", "POST", "/forecast/batch",
+         lambda ctx, i: {"url": "/forecast/batch", "json": {"product_ids": "all", "periods": 12}}, HEAVY_REQUESTS),
+        ("GET /forecast/cache-stats", "GET", "/forecast/cache-stats", get("/forecast/cache-stats"), None),
+        ("GET /forecast/models/{id}", "GET", "/forecast/models/{product_id}",
+         lambda ctx, i: {"url": f"/forecast/models/{ctx.product_id(i)}"}, None),
+        ("GET /insights", "GET", "/insights", get("/insights"), None),
+        ("GET /insights?rank=stockout&limit=100", "GET", "/insights", get("/insights", rank="stockout", limit=100), None),
+        ("GET /optimize", "GET", "/optimize", get("/optimize"), None),
+        ("GET /stock-movement", "GET", "/stock-movement", get("/stock-movement"), None),
+        ("GET /forecast-accuracy", "GET", "/forecast-accuracy", get("/forecast-accuracy"), None),
+        ("GET /forecast-accuracy/products/{id}", "GET", "/forecast-accuracy/products/{product_id}",
+         lambda ctx, i: {"url": f"/forecast-accuracy/products/{ctx.product_id(i)}"}, None),
+        ("GET /cost-savings", "GET", "/cost-savings", get("/cost-savings"), None),
+        ("GET /insights?async=true", "GET", "/insights", get("/insights", **{"async": "true"}), None),
+        ("GET /jobs/{id}", "GET", "/jobs/{job_id}", lambda ctx, i: {"url": f"/jobs/{ctx.job_id}"}, None),
+        ("GET /last-mile-deliveries", "GET", "/last-mile-deliveries", get("/last-mile-deliveries"), None),
+        ("GET /routes/{warehouse_id}", "GET", "/routes/{warehouse_id}",
+         lambda ctx, i: {"url": f"/routes/{ctx.warehouse_id}"}, None),
+        ("GET /supply-chain-summary", "GET", "/supply-chain-summary", get("/supply-chain-summary"), None),
+        ("GET /diagnostics/query-plans", "GET", "/diagnostics/query-plans", get("/diagnostics/query-plans"), HEAVY_REQUESTS),
+        ("GET /diagnostics/connection-pools", "GET", "/diagnostics/connection-pools", get("/diagnostics/connection-pools"), None),
+        ("GET /health", "GET", "/health", get("/health"), None),
+        ("GET /metrics", "GET", "/metrics", get("/metrics"), None),
+        ("GET /inventory/products/{id}", "GET", "/inventory/products/{product_id}",
+         lambda ctx, i: {"url": f"/inventory/products/{ctx.product_id(i)}"}, None),
+        ("GET /warehouses/{id}/inventory", "GET", "/warehouses/{warehouse_id}/inventory",
+         lambda ctx, i: {"url": f"/warehouses/{BENCH}/inventory"}, None),
+        ("GET /inventory/positions?limit=100", "GET", "/inventory/positions", get("/inventory/positions", limit=100), None),
+        ("GET /inventory/ledger?limit=100", "GET", "/inventory/ledger", get("/inventory/ledger", limit=100), None),
+    ]
+    for collection, (prefix, _, _) in ENTITIES.items():
+        if collection != "products":
+            reads.append((f"GET {prefix}?limit=100", "GET", prefix, get(prefix, limit=100), None))
+
+    writes = [
+        ("POST /import-excel", "POST", "/import-excel",
+         lambda ctx, i: {"url": "/import-excel", "files": {"file": ("bench.csv", io.BytesIO(ctx.import_file), "text/csv")}},
+         HEAVY_REQUESTS),
+        ("POST /forecast-accuracy/recompute", "POST", "/forecast-accuracy/recompute",
+         lambda ctx, i: {"url": "/forecast-accuracy/recompute"}, HEAVY_REQUESTS),
+        ("POST /forecast/models/refit", "POST", "/forecast/models/refit",
+         lambda ctx, i: {"url": "/forecast/models/refit"}, HEAVY_REQUESTS),
+        ("POST /routes/plan", "POST", "/routes/plan", lambda ctx, i: {"url": "/routes/plan"}, HEAVY_REQUESTS),
+        ("POST /optimize/refresh", "POST", "/optimize/refresh", lambda ctx, i: {"url": "/optimize/refresh"}, HEAVY_REQUESTS),
+        ("POST /supply-chain-summary/reconcile", "POST", "/supply-chain-summary/reconcile",
+         lambda ctx, i: {"url": "/supply-chain-summary/reconcile"}, HEAVY_REQUESTS),
+        ("POST /inventory/adjustments", "POST", "/inventory/adjustments",
+         lambda ctx, i: {"url": "/inventory/adjustments",
+                         "json": {"product_id": ctx.product_id(i), "warehouse_id": BENCH, "quantity": 1, "reason": BENCH}}, None),
+        ("POST /inventory/compact", "POST", "/inventory/compact", lambda ctx, i: {"url": "/inventory/compact"}, HEAVY_REQUESTS),
+        ("POST /inventory/reconcile", "POST", "/inventory/reconcile", lambda ctx, i: {"url": "/inventory/reconcile"}, HEAVY_REQUESTS),
+    ]
+    for collection, (prefix, _, body) in ENTITIES.items():
+        item_path = prefix + "/{" + ("product_id" if collection == "products" else item_param(prefix)) + "}"
+        writes += [
+            (f"POST {prefix}", "POST", prefix, lambda ctx, i, prefix=prefix, body=body: {"url": prefix, "json": body(ctx, i)}, None),
+            (f"PUT {prefix}/{{id}}", "PUT", item_path, update_builder(collection, prefix, body), None),
+            (f"DELETE {prefix}/{{id}}", "DELETE", item_path,
+             lambda ctx, i, collection=collection, prefix=prefix: {"url": f"{prefix}/{ctx.throwaway[collection][i]}"}, None),
+        ]
+        if collection not in ("products", "suppliers", "warehouses", "drivers"):
+            writes.append((f"POST {prefix}/bulk ({BULK_ITEMS})", "POST", f"{prefix}/bulk", bulk_builder(prefix, body), HEAVY_REQUESTS))
+    writes.append((f"POST /orders/bulk ndjson ({BULK_ITEMS})", "POST", "/orders/bulk",
+                   bulk_builder("/orders", order_body, ndjson=True), HEAVY_REQUESTS))
+    return reads + writes
+
+
+def item_param(prefix):
+    return {
+        "/suppliers": "supplier_id",
+        "/warehouses": "warehouse_id",
+        "/purchase-orders": "order_id",
+        "/stock-transfers": "transfer_id",
+        "/shipments": "shipment_id",
+        "/orders": "order_id",
+        "/deliveries": "delivery_id",
+        "/drivers": "driver_id",
+    }[prefix]
+
+
+def update_builder(collection, prefix, body):
+    def build(ctx, i):
+        payload = {"stock": 30, "min_stock": 20} if collection == "products" else body(ctx, i)
+        return {"url": f"{prefix}/{ctx.throwaway[collection][i]}", "json": payload}
+    return build
+
+
+def uncovered_routes():
+    from fastapi.routing import APIRoute
+
+    from main import app
+
+    covered = {(method, path) for _, method, path, _, _ in scenarios()}
+    return sorted(
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods if (method, route.path) not in covered
+    )
+
+
+async def sample_rss(pid, peak):
+    while True:
+        rss = rss_bytes(pid)
+        if rss is not None:
+            peak[0] = max(peak[0] or 0, rss)
+        await asyncio.sleep(RSS_SAMPLE_SECONDS)
+
+
+async def run_scenario(client, ctx, method, build, requests, concurrency, pid):
+    latencies = []
+    statuses = Counter()
+    indexes = iter(range(requests))
+
+    async def worker():
+        for i in indexes:
+            request = build(ctx, i)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, **request)
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as exc:
+                statuses[type(exc).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    peak = [rss_bytes(pid) if pid else None]
+    sampler = asyncio.create_task(sample_rss(pid, peak)) if pid else None
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.cancel()
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "requests": requests,
+        "concurrency": min(concurrency, requests),
+        "errors": sum(count for status, count in statuses.items() if not status.startswith(("2", "3"))),
+        "statuses": dict(statuses),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(latencies_ms.mean()), 2),
+        "throughput_rps": round(requests / elapsed, 2),
+        "peak_rss_mb": round(peak[0] / 2**20, 1) if peak[0] else None,
+    }
+
+
+async def cleanup(client, db):
+    """Delete what the benchmark wrote through the API, so the summary and backtests stay in step."""
+    for collection, (prefix, marker, _) in ENTITIES.items():
+        for doc in db[COLLECTIONS[collection]].find(marker, {"_id": 1}):
+            await client.delete(f"{prefix}/{doc['_id']}")
+    # The ledger is append-only, so stock the benchmark adjusted is adjusted back
+    for position in db[COLLECTIONS["stock_positions"]].find({"warehouse_id": BENCH, "on_hand": {"$ne": 0}}):
+        await client.post("/inventory/adjustments", json={
+            "product_id": str(position["product_id"]), "warehouse_id": BENCH, "quantity": -position["on_hand"], "reason": BENCH,
+        })
+    # Throwaway documents were inserted behind the counters' back
+    await client.post("/supply-chain-summary/reconcile")
+
+
+async def run(args, pid):
+    db = pymongo.MongoClient(args.mongo_uri)[args.db]
+    ctx = Context(db, args.requests)
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        try:
+            # A finished job to poll
+            ctx.job_id = (await client.get("/cost-savings", params={"async": "true"})).json()["job_id"]
+            ctx.products_etag = (await client.get("/products", params={"limit": 100})).headers.get("etag", "")
+            # Route plans to read
+            await client.post("/routes/plan")
+            for name, method, _, build, cap in scenarios():
+                if args.only and not any(part in name for part in args.only):
+                    continue
+                requests = min(args.requests, cap or args.requests)
+                results[name] = await run_scenario(client, ctx, method, build, requests, args.concurrency, pid)
+                r = results[name]
+                print(f"{name:<45} p50 {r['p50_ms']:>9.1f}ms  p95 {r['p95_ms']:>9.1f}ms  p99 {r['p99_ms']:>9.1f}ms  "
+                      f"{r['throughput_rps']:>8.1f} req/s  errors {r['errors']}")
+        finally:
+            await cleanup(client, db)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["endpoints"]
+    print(f"\nCompared with {baseline_path} (p95 regressions over {threshold:.0%} flagged):")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or not before["p95_ms"]:
+            continue
+        change = result["p95_ms"] / before["p95_ms"] - 1
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:<45} p95 {before['p95_ms']:>9.1f} -> {result['p95_ms']:>9.1f}ms ({change:+.0%})  "
+              f"{before['throughput_rps']:>8.1f} -> {result['throughput_rps']:>8.1f} req/s{flag}")
+
+
+def start_server(port):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit("uvicorn exited during startup")
+        try:
+            if httpx.get(f"{url}/health").status_code == 200:
+                return server, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    sys.exit("uvicorn did not become ready in time")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="start uvicorn on --port and measure its RSS")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--server-pid", type=int, help="pid to sample RSS from when not using --spawn")
+    parser.add_argument("--mongo-uri", default=MONGO_URI)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario (heavy ones are capped)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--only", nargs="*", help="run scenarios whose name contains any of these strings")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare p95 and throughput with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative p95 increase reported as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    missing = uncovered_routes()
+    if missing:
+        print("Routes without a benchmark scenario: " + ", ".join(missing))
+
+    server = None
+    pid = args.server_pid
+    if args.spawn:
+        server, args.url = start_server(args.port)
+        pid = server.pid
+    started_at = datetime.now(timezone.utc).isoformat()
+    try:
+        results = asyncio.run(run(args, pid))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "uncovered_routes": missing,
+        },
+        "endpoints": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import json
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic import ValidationError
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from pagination import NDJSON_MEDIA_TYPE
+from summary import COLLECTION_COUNTERS, record_changes
+
+# Items accepted in one JSON array body; larger feeds should be sent as NDJSON
+MAX_BULK_ITEMS = 10000
+BULK_CHUNK_SIZE = 1000
+MAX_LINE_BYTES = 1024 * 1024
+MAX_REPORTED_ERRORS = 100
+# Stands in for an NDJSON line that doesn't parse
+INVALID_JSON = object()
+# Collection -> (field, error): documents with the field set to true must be updated one at a time,
+# e.g. to release reserved stock
+SINGLE_UPDATE_FIELDS = {
+    "orders": ("stock_reserved", "Order holds reserved stock; update it with PUT /orders/{id}"),
+}
+
+
+def validation_message(exc):
+    return "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exc.errors())
+
+
+def prepare_item(model, raw, prepare=None):
+    """Validate one raw item with ``model``; return ``(doc_id or None, data)`` or raise ValueError."""
+    if raw is INVALID_JSON:
+        raise ValueError("Invalid JSON")
+    if not isinstance(raw, dict):
+        raise ValueError("Expected a JSON object")
+    try:
+        data = model(**raw).dict(exclude_unset=True)
+    except ValidationError as exc:
+        raise ValueError(validation_message(exc))
+    doc_id = data.pop("id", None)
+    if doc_id is not None:
+        try:
+            doc_id = ObjectId(doc_id)
+        except Exception:
+            raise ValueError(f"Invalid id format: {doc_id}")
+    if prepare:
+        prepare(data)
+    return doc_id, data
+
+
+async def write_chunk(repo, name, entries):
+    """Insert or update one chunk of ``(position, doc_id, data)`` entries with a single unordered bulk write.
+
+    Entries with an id update that document and the rest are inserted. Returns
+    one result per entry, in no particular order; an update that matched
+    nothing, e.g. because its document was deleted or reserved meanwhile, is
+    reported as an error.
+    """
+    collection = getattr(repo, name)
+    results = []
+    update_ids = [doc_id for _, doc_id, _ in entries if doc_id is not None]
+    guard_field, guard_error = SINGLE_UPDATE_FIELDS.get(name, (None, None))
+    # Previous statuses keep the summary counters right; they also tell which updates have nothing to match
+    previous = {}
+    if update_ids:
+        projection = {"status": 1, guard_field: 1} if guard_field else {"status": 1}
+        async for doc in collection.find({"_id": {"$in": update_ids}}, projection):
+            previous[doc["_id"]] = doc
+
+    ops, written, changes = [], [], []
+    for position, doc_id, data in entries:
+        if doc_id is None:
+            # Assigned here so the result can report it
+            data["_id"] = ObjectId()
+            ops.append(InsertOne(data))
+            written.append((position, data["_id"], "created"))
+            changes.append((None, data))
+        elif guard_field and previous.get(doc_id, {}).get(guard_field) is True:
+            results.append({"index": position, "status": "error", "error": guard_error})
+        elif doc_id in previous:
+            query = {"_id": doc_id, guard_field: {"$ne": True}} if guard_field else {"_id": doc_id}
+            ops.append(UpdateOne(query, {"$set": data}))
+            written.append((position, doc_id, "updated"))
+            changes.append((previous[doc_id], {**previous[doc_id], **data}))
+        else:
+            results.append({"index": position, "status": "error", "error": "Not found"})
+
+    failed = {}
+    matched = 0
+    if ops:
+        try:
+            result = await collection.bulk_write(ops, ordered=False)
+            matched = result.matched_count
+        except BulkWriteError as exc:
+            failed = {error["index"]: error["errmsg"] for error in exc.details["writeErrors"]}
+            matched = exc.details["nMatched"]
+    updated = [i for i, (_, _, status) in enumerate(written) if status == "updated" and i not in failed]
+    if matched < len(updated):
+        failed.update(await unmatched_updates(collection, guard_field, guard_error, written, updated))
+
+    for i, (position, doc_id, status) in enumerate(written):
+        if i in failed:
+            results.append({"index": position, "status": "error", "error": failed[i]})
+        else:
+            results.append({"index": position, "id": str(doc_id), "status": status})
+    if name in COLLECTION_COUNTERS:
+        await record_changes(repo, name, [change for i, change in enumerate(changes) if i not in failed])
+    return results
+
+
+async def unmatched_updates(collection, guard_field, guard_error, written, updated):
+    """``{index: error}`` for the updates in ``written`` (at ``updated``) whose document is gone or now guarded.
+
+    Only called when the bulk write matched fewer updates than it sent; its
+    result has no per-update counts.
+    """
+    ids = [written[i][1] for i in updated]
+    projection = {guard_field: 1} if guard_field else {"_id": 1}
+    current = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": ids}}, projection)}
+    errors = {}
+    for i in updated:
+        doc = current.get(written[i][1])
+        if doc is None:
+            errors[i] = "Not found"
+        elif guard_field and doc.get(guard_field) is True:
+            errors[i] = guard_error
+    return errors
+
+
+async def write_items(repo, name, model, items, prepare=None):
+    """Validate and write ``(position, raw item)`` pairs chunk by chunk, yielding each chunk's results in order."""
+    entries, invalid = [], []
+    async for position, raw in items:
+        try:
+            doc_id, data = prepare_item(model, raw, prepare)
+        except ValueError as exc:
+            invalid.append({"index": position, "status": "error", "error": str(exc)})
+        else:
+            entries.append((position, doc_id, data))
+        if len(entries) + len(invalid) >= BULK_CHUNK_SIZE:
+            yield await flush_chunk(repo, name, entries, invalid)
+            entries, invalid = [], []
+    if entries or invalid:
+        yield await flush_chunk(repo, name, entries, invalid)
+
+
+async def flush_chunk(repo, name, entries, invalid):
+    results = invalid + (await write_chunk(repo, name, entries) if entries else [])
+    return sorted(results, key=result_index)
+
+
+def result_index(result):
+    return result["index"]
+
+
+async def iter_ndjson_items(request):
+    """Parse an NDJSON request body as it arrives, yielding ``(line number, item)``.
+
+    Lines that aren't valid JSON yield ``INVALID_JSON`` and are reported like
+    any other bad item.
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail=f"NDJSON line {line_number + len(lines) + 1} is too long")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, parse_line(line)
+    if buffer.strip():
+        yield line_number + 1, parse_line(buffer)
+
+
+def parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return INVALID_JSON
+
+
+async def aiter_items(items):
+    for item in items:
+        yield item
+
+
+async def bulk_upsert(request, repo, name, model, prepare=None):
+    """Create and update documents of ``model`` in bulk.
+
+    The body is either a JSON array, answered with one result per item
+    (``index``, ``id``, ``status`` or ``error``), or NDJSON
+    (``Content-Type: application/x-ndjson``), which is written as it streams in
+    and answered with counts and the first errors by line number. Items with
+    an ``id`` update that document; the others are inserted. A bad item never
+    fails the rest.
+    """
+    if NDJSON_MEDIA_TYPE in request.headers.get("content-type", ""):
+        summary = {"processed": 0, "created": 0, "updated": 0, "errors": 0, "error_items": []}
+        async for results in write_items(repo, name, model, iter_ndjson_items(request), prepare):
+            for result in results:
+                summary["processed"] += 1
+                if result["status"] == "error":
+                    summary["errors"] += 1
+                    if len(summary["error_items"]) < MAX_REPORTED_ERRORS:
+                        summary["error_items"].append({"line": result["index"], "error": result["error"]})
+                else:
+                    summary[result["status"]] += 1
+        return summary
+
+    try:
+        items = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per array; send larger feeds as NDJSON")
+    results = []
+    async for chunk_results in write_items(repo, name, model, aiter_items(enumerate(items)), prepare):
+        results.extend(chunk_results)
+    return {
+        "created": sum(result["status"] == "created" for result in results),
+        "updated": sum(result["status"] == "updated" for result in results),
+        "errors": sum(result["status"] == "error" for result in results),
+        "results": results,
+    }
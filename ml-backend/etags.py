@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import time
+from datetime import date
+from functools import lru_cache
+
+from pymongo.errors import PyMongoError
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+BODY_CACHE_SIZE = 512
+BODY_CACHE_SECONDS = 3600
+
+
+def versioned(*collections, cache_body=False, stamp=None, stale_for=None):
+    """Mark a GET endpoint as depending only on ``collections``, so it gets an ETag.
+
+    ``cache_body`` keeps the endpoint's last response per URL for as long as
+    its ETag holds. ``stamp``, if given, is called instead of reading the
+    collection versions and returns the versions the endpoint's current data
+    was built from, or None when there is none yet. ``stale_for``, if given,
+    returns how many seconds the endpoint's reads may lag behind the primary;
+    its ETag then also changes that often, so data read from a secondary
+    that hadn't caught up yet isn't kept until the next write.
+    """
+    def mark(endpoint):
+        endpoint.versioned_by = (collections, cache_body, stamp, stale_for)
+        return endpoint
+    return mark
+
+
+def make_etag(versions, accept, stale_seconds=0):
+    # The day covers endpoints whose default date range moves; Accept covers JSON vs NDJSON
+    key = f"{date.today().isoformat()}|{accept}|{versions}"
+    if stale_seconds:
+        key += f"|{int(time.time() // stale_seconds)}"
+    return f'"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class ConditionalGetMiddleware:
+    """ASGI middleware answering conditional GETs from collection versions.
+
+    Endpoints marked with ``versioned`` get an ``ETag`` built from the
+    versions of the collections they read; a request whose ``If-None-Match``
+    still matches is answered ``304`` without running the endpoint. Marked
+    endpoints with ``cache_body`` also have their last ``200`` per URL replayed
+    while the ETag holds.
+    """
+
+    def __init__(self, app, routes, versions):
+        self.app = app
+        self.routes = routes
+        self.versions = versions
+        self.bodies = TTLCache(maxsize=BODY_CACHE_SIZE, ttl=BODY_CACHE_SECONDS)
+        self.spec = lru_cache(maxsize=4096)(self._spec)
+
+    def _spec(self, path):
+        for route in self.routes:
+            regex = getattr(route, "path_regex", None)
+            if regex is not None and "GET" in getattr(route, "methods", ()) and regex.match(path):
+                return getattr(route.endpoint, "versioned_by", None)
+        return None
+
+    async def __call__(self, scope, receive, send):
+        spec = self.spec(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+        if spec is None:
+            await self.app(scope, receive, send)
+            return
+
+        collections, cache_body, stamp, stale_for = spec
+        headers = dict(scope["headers"])
+        accept = headers.get(b"accept", b"").decode("latin-1")
+        stale_seconds = stale_for() if stale_for else 0
+        try:
+            versions = stamp() if stamp else await self.versions.current(collections)
+        except PyMongoError as exc:
+            logger.warning("Collection versions unavailable, serving %s unconditionally: %s", scope["path"], exc)
+            await self.app(scope, receive, send)
+            return
+        # A stamped endpoint with nothing built yet is tagged once its response has built it
+        etag = None if versions is None else make_etag(versions, accept, stale_seconds)
+
+        if etag is not None and etag_matches(headers.get(b"if-none-match", b"").decode("latin-1"), etag):
+            await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", etag.encode())]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cache_key = (scope["path"], scope["query_string"], headers.get(b"accept"))
+        if cache_body and etag is not None:
+            cached = self.bodies.get(cache_key)
+            if cached is not None and cached[0] == etag:
+                await send({"type": "http.response.start", "status": 200, "headers": cached[1]})
+                await send({"type": "http.response.body", "body": cached[2]})
+                return
+
+        response = {"status": None, "headers": None, "body": [], "etag": etag}
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                if response["etag"] is None and stamp:
+                    built = stamp()
+                    response["etag"] = None if built is None else make_etag(built, accept, stale_seconds)
+                if message["status"] == 200 and response["etag"] is not None:
+                    message["headers"] = [
+                        *message.get("headers", []), (b"etag", response["etag"].encode()), (b"cache-control", b"no-cache"),
+                    ]
+                response["headers"] = message.get("headers", [])
+            elif cache_body and response["status"] == 200 and response["etag"] is not None:
+                response["body"].append(message.get("body", b""))
+                if not message.get("more_body"):
+                    self.bodies.set(cache_key, (response["etag"], response["headers"], b"".join(response["body"])))
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
@@ -0,0 +1,162 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from multiprocessing import shared_memory
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReplaceOne
+
+from forecasting import MODELS, SEASON_LENGTH, select_models
+from metrics import MODEL_FIT_SECONDS, MODEL_FIT_SERIES, timed_fit
+from sales_store import series_matrix
+from workers import get_process_pool
+
+FIT_CHUNK_SIZE = 5000
+MODEL_FIELDS = {"model": 1, "level": 1, "trend": 1, "season": 1, "length": 1}
+
+_fit_lock = asyncio.Lock()
+
+
+def fit_shared(matrix_name, lengths_name, shape, start, stop):
+    """``select_models`` over rows ``[start, stop)`` of a sales matrix held in shared memory.
+
+    Top-level so it can run in a worker process; only the segment names and
+    row bounds are pickled, not the matrix.
+    """
+    matrix_segment = shared_memory.SharedMemory(name=matrix_name)
+    lengths_segment = shared_memory.SharedMemory(name=lengths_name)
+    try:
+        matrix = np.ndarray(shape, dtype=np.float64, buffer=matrix_segment.buf)
+        lengths = np.ndarray(shape[:1], dtype=np.int64, buffer=lengths_segment.buf)
+        # Copies, so no view of the segments outlives them
+        models = select_models(matrix[start:stop].copy(), lengths[start:stop].copy())
+        del matrix, lengths
+        return models
+    finally:
+        matrix_segment.close()
+        lengths_segment.close()
+
+
+def model_documents(ids, models, lengths, now):
+    return [
+        ReplaceOne({"_id": pid}, {
+            "model": MODELS[int(models["model"][i])],
+            "level": float(models["level"][i]),
+            "trend": float(models["trend"][i]),
+            "season": models["season"][i].tolist(),
+            "params": {name: float(models[name][i]) for name in ("alpha", "beta", "gamma")},
+            "mape": None if np.isnan(models["mape"][i]) else round(float(models["mape"][i]), 2),
+            "length": int(lengths[i]),
+            "updated_at": now,
+        }, upsert=True)
+        for i, pid in enumerate(ids)
+    ]
+
+
+async def save_models(repo, ids, models, lengths):
+    if ids:
+        await repo.forecast_models.bulk_write(model_documents(ids, models, lengths, datetime.now(timezone.utc)), ordered=False)
+
+
+async def refresh_model(repo, product_id, series):
+    """Reselect one product's model after its stored sales series changed.
+
+    An empty series has nothing to fit, so any stored model is dropped, as
+    ``fit_all_models`` skips such series too.
+    """
+    matrix, lengths = series_matrix([series])
+    if lengths[0] == 0:
+        await remove_model(repo, product_id)
+        return
+    await save_models(repo, [product_id], timed_fit("model_select", 1, select_models, matrix, lengths), lengths)
+
+
+async def remove_model(repo, product_id):
+    await repo.forecast_models.delete(product_id)
+
+
+async def fit_all_models(repo, progress=None):
+    """Select and store a model for every sales series, fanning chunks out to the process pool.
+
+    The matrix is copied once into shared memory and each worker reads its
+    rows from there. ``progress(done, total)`` is called as chunks finish.
+    """
+    async with _fit_lock:
+        started = datetime.now(timezone.utc)
+        docs = await repo.sales_series.find({"length": {"$gt": 0}}, {"dtype": 1, "sales": 1}).to_list()
+        ids = [doc["_id"] for doc in docs]
+        matrix, lengths = series_matrix(docs)
+        del docs
+        counts = dict.fromkeys(MODELS, 0)
+        if ids:
+            matrix_segment = shared_memory.SharedMemory(create=True, size=matrix.nbytes or 1)
+            lengths_segment = shared_memory.SharedMemory(create=True, size=lengths.nbytes)
+            try:
+                np.ndarray(matrix.shape, dtype=np.float64, buffer=matrix_segment.buf)[:] = matrix
+                np.ndarray(lengths.shape, dtype=np.int64, buffer=lengths_segment.buf)[:] = lengths
+                await fit_chunks(repo, ids, matrix_segment.name, lengths_segment.name, matrix.shape, lengths, counts, progress)
+            finally:
+                matrix_segment.close()
+                matrix_segment.unlink()
+                lengths_segment.close()
+                lengths_segment.unlink()
+        # Products deleted or stripped of history since the last run
+        await repo.forecast_models.delete_many({"updated_at": {"$lt": started}})
+        return {"products": len(ids), "models": counts}
+
+
+async def fit_chunks(repo, ids, matrix_name, lengths_name, shape, lengths, counts, progress):
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    # Bounds how many chunks' results are held in memory at once
+    in_flight = asyncio.Semaphore(os.cpu_count() or 1)
+    done = 0
+
+    async def process(start, stop):
+        nonlocal done
+        try:
+            with MODEL_FIT_SECONDS.labels("model_select_all").time():
+                models = await loop.run_in_executor(pool, fit_shared, matrix_name, lengths_name, shape, start, stop)
+            MODEL_FIT_SERIES.labels("model_select_all").inc(stop - start)
+            await save_models(repo, ids[start:stop], models, lengths[start:stop])
+            for index, count in enumerate(np.bincount(models["model"], minlength=len(MODELS))):
+                counts[MODELS[index]] += int(count)
+            done += stop - start
+            if progress:
+                progress(done, len(ids))
+        finally:
+            in_flight.release()
+
+    tasks = []
+    for start in range(0, len(ids), FIT_CHUNK_SIZE):
+        await in_flight.acquire()
+        tasks.append(asyncio.create_task(process(start, min(start + FIT_CHUNK_SIZE, len(ids)))))
+    await asyncio.gather(*tasks)
+
+
+async def load_models(repo, ids, matrix, lengths):
+    """Stored model states for ``ids`` as ``(model names, level, trend, season)`` arrays.
+
+    Products without a model, or whose series has changed length since it
+    was stored, are fitted now and saved.
+    """
+    stored = {doc["_id"]: doc async for doc in repo.forecast_models.find({"_id": {"$in": list(ids)}}, MODEL_FIELDS)}
+    stale = [i for i, pid in enumerate(ids) if stored.get(pid, {}).get("length") != int(lengths[i])]
+    if stale:
+        models = await run_in_threadpool(timed_fit, "model_select", len(stale), select_models, matrix[stale], lengths[stale])
+        await save_models(repo, [ids[i] for i in stale], models, lengths[stale])
+        for row, i in enumerate(stale):
+            stored[ids[i]] = {
+                "model": MODELS[int(models["model"][row])],
+                "level": models["level"][row],
+                "trend": models["trend"][row],
+                "season": models["season"][row],
+            }
+    docs = [stored[pid] for pid in ids]
+    return (
+        [doc["model"] for doc in docs],
+        np.array([doc["level"] for doc in docs], dtype=np.float64),
+        np.array([doc["trend"] for doc in docs], dtype=np.float64),
+        np.array([doc["season"] for doc in docs], dtype=np.float64).reshape(len(docs), SEASON_LENGTH),
+    )
@@ -0,0 +1,251 @@
+import numpy as np
+
+# Holdout lengths (in periods) the backtest store keeps per product
+BACKTEST_WINDOWS = (3, 6, 12)
+
+
+def fit_linear_batch(matrix, lengths):
+    """Least-squares fit of ``sales ~ a + b * t`` for every row at once.
+
+    Only the first ``lengths[i]`` values of row ``i`` are used, so the same
+    matrix can be refit over shorter windows (e.g. for holdout backtests).
+    Returns ``(intercepts, slopes)``.
+    """
+    n = lengths.astype(np.float64)
+    t = np.arange(matrix.shape[1], dtype=np.float64)
+    y = np.where(t < n[:, None], matrix, 0.0)
+
+    sum_t = n * (n - 1) / 2
+    sum_tt = (n - 1) * n * (2 * n - 1) / 6
+    sum_y = y.sum(axis=1)
+    sum_ty = y @ t
+
+    denom = n * sum_tt - sum_t ** 2
+    slopes = np.divide(n * sum_ty - sum_t * sum_y, denom, out=np.zeros_like(n), where=denom != 0)
+    intercepts = np.divide(sum_y - slopes * sum_t, n, out=np.zeros_like(n), where=n > 0)
+    return intercepts, slopes
+
+
+def predict_linear_batch(intercepts, slopes, start, periods):
+    """Evaluate fitted lines at ``start[i] + k`` for ``k`` in ``range(periods)``."""
+    steps = np.asarray(start, dtype=np.float64)[:, None] + np.arange(periods, dtype=np.float64)
+    return intercepts[:, None] + slopes[:, None] * steps
+
+
+def build_chart_data(actuals, labels, predictions):
+    chart_data = [{"period": label, "actual": float(value), "predicted": None} for label, value in zip(labels, actuals)]
+    start = len(actuals)
+    for i, pred in enumerate(predictions):
+        # Assuming periods are monthly
+        chart_data.append({"period": f"Month {start + i + 1}", "actual": None, "predicted": float(pred)})
+    return chart_data
+
+
+def backtest_matrix(matrix, lengths, windows=BACKTEST_WINDOWS):
+    """Holdout backtests of the linear model for every row and window.
+
+    For a window ``w`` the last ``w`` values of a row are predicted from the
+    ones before it. Per-point accuracy is ``100 - APE`` clipped to 0-100 and
+    only points with a positive actual count; rows no longer than ``w`` get no
+    points. Returns ``{w: (accuracy_sum, points, mape)}`` with one value per row.
+    """
+    n_rows, width = matrix.shape
+    results = {}
+    for window in windows:
+        eligible = lengths > window
+        train_lengths = np.where(eligible, lengths - window, 0)
+        intercepts, slopes = fit_linear_batch(matrix, train_lengths)
+        preds = predict_linear_batch(intercepts, slopes, train_lengths, window)
+        positions = np.minimum(train_lengths[:, None] + np.arange(window), max(width - 1, 0))
+        actuals = np.take_along_axis(matrix, positions, axis=1) if width else np.zeros((n_rows, window))
+
+        valid = eligible[:, None] & (actuals > 0)
+        ape = np.abs(preds - actuals) / np.where(valid, actuals, 1.0)
+        accuracy_sum = np.where(valid, np.clip(100 - ape * 100, 0, 100), 0.0).sum(axis=1)
+        points = valid.sum(axis=1)
+        mape = np.divide(np.where(valid, ape, 0.0).sum(axis=1) * 100, points, out=np.full(n_rows, np.nan), where=points > 0)
+        results[window] = (accuracy_sum, points, mape)
+    return results
+
+
+# --- Model selection ---
+# Every model is stored in one shape, so a forecast is a cheap evaluation whatever was selected:
+# prediction h periods after the last actual = level + h * trend + season[(h - 1) % SEASON_LENGTH]
+
+SEASON_LENGTH = 12
+MODELS = ("linear", "holt", "holt_winters", "seasonal_naive")
+HOLDOUT_PERIODS = 6
+# Smoothing parameters tried per series; the best by holdout error is kept
+ALPHAS = (0.2, 0.5, 0.8)
+BETAS = (0.05, 0.2)
+GAMMAS = (0.1, 0.3)
+
+
+def smooth(matrix, lengths, alpha, beta, gamma, seasonal):
+    """Additive Holt-Winters (``seasonal``) or Holt's linear smoothing of every row at once.
+
+    Parameters are per-row arrays. Rows need at least two seasons (or two
+    points without seasonality); shorter ones come back as garbage for the
+    caller to mask. Returns ``(level, trend, season)`` as of each row's last
+    point, with ``season[:, k]`` the component ``k + 1`` periods ahead.
+    """
+    rows = len(lengths)
+    period = SEASON_LENGTH if seasonal else 1
+    if seasonal:
+        first = matrix[:, :period].mean(axis=1)
+        trend = (matrix[:, period:2 * period].mean(axis=1) - first) / period
+        offsets = np.arange(period) - (period - 1) / 2
+        season = matrix[:, :period] - (first[:, None] + trend[:, None] * offsets)
+        level = first + trend * (period - 1) / 2
+    else:
+        level = matrix[:, 0].copy()
+        trend = matrix[:, 1] - matrix[:, 0] if matrix.shape[1] > 1 else np.zeros(rows)
+        season = np.zeros((rows, 1))
+    for t in range(period, matrix.shape[1]):
+        active = t < lengths
+        column = t % period
+        current = season[:, column]
+        y = matrix[:, t]
+        new_level = alpha * (y - current) + (1 - alpha) * (level + trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        season[:, column] = np.where(active, gamma * (y - new_level) + (1 - gamma) * current, current)
+        level = np.where(active, new_level, level)
+        trend = np.where(active, new_trend, trend)
+    ahead = (lengths[:, None] + np.arange(SEASON_LENGTH)) % period
+    return level, trend, np.take_along_axis(season, ahead, axis=1)
+
+
+def linear_state(matrix, lengths):
+    intercepts, slopes = fit_linear_batch(matrix, lengths)
+    return intercepts + slopes * (lengths - 1), slopes, np.zeros((len(lengths), SEASON_LENGTH))
+
+
+def seasonal_naive_state(matrix, lengths):
+    # Next year repeats the last one
+    positions = np.clip(lengths[:, None] - SEASON_LENGTH + np.arange(SEASON_LENGTH), 0, max(matrix.shape[1] - 1, 0))
+    season = np.take_along_axis(matrix, positions, axis=1) if matrix.shape[1] else np.zeros((len(lengths), SEASON_LENGTH))
+    return np.zeros(len(lengths)), np.zeros(len(lengths)), season
+
+
+def evaluate_models(level, trend, season, periods):
+    """Forecast ``periods`` steps ahead for every row from stored model states."""
+    steps = np.arange(1, periods + 1)
+    return level[:, None] + trend[:, None] * steps + season[:, (steps - 1) % SEASON_LENGTH]
+
+
+def model_chart_data(matrix, lengths, labels, level, trend, season, periods):
+    """``chart_data`` for every row: its actuals (named by ``labels``) followed by the model's forecast."""
+    # Demand can't go negative, whatever the trend says
+    predictions = np.maximum(evaluate_models(level, trend, season, periods), 0)
+    return [
+        build_chart_data(row[:length], row_labels, preds)
+        for row, length, row_labels, preds in zip(matrix, lengths, labels, predictions)
+    ]
+
+
+def parameter_grid(seasonal):
+    gammas = GAMMAS if seasonal else (0.0,)
+    return np.array([(a, b, g) for a in ALPHAS for b in BETAS for g in gammas])
+
+
+def smoothing_candidates(matrix, lengths, seasonal, holdout, eligible):
+    """Grid-search smoothing parameters on the training part of each ``eligible`` row.
+
+    Returns the best ``(params, holdout absolute error)`` per row, with an
+    infinite error for the other rows.
+    """
+    grid = parameter_grid(seasonal)
+    params = np.zeros((len(lengths), 3))
+    error = np.full(len(lengths), np.inf)
+    rows = np.flatnonzero(eligible)
+    if not len(rows):
+        return params, error
+    tiled = np.repeat(rows, len(grid))
+    candidates = np.tile(grid, (len(rows), 1))
+    train = lengths[tiled] - holdout
+    level, trend, season = smooth(matrix[tiled], train, candidates[:, 0], candidates[:, 1], candidates[:, 2], seasonal)
+    errors = holdout_errors(matrix[tiled], train, evaluate_models(level, trend, season, holdout)).reshape(len(rows), len(grid))
+    best = errors.argmin(axis=1)
+    params[rows] = grid[best]
+    error[rows] = errors[np.arange(len(rows)), best]
+    return params, error
+
+
+def holdout_errors(matrix, train_lengths, predictions):
+    holdout = predictions.shape[1]
+    positions = np.minimum(train_lengths[:, None] + np.arange(holdout), max(matrix.shape[1] - 1, 0))
+    actuals = np.take_along_axis(matrix, positions, axis=1)
+    return np.abs(predictions - actuals).sum(axis=1)
+
+
+def holdout_mape(matrix, train_lengths, predictions):
+    holdout = predictions.shape[1]
+    positions = np.minimum(train_lengths[:, None] + np.arange(holdout), max(matrix.shape[1] - 1, 0))
+    actuals = np.take_along_axis(matrix, positions, axis=1)
+    valid = actuals > 0
+    ape = np.abs(predictions - actuals) / np.where(valid, actuals, 1.0)
+    points = valid.sum(axis=1)
+    return np.divide(np.where(valid, ape, 0.0).sum(axis=1) * 100, points, out=np.full(len(train_lengths), np.nan), where=points > 0)
+
+
+def select_models(matrix, lengths, holdout=HOLDOUT_PERIODS):
+    """Pick a forecasting model per row by error on its last ``holdout`` periods, then fit it to the whole row.
+
+    Candidates are the linear trend, Holt's linear smoothing, additive
+    Holt-Winters (at least two seasons of training data) and seasonal naive
+    (one season). Rows too short to hold anything out get the linear trend.
+    Returns one array per field: ``model`` (index into ``MODELS``),
+    ``level``, ``trend``, ``season``, ``alpha``, ``beta``, ``gamma`` and the
+    chosen model's holdout ``mape`` (NaN when nothing was held out).
+    """
+    rows = len(lengths)
+    train = lengths - holdout
+    can_holdout = train >= 2
+
+    errors = np.full((rows, len(MODELS)), np.inf)
+    linear_holdout = evaluate_models(*linear_state(matrix, np.maximum(train, 0)), holdout)
+    errors[:, 0] = np.where(can_holdout, holdout_errors(matrix, np.maximum(train, 0), linear_holdout), np.inf)
+    holt_params, errors[:, 1] = smoothing_candidates(matrix, lengths, False, holdout, train >= 3)
+    hw_params, errors[:, 2] = smoothing_candidates(matrix, lengths, True, holdout, train >= 2 * SEASON_LENGTH)
+    naive_holdout = evaluate_models(*seasonal_naive_state(matrix, np.maximum(train, 0)), holdout)
+    errors[:, 3] = np.where(train >= SEASON_LENGTH, holdout_errors(matrix, np.maximum(train, 0), naive_holdout), np.inf)
+    # Ties (e.g. flat series) go to the simplest model, which comes first
+    model = np.where(can_holdout, errors.argmin(axis=1), 0)
+
+    params = np.zeros((rows, 3))
+    params[model == 1] = holt_params[model == 1]
+    params[model == 2] = hw_params[model == 2]
+
+    level, trend, season = linear_state(matrix, lengths)
+    for index, seasonal in ((1, False), (2, True)):
+        chosen = np.flatnonzero(model == index)
+        if len(chosen):
+            p = params[chosen]
+            state = smooth(matrix[chosen], lengths[chosen], p[:, 0], p[:, 1], p[:, 2], seasonal)
+            level[chosen], trend[chosen], season[chosen] = state
+    chosen = np.flatnonzero(model == 3)
+    if len(chosen):
+        level[chosen], trend[chosen], season[chosen] = seasonal_naive_state(matrix[chosen], lengths[chosen])
+
+    # Holdout error of the chosen model, for reporting
+    holdout_predictions = np.zeros((rows, holdout))
+    for index, predictions in ((0, linear_holdout), (3, naive_holdout)):
+        holdout_predictions[model == index] = predictions[model == index]
+    for index, seasonal, chosen_params in ((1, False, holt_params), (2, True, hw_params)):
+        chosen = np.flatnonzero(model == index)
+        if len(chosen):
+            p = chosen_params[chosen]
+            state = smooth(matrix[chosen], train[chosen], p[:, 0], p[:, 1], p[:, 2], seasonal)
+            holdout_predictions[chosen] = evaluate_models(*state, holdout)
+    mape = np.where(can_holdout, holdout_mape(matrix, np.maximum(train, 0), holdout_predictions), np.nan)
+
+    return {
+        "model": model,
+        "level": level,
+        "trend": trend,
+        "season": season,
+        "alpha": params[:, 0],
+        "beta": params[:, 1],
+        "gamma": params[:, 2],
+        "mape": mape,
+    }
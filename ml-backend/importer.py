@@ -0,0 +1,145 @@
+import codecs
+import csv
+import math
+import os
+
+from fastapi.concurrency import run_in_threadpool
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from products import coerce_product_fields, compute_status, missing_required_field
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+
+class UnsupportedFileType(ValueError):
+    pass
+
+
+def iter_excel_rows(fileobj):
+    from openpyxl import load_workbook
+
+    # read_only mode streams rows from the sheet XML instead of building the workbook in memory
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        for values in rows:
+            yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def iter_csv_rows(fileobj):
+    yield from csv.DictReader(codecs.iterdecode(fileobj, "utf-8-sig"))
+
+
+def iter_parquet_rows(fileobj, batch_size):
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(fileobj).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def iter_rows(fileobj, filename, chunk_size):
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".csv":
+        return iter_csv_rows(fileobj)
+    if ext in (".parquet", ".pq"):
+        return iter_parquet_rows(fileobj, chunk_size)
+    if ext in (".xlsx", ".xlsm"):
+        return iter_excel_rows(fileobj)
+    raise UnsupportedFileType(f"Unsupported file type: {ext or filename!r} (expected .xlsx, .csv or .parquet)")
+
+
+def iter_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prepare_product_row(row):
+    data = {}
+    for key, value in row.items():
+        # Blank cells come through as None, "" or NaN depending on the format
+        if key is None or value is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if not value:
+                continue
+        elif isinstance(value, float) and math.isnan(value):
+            continue
+        data[str(key).strip()] = value
+    data.pop("_id", None)
+
+    coerce_product_fields(data)
+    missing = missing_required_field(data)
+    if missing:
+        raise ValueError(f"Missing required field: {missing}")
+    stock = data.get("stock", 0)
+    min_stock = data.get("min_stock", 0)
+    if not isinstance(stock, (int, float)) or not isinstance(min_stock, (int, float)):
+        raise ValueError("stock and min_stock must be numeric")
+    data["status"] = compute_status(stock, min_stock)
+    return data
+
+
+def record_error(summary, row_number, message):
+    summary["errors"] += 1
+    if len(summary["error_rows"]) < MAX_REPORTED_ERRORS:
+        summary["error_rows"].append({"row": row_number, "error": message})
+
+
+def iter_prepared_chunks(fileobj, filename, chunk_size, summary):
+    """Yield ``(row_numbers, operations)`` per chunk, recording bad rows in ``summary``."""
+    row_number = 0
+    for chunk in iter_chunks(iter_rows(fileobj, filename, chunk_size), chunk_size):
+        # Later rows win when a SKU repeats within a chunk
+        ops = {}
+        for row in chunk:
+            row_number += 1
+            try:
+                data = prepare_product_row(row)
+            except ValueError as exc:
+                record_error(summary, row_number, str(exc))
+                continue
+            ops[data["sku"]] = (row_number, UpdateOne({"sku": data["sku"]}, {"$set": data}, upsert=True))
+        summary["processed"] += len(chunk)
+        summary["chunks"] += 1
+        yield [number for number, _ in ops.values()], [op for _, op in ops.values()]
+
+
+async def import_products(collection, fileobj, filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Upsert products by ``sku`` from an Excel, CSV or Parquet upload.
+
+    Rows are read and written ``chunk_size`` at a time, so memory use is
+    bounded by the chunk rather than the file. Parsing runs in the threadpool;
+    only the bulk writes are awaited on the event loop.
+    """
+    summary = {"processed": 0, "inserted": 0, "updated": 0, "errors": 0, "chunks": 0, "error_rows": []}
+    chunks = iter_prepared_chunks(fileobj, filename, chunk_size, summary)
+    while True:
+        prepared = await run_in_threadpool(next, chunks, None)
+        if prepared is None:
+            break
+        row_numbers, ops = prepared
+        if not ops:
+            continue
+        try:
+            result = (await collection.bulk_write(ops, ordered=False)).bulk_api_result
+        except BulkWriteError as exc:
+            result = exc.details
+            for error in result["writeErrors"]:
+                record_error(summary, row_numbers[error["index"]], error["errmsg"])
+        summary["inserted"] += result["nUpserted"]
+        summary["updated"] += result["nMatched"]
+    return summary
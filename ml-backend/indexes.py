@@ -0,0 +1,140 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indexes declared per collection. create_indexes is a no-op for indexes that
+# already exist with the same keys and options, so this is safe on every startup.
+INDEXES = {
+    "products": [
+        # Partial so older products imported without a SKU don't collide on null
+        IndexModel([("sku", ASCENDING)], unique=True, partialFilterExpression={"sku": {"$exists": True}}),
+        IndexModel([("category", ASCENDING)]),
+        IndexModel([("supplier", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+    ],
+    "purchase_orders": [
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("supplier_id", ASCENDING)]),
+        IndexModel([("items.product_id", ASCENDING)]),
+    ],
+    "orders": [
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("placed_date", ASCENDING)]),
+        IndexModel([("items.product_id", ASCENDING)]),
+    ],
+    "shipments": [
+        # Also serves status-only filters through its prefix
+        IndexModel([("status", ASCENDING), ("actual_delivery", ASCENDING)]),
+        IndexModel([("purchase_order_id", ASCENDING)]),
+        IndexModel([("warehouse_id", ASCENDING)]),
+    ],
+    "deliveries": [
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("order_id", ASCENDING)]),
+        IndexModel([("warehouse_id", ASCENDING)]),
+    ],
+    "drivers": [
+        IndexModel([("warehouse_id", ASCENDING)]),
+    ],
+    "route_plans": [
+        # Finds the plan holding a delivery when it changes
+        IndexModel([("routes.stops.delivery_id", ASCENDING)]),
+        IndexModel([("unassigned.delivery_id", ASCENDING)]),
+    ],
+    "stock_transfers": [
+        IndexModel([("items.product_id", ASCENDING)]),
+        IndexModel([("from_warehouse", ASCENDING)]),
+        IndexModel([("to_warehouse", ASCENDING)]),
+        IndexModel([("transfer_date", ASCENDING)]),
+    ],
+    "sales_series": [
+        IndexModel([("length", ASCENDING)]),
+        # Incremental insight refreshes read the series written since the last one
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "inventory_ledger": [
+        IndexModel([("product_id", ASCENDING), ("warehouse_id", ASCENDING)]),
+        IndexModel([("warehouse_id", ASCENDING)]),
+    ],
+    "stock_positions": [
+        # The position's identity; positions are upserted on it
+        IndexModel([("product_id", ASCENDING), ("warehouse_id", ASCENDING)], unique=True),
+        IndexModel([("warehouse_id", ASCENDING)]),
+    ],
+    "stock_snapshots": [
+        IndexModel(
+            [("through", ASCENDING), ("product_id", ASCENDING), ("warehouse_id", ASCENDING)],
+            unique=True, partialFilterExpression={"through": {"$exists": True}},
+        ),
+    ],
+}
+
+# Filters issued by the dashboard endpoints, checked by explain_hot_queries.
+# Sample values only need the right type; the plan doesn't depend on them.
+HOT_QUERIES = [
+    ("products", {"sku": "SAMPLE-SKU"}),
+    ("products", {"category": "Widgets"}),
+    ("sales_series", {"length": {"$gte": 2}}),
+    ("sales_series", {"updated_at": {"$gte": datetime(2024, 1, 1, tzinfo=timezone.utc)}}),
+    ("purchase_orders", {"status": {"$nin": ["received", "cancelled"]}}),
+    ("purchase_orders", {"supplier_id": "000000000000000000000000"}),
+    ("purchase_orders", {"items.product_id": ObjectId("000000000000000000000000")}),
+    ("orders", {"status": {"$nin": ["delivered", "cancelled"]}}),
+    ("orders", {"items.product_id": "000000000000000000000000"}),
+    ("deliveries", {"status": {"$nin": ["delivered", "cancelled"]}}),
+    ("shipments", {"status": {"$nin": ["received", "cancelled"]}}),
+    ("stock_transfers", {"items.product_id": "000000000000000000000000"}),
+    ("orders", {"placed_date": {"$gte": "2024-01"}, "status": {"$ne": "cancelled"}}),
+    ("shipments", {"actual_delivery": {"$gte": "2024-01"}, "status": "received"}),
+    ("stock_transfers", {"transfer_date": {"$gte": "2024-01"}, "status": "completed"}),
+    ("stock_positions", {"product_id": ObjectId("000000000000000000000000")}),
+    ("stock_positions", {"warehouse_id": "000000000000000000000000"}),
+]
+
+
+async def ensure_indexes(database):
+    """Create every declared index, logging (not raising) conflicts with existing data or indexes."""
+    created = {}
+    for name, models in INDEXES.items():
+        try:
+            created[name] = await database[name].create_indexes(models)
+        except OperationFailure as exc:
+            # e.g. duplicate SKUs already stored, or an index with the same keys but other options
+            logger.warning("Could not create indexes on %s: %s", name, exc)
+    return created
+
+
+def plan_values(plan, key):
+    """Collect every value of ``key`` in an explain plan tree, depth first."""
+    values = []
+    if isinstance(plan, dict):
+        if key in plan:
+            values.append(plan[key])
+        for value in plan.values():
+            values.extend(plan_values(value, key))
+    elif isinstance(plan, list):
+        for value in plan:
+            values.extend(plan_values(value, key))
+    return values
+
+
+async def explain_hot_queries(database):
+    results = []
+    for name, query in HOT_QUERIES:
+        explain = await database[name].find(query).explain()
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = plan_values(winning_plan, "stage")
+        results.append({
+            "collection": name,
+            "filter": json.dumps(query, default=str),
+            "stages": stages,
+            "indexes": plan_values(winning_plan, "indexName"),
+            "collscan": "COLLSCAN" in stages,
+        })
+    return {"collscans": sum(r["collscan"] for r in results), "queries": results}
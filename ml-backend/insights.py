@@ -0,0 +1,172 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from forecasting import SEASON_LENGTH, fit_linear_batch
+from metrics import timed_fit
+from reorder import DAYS_PER_PERIOD, number
+from sales_store import series_matrix
+
+# Slope (units per period) beyond which demand counts as rising or falling
+TREND_SLOPE = 5
+# Series written this long before a refresh started are read again by the next one, in case they committed late
+REFRESH_LAG = timedelta(seconds=5)
+LEVELS = ("High", "Medium", "Low")
+# Share of the trend residual explained by a repeating yearly profile
+SEASONALITY_LEVELS = ((0.6, "Strong"), (0.3, "Moderate"), (0.0, "Weak"))
+RECOMMENDATIONS = {
+    "Increasing": "Consider increasing stock by 15-25%",
+    "Decreasing": "Consider reducing orders by 20-40%",
+    "Stable": "Maintain current stock levels",
+}
+
+
+def insight_stats(matrix, lengths):
+    """Trend, demand level and fit quality for every row, as one array per statistic.
+
+    ``confidence`` (0-100) falls as the residual error of the linear fit
+    grows relative to mean demand; ``growth`` is the slope relative to mean
+    demand and ``forecast`` the next period's fitted demand. ``seasonality``
+    is the share of the residual a yearly profile explains, or NaN with less
+    than two years of history.
+    """
+    intercepts, slopes = fit_linear_batch(matrix, lengths)
+    n = lengths.astype(np.float64)
+    t = np.arange(matrix.shape[1], dtype=np.float64)
+    observed = t < n[:, None]
+    mean = np.divide(np.where(observed, matrix, 0).sum(axis=1), n, out=np.zeros_like(n), where=n > 0)
+    latest = matrix[np.arange(len(lengths)), np.maximum(lengths - 1, 0)] if matrix.shape[1] else np.zeros_like(n)
+
+    residuals = np.where(observed, matrix - (intercepts[:, None] + slopes[:, None] * t), 0)
+    rmse = np.sqrt((residuals ** 2).sum(axis=1) / np.maximum(n - 2, 1))
+    scale = np.maximum(np.abs(mean), 1e-9)
+
+    # Average residual per month of the year, then how much of the residual variance it removes
+    month = t.astype(np.int64) % SEASON_LENGTH
+    sums = np.zeros((len(lengths), SEASON_LENGTH))
+    counts = np.zeros((len(lengths), SEASON_LENGTH))
+    for column in range(SEASON_LENGTH):
+        sums[:, column] = residuals[:, column::SEASON_LENGTH].sum(axis=1)
+        counts[:, column] = observed[:, column::SEASON_LENGTH].sum(axis=1)
+    profile = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    remainder = np.where(observed, residuals - profile[:, month], 0)
+    total = (residuals ** 2).sum(axis=1)
+    unexplained = np.divide((remainder ** 2).sum(axis=1), total, out=np.ones_like(total), where=total > 0)
+    # Adjusted for the 12 fitted monthly means, so pure noise scores around zero
+    explained = 1 - unexplained * (n - 1) / np.maximum(n - SEASON_LENGTH, 1)
+    seasonality = np.where(lengths >= 2 * SEASON_LENGTH, np.clip(explained, 0, 1), np.nan)
+    return {
+        "fitted": lengths >= 2,
+        "slope": slopes,
+        "growth": slopes / scale,
+        "level": np.select([latest > mean * 1.2, latest < mean * 0.8], [0, 2], 1),
+        "confidence": np.round(100 * np.clip(1 - rmse / scale, 0, 1)),
+        "forecast": np.maximum(intercepts + slopes * n, 0),
+        "seasonality": seasonality,
+    }
+
+
+class InsightTable:
+    """Fit statistics for every stored sales series, kept in memory and refreshed incrementally.
+
+    The first refresh fits every series; later ones only refit the series
+    written since the previous refresh (by ``updated_at``).
+    """
+
+    def __init__(self):
+        self.rows = {}  # product_id -> row in every stats array
+        self.stats = {}
+        self.through = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, repo):
+        """Refit the series changed since the last refresh; returns how many were refit."""
+        async with self._lock:
+            started = datetime.now(timezone.utc)
+            # Reads from a secondary can be up to its staleness behind
+            lag = REFRESH_LAG + timedelta(seconds=repo.staleness_seconds)
+            query = {} if self.through is None else {"updated_at": {"$gte": self.through - lag}}
+            docs = await repo.sales_series.find(query, {"dtype": 1, "sales": 1}).to_list()
+            if docs:
+                matrix, lengths = series_matrix(docs)
+                stats = await run_in_threadpool(timed_fit, "insights", len(docs), insight_stats, matrix, lengths)
+                self._store([doc["_id"] for doc in docs], stats)
+            self.through = started
+            return len(docs)
+
+    def _store(self, ids, stats):
+        positions = np.fromiter((self.rows.setdefault(pid, len(self.rows)) for pid in ids), dtype=np.int64, count=len(ids))
+        for name, values in stats.items():
+            current = self.stats.get(name, np.zeros(0, dtype=values.dtype))
+            if len(current) < len(self.rows):
+                current = np.concatenate([current, np.zeros(len(self.rows) - len(current), dtype=values.dtype)])
+            current[positions] = values
+            self.stats[name] = current
+
+
+def top_k(scores, k):
+    """Indices of the ``k`` highest scores, highest first, without sorting the rest."""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+async def ranked_insights(repo, table, rank="movers", limit=10, category=None, supplier=None):
+    """The ``limit`` products with the biggest demand trends (``movers``) or least stock cover (``stockout``).
+
+    Stock cover is current stock over the next period's forecast demand, in days.
+    """
+    await table.refresh(repo)
+    if not table.stats:
+        return []
+    query = {}
+    if category is not None:
+        query["category"] = category
+    if supplier is not None:
+        query["supplier"] = supplier
+    products = await repo.products.find(query, {"name": 1, "stock": 1}).to_list()
+
+    rows = np.fromiter((table.rows.get(p["_id"], -1) for p in products), dtype=np.int64, count=len(products))
+    known = np.flatnonzero(rows >= 0)
+    known = known[table.stats["fitted"][rows[known]]]
+    rows = rows[known]
+    stats = {name: values[rows] for name, values in table.stats.items()}
+    stock = np.array([number(products[i].get("stock")) for i in known], dtype=np.float64)
+    daily_demand = stats["forecast"] / DAYS_PER_PERIOD
+    cover = np.divide(stock, daily_demand, out=np.full(len(rows), np.inf), where=daily_demand > 0)
+
+    if rank == "stockout":
+        # Only products expected to sell can run out
+        candidates = np.flatnonzero(np.isfinite(cover))
+        selected = candidates[top_k(-np.maximum(cover[candidates], 0), limit)]
+    else:
+        selected = top_k(np.abs(stats["growth"]), limit)
+
+    insights = []
+    for i in selected.tolist():
+        product = products[known[i]]
+        slope = stats["slope"][i]
+        trend = "Increasing" if slope > TREND_SLOPE else "Decreasing" if slope < -TREND_SLOPE else "Stable"
+        insights.append({
+            "product_id": str(product["_id"]),
+            "product": product.get("name"),
+            "currentDemand": LEVELS[int(stats["level"][i])],
+            "predictedTrend": trend,
+            "seasonality": seasonality_label(stats["seasonality"][i]),
+            "recommendation": RECOMMENDATIONS[trend],
+            "confidence": int(stats["confidence"][i]),
+            "growth": round(float(stats["growth"][i]), 4),
+            "forecast": round(float(stats["forecast"][i]), 2),
+            "daysOfCover": round(float(cover[i]), 1) if np.isfinite(cover[i]) else None,
+        })
+    return insights
+
+
+def seasonality_label(strength):
+    if np.isnan(strength):
+        return "N/A"
+    return next(label for threshold, label in SEASONALITY_LEVELS if strength >= threshold)
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+MAX_RUNNING_JOBS = os.cpu_count() or 1
+MAX_QUEUED_JOBS = 100
+JOB_RETENTION_SECONDS = 3600
+MAX_RETAINED_JOBS = 1000
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = "queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+        self.expires_at = None  # monotonic deadline, set once finished
+        self.task = None
+
+    def report(self, done, total):
+        """Progress callback handed to the job's work: ``done`` out of ``total`` units."""
+        if total:
+            self.progress = round(min(done / total, 1.0), 4)
+
+    def to_dict(self):
+        doc = {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "succeeded":
+            doc["result"] = self.result
+        elif self.status == "failed":
+            doc["error"] = self.error
+        return doc
+
+
+class JobQueue:
+    """Runs heavy analytics in the background and keeps their results for polling.
+
+    ``submit`` returns at once with a ``Job``; at most ``max_running`` jobs
+    run at a time and the rest wait in line, up to ``max_queued``. An
+    identical job (same kind and parameters) that is still queued or running
+    is returned instead of starting another. Finished jobs are kept for
+    ``retention`` seconds, and the oldest are evicted beyond ``max_retained``.
+    Jobs live in this process only.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS,
+                 retention=JOB_RETENTION_SECONDS, max_retained=MAX_RETAINED_JOBS):
+        self.max_queued = max_queued
+        self.retention = retention
+        self.max_retained = max_retained
+        self._jobs = OrderedDict()  # id -> Job, oldest first
+        self._in_flight = {}  # (kind, params) -> Job
+        self._slots = asyncio.Semaphore(max_running)
+
+    def submit(self, kind, params, run):
+        """Start ``run(progress)`` as a job, or return the identical job already in flight.
+
+        ``progress`` is a ``(done, total)`` callback the work may call as it goes.
+        Raises JobQueueFull when ``max_queued`` jobs are already waiting.
+        """
+        self.evict()
+        key = (kind, tuple(sorted(params.items())))
+        job = self._in_flight.get(key)
+        if job is not None:
+            return job
+        if sum(job.status == "queued" for job in self._in_flight.values()) >= self.max_queued:
+            raise JobQueueFull(f"{self.max_queued} jobs are already waiting")
+        job = Job(kind, key)
+        self._jobs[job.id] = job
+        self._in_flight[key] = job
+        job.task = asyncio.create_task(self._run(job, run))
+        return job
+
+    def get(self, job_id):
+        self.evict()
+        return self._jobs.get(job_id)
+
+    async def _run(self, job, run):
+        try:
+            async with self._slots:
+                job.status = "running"
+                job.started_at = datetime.now(timezone.utc)
+                job.result = await run(job.report)
+            job.status = "succeeded"
+            job.progress = 1.0
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "Cancelled"
+            raise
+        except Exception as exc:
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+            job.status = "failed"
+            job.error = str(exc) or type(exc).__name__
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+            job.expires_at = time.monotonic() + self.retention
+            self._in_flight.pop(job.key, None)
+            job.task = None
+
+    def evict(self):
+        now = time.monotonic()
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATUSES]
+        excess = len(self._jobs) - self.max_retained
+        for job in finished:
+            if job.expires_at <= now or excess > 0:
+                del self._jobs[job.id]
+                excess -= 1
+
+    def shutdown(self):
+        for job in list(self._in_flight.values()):
+            if job.task is not None:
+                job.task.cancel()
@@ -0,0 +1,26 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Register module ``name`` without running it; its code runs on first attribute access.
+
+    ``from name import x`` anywhere also counts as an access, so callers that
+    want to stay lazy use ``module.x``.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(*modules):
+    """Run lazily imported modules now, e.g. to take their import cost at startup."""
+    for module in modules:
+        getattr(module, "__doc__")
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from products import update_pipeline
+from reservations import FULFILLED_ORDER_STATUSES
+
+logger = logging.getLogger(__name__)
+
+LEDGER_RETENTION_DAYS = 90
+COMPACTION_INTERVAL_SECONDS = 3600
+SNAPSHOT_STATE_ID = "state"
+# Entry kinds that also change the product's total stock; the others move stock between or out of warehouses
+STOCK_CHANGING_KINDS = ("receipt", "adjustment")
+
+
+def merge_lines(lines):
+    """Sum ``(product_id, warehouse_id, kind, quantity)`` tuples into sorted ledger lines."""
+    totals = {}
+    for product_id, warehouse_id, kind, quantity in lines:
+        key = (product_id, warehouse_id, kind)
+        totals[key] = totals.get(key, 0) + quantity
+    return [
+        {"product_id": product_id, "warehouse_id": warehouse_id, "kind": kind, "quantity": quantity}
+        for (product_id, warehouse_id, kind), quantity in sorted(totals.items(), key=lambda item: tuple(map(str, item[0])))
+        if quantity
+    ]
+
+
+def item_lines(items, warehouse_id, kind, sign):
+    lines = []
+    for item in items:
+        try:
+            product_id = ObjectId(item["product_id"])
+        except Exception:
+            continue
+        lines.append((product_id, warehouse_id, kind, sign * item["quantity"]))
+    return lines
+
+
+async def shipment_lines(repo, shipment):
+    # A received shipment brings in its purchase order's items
+    if shipment.get("status") != "received" or not shipment.get("warehouse_id"):
+        return []
+    try:
+        order = await repo.purchase_orders.get(ObjectId(shipment["purchase_order_id"]), {"items": 1})
+    except Exception:
+        return []
+    return merge_lines(item_lines(order["items"], shipment["warehouse_id"], "receipt", 1)) if order else []
+
+
+async def transfer_lines(repo, transfer):
+    if transfer.get("status") != "completed":
+        return []
+    items = transfer.get("items", [])
+    return merge_lines(
+        item_lines(items, transfer["from_warehouse"], "transfer_out", -1)
+        + item_lines(items, transfer["to_warehouse"], "transfer_in", 1)
+    )
+
+
+async def order_lines(repo, order):
+    # Stock leaves the fulfilling warehouse when the order ships
+    if order.get("status") not in FULFILLED_ORDER_STATUSES or not order.get("warehouse_id"):
+        return []
+    return merge_lines(item_lines(order.get("items", []), order["warehouse_id"], "fulfilment", -1))
+
+
+# Repository collection -> coroutine building a document's ledger lines from its current state
+LINE_BUILDERS = {
+    "shipments": shipment_lines,
+    "stock_transfers": transfer_lines,
+    "orders": order_lines,
+}
+
+
+def line_entries(posted, desired, source):
+    """Ledger entries that take a document from its ``posted`` lines to its ``desired`` ones."""
+    posted = {(line["product_id"], line["warehouse_id"], line["kind"]): line["quantity"] for line in posted}
+    desired = {(line["product_id"], line["warehouse_id"], line["kind"]): line["quantity"] for line in desired}
+    entries = []
+    for key in sorted(posted.keys() | desired.keys(), key=lambda key: tuple(map(str, key))):
+        product_id, warehouse_id, kind = key
+        change = desired.get(key, 0) - posted.get(key, 0)
+        if not change:
+            continue
+        # Undoing a line (e.g. a shipment un-received) is recorded as its reversal
+        direction = desired.get(key) or posted.get(key)
+        if change * direction < 0:
+            kind += "_reversal"
+        entries.append({"product_id": product_id, "warehouse_id": warehouse_id, "kind": kind, "quantity": change, "source": source})
+    return entries
+
+
+async def product_prices(repo, product_ids):
+    cursor = repo.products.find({"_id": {"$in": list(product_ids)}}, {"price": 1})
+    return {doc["_id"]: doc.get("price") or 0 async for doc in cursor}
+
+
+async def post_entries(repo, entries):
+    """Append ``entries`` to the ledger and apply them to positions, warehouse totals and product stock.
+
+    Warehouse value moves at the product's price when the entry is posted;
+    ``reconcile_positions`` revalues at current prices.
+    """
+    if not entries:
+        return
+    now = datetime.now(timezone.utc)
+    for entry in entries:
+        entry["at"] = now
+    await repo.inventory_ledger.insert_many(entries)
+
+    positions, warehouses, products = {}, {}, {}
+    prices = await product_prices(repo, {entry["product_id"] for entry in entries})
+    for entry in entries:
+        product_id, warehouse_id, quantity = entry["product_id"], entry["warehouse_id"], entry["quantity"]
+        positions[(product_id, warehouse_id)] = positions.get((product_id, warehouse_id), 0) + quantity
+        units, value = warehouses.get(warehouse_id, (0, 0.0))
+        warehouses[warehouse_id] = (units + quantity, value + quantity * prices.get(product_id, 0))
+        if entry["kind"].removesuffix("_reversal") in STOCK_CHANGING_KINDS:
+            products[product_id] = products.get(product_id, 0) + quantity
+
+    await repo.stock_positions.bulk_write([
+        # Unique on (product_id, warehouse_id), so racing upserts of a new position are retried by the server
+        UpdateOne({"product_id": product_id, "warehouse_id": warehouse_id}, {"$inc": {"on_hand": quantity}}, upsert=True)
+        for (product_id, warehouse_id), quantity in positions.items()
+    ], ordered=False)
+    await repo.warehouse_stock.bulk_write([
+        UpdateOne({"_id": warehouse_id}, {"$inc": {"units": units, "value": value}}, upsert=True)
+        for warehouse_id, (units, value) in warehouses.items()
+    ], ordered=False)
+    if products:
+        await repo.products.bulk_write(
+            [UpdateOne({"_id": product_id}, update_pipeline({}, quantity)) for product_id, quantity in products.items()],
+            ordered=False,
+        )
+
+
+async def sync_ledger(repo, name, doc_id):
+    """Post whatever changed in a shipment, transfer or order's ledger lines since they were last posted.
+
+    The posted lines are kept on the document as ``ledger_lines`` and swapped
+    with a compare-and-set, so each change is posted once however many
+    writers race. Call it after every write to the document.
+    """
+    collection = getattr(repo, name)
+    doc = await collection.get(doc_id)
+    if doc is None:
+        return
+    desired = await LINE_BUILDERS[name](repo, doc)
+    posted = doc.get("ledger_lines")
+    if desired == (posted or []):
+        return
+    guard = {"$exists": False} if posted is None else posted
+    result = await collection.update_one({"_id": doc_id, "ledger_lines": guard}, {"$set": {"ledger_lines": desired}})
+    if result.matched_count:
+        await post_entries(repo, line_entries(posted or [], desired, {"collection": name, "id": doc_id}))
+
+
+async def reverse_deleted(repo, name, deleted):
+    """Reverse the lines a deleted document had posted; ``deleted`` must include ``ledger_lines``."""
+    if deleted.get("ledger_lines"):
+        await post_entries(repo, line_entries(deleted["ledger_lines"], [], {"collection": name, "id": deleted["_id"]}))
+
+
+async def adjust(repo, product_id, warehouse_id, quantity, reason=None):
+    entry = {"product_id": product_id, "warehouse_id": warehouse_id, "kind": "adjustment", "quantity": quantity,
+             "source": {"reason": reason}}
+    await post_entries(repo, [entry])
+    return entry
+
+
+# --- Snapshots ---
+# A snapshot generation holds every position's balance as of ``through`` (a ledger _id); the state document
+# points at the current generation. Balance = current snapshot + ledger entries from ``through`` on.
+
+async def snapshot_through(repo):
+    state = await repo.stock_snapshots.find_one({"_id": SNAPSHOT_STATE_ID})
+    return state["current"] if state else None
+
+
+async def ledger_balances(repo, through=None, until=None):
+    """``(product_id, warehouse_id) -> on_hand`` from snapshot ``through`` plus the entries in [through, until)."""
+    balances = {}
+    if through is not None:
+        async for doc in repo.stock_snapshots.find({"through": through}):
+            balances[(doc["product_id"], doc["warehouse_id"])] = doc["on_hand"]
+    id_range = {}
+    if through is not None:
+        id_range["$gte"] = through
+    if until is not None:
+        id_range["$lt"] = until
+    rows = await repo.inventory_ledger.aggregate_list([
+        {"$match": {"_id": id_range} if id_range else {}},
+        {"$group": {"_id": {"product_id": "$product_id", "warehouse_id": "$warehouse_id"}, "quantity": {"$sum": "$quantity"}}},
+    ])
+    for row in rows:
+        key = (row["_id"]["product_id"], row["_id"]["warehouse_id"])
+        balances[key] = balances.get(key, 0) + row["quantity"]
+    return balances
+
+
+async def compact(repo, retention_days=LEDGER_RETENTION_DAYS, now=None):
+    """Fold ledger entries older than ``retention_days`` into a new snapshot generation and drop them.
+
+    Every step can be rerun: the new generation is written with absolute
+    balances before the state flips to it, and old generations and entries are
+    only deleted afterwards.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = ObjectId.from_datetime(now - timedelta(days=retention_days))
+    through = await snapshot_through(repo)
+    if through is not None and through >= cutoff:
+        return {"through": through.generation_time, "positions": 0, "entries_removed": 0}
+
+    balances = await ledger_balances(repo, through, cutoff)
+    if balances:
+        await repo.stock_snapshots.bulk_write([
+            UpdateOne(
+                {"through": cutoff, "product_id": product_id, "warehouse_id": warehouse_id},
+                {"$set": {"on_hand": on_hand}},
+                upsert=True,
+            )
+            for (product_id, warehouse_id), on_hand in balances.items()
+        ], ordered=False)
+    await repo.stock_snapshots.update_one({"_id": SNAPSHOT_STATE_ID}, {"$set": {"current": cutoff}}, upsert=True)
+    await repo.stock_snapshots.delete_many({"through": {"$exists": True, "$ne": cutoff}})
+    removed = await repo.inventory_ledger.delete_many({"_id": {"$lt": cutoff}})
+    return {"through": cutoff.generation_time, "positions": len(balances), "entries_removed": removed.deleted_count}
+
+
+async def reconcile_positions(repo):
+    """Rebuild positions from the snapshot and ledger, and revalue warehouses at current prices.
+
+    Positions are overwritten wherever they drifted from the ledger. Entries
+    posted while this runs can be miscounted, so run it when writes are quiet.
+    """
+    balances = await ledger_balances(repo, await snapshot_through(repo))
+    current = {}
+    async for doc in repo.stock_positions.find({}, {"product_id": 1, "warehouse_id": 1, "on_hand": 1}):
+        current[(doc["product_id"], doc["warehouse_id"])] = doc["on_hand"]
+    drift = {key: balances.get(key, 0) - current.get(key, 0) for key in balances.keys() | current.keys()
+             if balances.get(key, 0) != current.get(key, 0)}
+    if drift:
+        logger.warning("Stock positions drifted from the ledger at %d position(s); corrected", len(drift))
+        await repo.stock_positions.bulk_write([
+            UpdateOne(
+                {"product_id": product_id, "warehouse_id": warehouse_id},
+                {"$set": {"on_hand": balances.get((product_id, warehouse_id), 0)}},
+                upsert=True,
+            )
+            for product_id, warehouse_id in drift
+        ], ordered=False)
+
+    prices = await product_prices(repo, {product_id for product_id, _ in balances})
+    warehouses = {}
+    for (product_id, warehouse_id), on_hand in balances.items():
+        units, value = warehouses.get(warehouse_id, (0, 0.0))
+        warehouses[warehouse_id] = (units + on_hand, value + on_hand * prices.get(product_id, 0))
+    await repo.warehouse_stock.delete_many({"_id": {"$nin": list(warehouses)}})
+    if warehouses:
+        await repo.warehouse_stock.bulk_write([
+            UpdateOne({"_id": warehouse_id}, {"$set": {"units": units, "value": value}}, upsert=True)
+            for warehouse_id, (units, value) in warehouses.items()
+        ], ordered=False)
+    return {"positions": len(balances), "drift": [
+        {"product_id": str(product_id), "warehouse_id": warehouse_id, "delta": delta}
+        for (product_id, warehouse_id), delta in drift.items()
+    ]}
+
+
+async def compact_periodically(repo, interval=COMPACTION_INTERVAL_SECONDS):
+    while True:
+        try:
+            await compact(repo)
+        except PyMongoError as exc:
+            logger.warning("Ledger compaction failed: %s", exc)
+        await asyncio.sleep(interval)
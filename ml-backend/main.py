@@ -1,292 +1,375 @@
-from fastapi import FastAPI, UploadFile, File, Request, HTTPException, Body
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException, Body, Query, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import numpy as np
-import pandas as pd
-from pymongo import MongoClient
-from sklearn.linear_model import LinearRegression
 from fastapi.middleware.cors import CORSMiddleware
 from bson import ObjectId
-from fastapi.responses import JSONResponse
-from typing import List, Optional
+from pymongo.errors import PyMongoError
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from typing import List, Literal, Optional, Union
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import json
+import logging
+import os
 import random
 
-app = FastAPI()
+from bulk import bulk_upsert
+from cache import TTLCache
+from etags import ConditionalGetMiddleware, versioned
+from indexes import ensure_indexes, explain_hot_queries
+from jobs import JobQueue, JobQueueFull
+from lazy import lazy_import, load
+from ledger import adjust, compact, compact_periodically, reconcile_positions, reverse_deleted, sync_ledger
+from metrics import CommandMetrics, MetricsMiddleware, PoolMetrics, timed_fit
+from importer import DEFAULT_CHUNK_SIZE, UnsupportedFileType, import_products
+from pagination import NEXT_CURSOR_HEADER, ListParams, list_documents
+from products import coerce_product_fields, compute_status, missing_required_field, update_pipeline
+from repository import repo
+from reservations import (
+    FULFILLED_ORDER_STATUSES,
+    RESERVATION_FIELDS,
+    StockShortage,
+    order_quantities,
+    release,
+    reserve,
+    update_reserved_order,
+)
+from serialization import APIResponse, serialize_document
+from stock_movement import resolve_range, stock_movement
+from summary import increment, read_summary, reconcile, reconcile_periodically, record_change
+from versions import BatchedVersionsMiddleware
+from workers import shutdown_process_pool
+
+# Loaded on first use, so workers that only serve CRUD routes never import numpy or fit anything
+backtests = lazy_import("backtests")
+forecast_models = lazy_import("forecast_models")
+forecasting = lazy_import("forecasting")
+insights = lazy_import("insights")
+reorder = lazy_import("reorder")
+routing = lazy_import("routing")
+sales_store = lazy_import("sales_store")
+ANALYTICS_MODULES = (backtests, forecast_models, forecasting, insights, reorder, routing, sales_store)
+# Load them, and build the reorder plan, at startup instead
+PREWARM_ANALYTICS = os.environ.get("PREWARM_ANALYTICS", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+# Set once /optimize is first asked for; until then the plan isn't kept fresh
+reorder_plan_requested = asyncio.Event()
+
+async def refresh_reorder_plan():
+    if not PREWARM_ANALYTICS:
+        await reorder_plan_requested.wait()
+    await reorder.refresh_periodically(repo.analytics)
+
+# Pool listener per client, for /diagnostics/connection-pools
+pool_metrics = {}
+
+def client_listeners(pool):
+    pool_metrics[pool] = PoolMetrics(pool)
+    return [CommandMetrics(), pool_metrics[pool]]
+
+def analytics_staleness():
+    return repo.analytics.staleness_seconds
+
+@asynccontextmanager
+async def lifespan(app):
+    # MongoDB setup
+    await repo.connect(listeners=client_listeners)
+    try:
+        await ensure_indexes(repo.database)
+    except PyMongoError as exc:
+        # Don't block startup if Mongo isn't reachable yet; indexes are created on the next start
+        logger.warning("Index bootstrap skipped: %s", exc)
+    try:
+        # Checked here so a database with nothing to move doesn't load the series store
+        if await repo.products.find_one({"sales_history": {"$exists": True}}, {"_id": 1}):
+            moved = await sales_store.migrate_embedded_history(repo)
+            if moved:
+                logger.info("Moved %d embedded sales histories to the series store", moved)
+    except PyMongoError as exc:
+        logger.warning("Sales history migration skipped: %s", exc)
+    if PREWARM_ANALYTICS:
+        load(*ANALYTICS_MODULES)
+    # Materializes the supply chain summary now, then corrects drift periodically
+    reconcile_task = asyncio.create_task(reconcile_periodically(repo))
+    # Folds old inventory ledger entries into a snapshot
+    compaction_task = asyncio.create_task(compact_periodically(repo))
+    # Recomputes reorder points and EOQs for the whole catalog
+    reorder_task = asyncio.create_task(refresh_reorder_plan())
+    try:
+        yield
+    finally:
+        reconcile_task.cancel()
+        compaction_task.cancel()
+        reorder_task.cancel()
+        jobs.shutdown()
+        shutdown_process_pool()
+        await repo.close()
+
+# Responses are encoded with orjson, which also converts ObjectIds
+app = FastAPI(lifespan=lifespan, default_response_class=APIResponse)
 
 print("main.py loaded")
 
-# MongoDB setup
-MONGO_URI = "mongodb://localhost:27017"
-client = MongoClient(MONGO_URI)
-db = client["inventory_db"]
-products_collection = db["products"]
-suppliers_collection = db["suppliers"]
-purchase_orders_collection = db["purchase_orders"]
-warehouses_collection = db["warehouses"]
-stock_transfers_collection = db["stock_transfers"]
-shipments_collection = db["shipments"]
-orders_collection = db["orders"]
-deliveries_collection = db["deliveries"]
-
+# Innermost, so collection versions are bumped before a write's response leaves the handler
+app.add_middleware(BatchedVersionsMiddleware, versions=repo.versions)
+# Inside CORS, so 304s still get CORS headers and are timed
+app.add_middleware(ConditionalGetMiddleware, routes=app.router.routes, versions=repo.versions)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Or ["http://localhost:8080"] for more security
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
+# Outermost, so latency includes every other middleware
+app.add_middleware(MetricsMiddleware, routes=app.router.routes)
+
+# Forecast results keyed by (product_id, periods, sales series digest)
+forecast_cache = TTLCache(maxsize=10000, ttl=600)
 
-# Excel import endpoint
+# Catalog-wide analytics requested with ?async=true
+jobs = JobQueue()
+
+def enqueue(kind, params, run):
+    """Submit ``run(progress)`` as a background job and answer 202 with where to poll it."""
+    try:
+        job = jobs.submit(kind, params, run)
+    except JobQueueFull as exc:
+        raise HTTPException(status_code=503, detail=f"Job queue is full: {exc}")
+    url = f"/jobs/{job.id}"
+    return APIResponse({"job_id": job.id, "status": job.status, "url": url}, status_code=202, headers={"Location": url})
+
+def series_digest(sales, periods):
+    digest = hashlib.blake2b(sales.tobytes(), digest_size=16)
+    if periods:
+        digest.update(json.dumps(periods).encode())
+    return digest.hexdigest()
+
+def mock_sales_history():
+    return [{"period": f"Month {i + 1}", "sales": random.randint(50, 199)} for i in range(6)]
+
+# Bulk product import endpoint (Excel, CSV or Parquet), upserted by SKU
 @app.post("/import-excel")
-async def import_excel(file: UploadFile = File(...)):
-    df = pd.read_excel(file.file)
-    records = df.to_dict(orient="records")
-    if records:
-        products_collection.insert_many(records)
-    return {"inserted": len(records)}
+async def import_excel(file: UploadFile = File(...), chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=100000)):
+    try:
+        summary = await import_products(repo.products, file.file, file.filename, chunk_size)
+    except UnsupportedFileType as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if summary["inserted"] or summary["updated"]:
+        forecast_cache.clear()
+    if summary["inserted"]:
+        await increment(repo, "total_products", summary["inserted"])
+    return summary
 
 class ForecastRequest(BaseModel):
     product_id: str
     periods: int = 12 # Number of future periods to forecast
 
 @app.post("/forecast")
-def forecast(req: ForecastRequest):
+async def forecast(req: ForecastRequest):
     try:
         product_id = ObjectId(req.product_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid product ID format")
 
-    product = products_collection.find_one({"_id": product_id})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-
-    if "sales_history" not in product or not product["sales_history"]:
+    # A stored series implies the product exists; only check the product when there isn't one
+    ids, matrix, lengths, periods = await sales_store.load_series(repo, [product_id])
+    if not ids:
+        if not await repo.products.get(product_id, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Product not found")
         # Generate and save mock sales history if it doesn't exist
-        sales_history = [
-            {"period": "Month 1", "sales": np.random.randint(50, 200)},
-            {"period": "Month 2", "sales": np.random.randint(50, 200)},
-            {"period": "Month 3", "sales": np.random.randint(50, 200)},
-            {"period": "Month 4", "sales": np.random.randint(50, 200)},
-            {"period": "Month 5", "sales": np.random.randint(50, 200)},
-            {"period": "Month 6", "sales": np.random.randint(50, 200)},
-        ]
-        products_collection.update_one({"_id": product["_id"]}, {"$set": {"sales_history": sales_history}})
-        product["sales_history"] = sales_history
-        
-    sales_history = product["sales_history"]
-    if len(sales_history) < 2:
-        raise HTTPException(status_code=400, detail="Not enough sales history to forecast")
+        series = await sales_store.save_history(repo, product_id, mock_sales_history())
+        await backtests.refresh_backtest(repo, product_id, series)
+        await forecast_models.refresh_model(repo, product_id, series)
+        matrix, lengths = sales_store.series_matrix([series])
+        periods = [series.get("periods")]
 
-    # Simple linear regression model
-    X = np.arange(len(sales_history)).reshape(-1, 1)
-    y = np.array([item['sales'] for item in sales_history])
-    
-    model = LinearRegression()
-    model.fit(X, y)
-    
-    # Generate future periods for prediction
-    future_periods_start = len(sales_history)
-    future_periods_end = future_periods_start + req.periods
-    future_X = np.arange(future_periods_start, future_periods_end).reshape(-1, 1)
-    
-    predictions = model.predict(future_X)
-
-    # Combine historical and predicted data for the chart
-    chart_data = []
-    for i, item in enumerate(sales_history):
-        chart_data.append({"period": item["period"], "actual": item["sales"], "predicted": None})
-    
-    for i, pred in enumerate(predictions):
-        # Assuming periods are monthly
-        chart_data.append({"period": f"Month {future_periods_start + i + 1}", "actual": None, "predicted": float(pred)})
-
-    return {"chart_data": chart_data}
-
-def get_trend(model):
-    slope = model.coef_[0]
-    if slope > 5:
-        return "Increasing"
-    elif slope < -5:
-        return "Decreasing"
-    else:
-        return "Stable"
-
-def get_demand_level(sales_history):
-    if not sales_history:
-        return "Unknown"
-    sales = [item['sales'] for item in sales_history]
-    avg_sales = np.mean(sales)
-    latest_sale = sales[-1]
-    if latest_sale > avg_sales * 1.2:
-        return "High"
-    elif latest_sale < avg_sales * 0.8:
-        return "Low"
-    else:
-        return "Medium"
+    if lengths[0] < 2:
+        raise HTTPException(status_code=400, detail="Not enough sales history to forecast")
 
-def get_recommendation(trend):
-    if trend == "Increasing":
-        return "Consider increasing stock by 15-25%"
-    elif trend == "Decreasing":
-        return "Consider reducing orders by 20-40%"
+    cache_key = (str(product_id), req.periods, series_digest(matrix[0], periods[0]))
+    cached = forecast_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Evaluates the model selected for this product (fitted now if it has none yet)
+    models, level, trend, season = await forecast_models.load_models(repo, [product_id], matrix, lengths)
+    labels = [sales_store.period_labels(periods[0], int(lengths[0]))]
+    chart_data = timed_fit("forecast", 1, forecasting.model_chart_data, matrix, lengths, labels, level, trend, season, req.periods)[0]
+    result = {"chart_data": chart_data, "model": models[0]}
+    forecast_cache.set(cache_key, result, tag=str(product_id))
+    return result
+
+@app.get("/forecast/models/{product_id}")
+@versioned("forecast_models")
+async def get_forecast_model(product_id: str):
+    try:
+        obj_id = ObjectId(product_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Product not found")
+    model = await repo.forecast_models.get(obj_id, {"_id": 0})
+    if not model:
+        raise HTTPException(status_code=404, detail="No forecast model for this product")
+    return model
+
+async def refit_models(progress=None):
+    result = await forecast_models.fit_all_models(repo, progress)
+    # Cached forecasts were made with the models just replaced
+    forecast_cache.clear()
+    return result
+
+@app.post("/forecast/models/refit")
+async def refit_forecast_models(run_async: bool = Query(False, alias="async")):
+    if run_async:
+        return enqueue("forecast_models_refit", {}, refit_models)
+    return await refit_models()
+
+@app.get("/forecast/cache-stats")
+async def forecast_cache_stats():
+    return forecast_cache.stats()
+
+class BatchForecastRequest(BaseModel):
+    product_ids: Union[Literal["all"], List[str]] = "all"
+    periods: int = 12
+
+@app.post("/forecast/batch")
+async def forecast_batch(req: BatchForecastRequest):
+    if req.product_ids == "all":
+        product_ids = None
     else:
-        return "Maintain current stock levels"
+        try:
+            product_ids = [ObjectId(pid) for pid in req.product_ids]
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid product ID format")
+
+    # Series with fewer than two points can't be fit
+    ids, matrix, lengths, periods = await sales_store.load_series(repo, product_ids, min_length=2)
+    found = {str(pid) for pid in ids}
+    skipped = [] if product_ids is None else [pid for pid in req.product_ids if pid not in found]
+    if not ids:
+        return {"forecasts": {}, "skipped": skipped}
+
+    models, level, trend, season = await forecast_models.load_models(repo, ids, matrix, lengths)
+    # Catalog-sized; keep it off the event loop
+    labels = [sales_store.period_labels(p, int(n)) for p, n in zip(periods, lengths)]
+    charts = await run_in_threadpool(
+        timed_fit, "forecast_batch", len(ids), forecasting.model_chart_data, matrix, lengths, labels, level, trend, season, req.periods
+    )
+    forecasts = {str(pid): {"chart_data": chart_data, "model": model} for pid, chart_data, model in zip(ids, charts, models)}
+    # Catalog-sized; skip the jsonable_encoder walk
+    return APIResponse({"forecasts": forecasts, "skipped": skipped})
+
+# Per-product trend fits, refit only where the sales history changed
+_insight_table = None
+
+def insight_table():
+    global _insight_table
+    if _insight_table is None:
+        _insight_table = insights.InsightTable()
+    return _insight_table
 
 @app.get("/insights")
-def get_demand_insights():
-    products_with_history = list(products_collection.find(
-        {"sales_history": {"$exists": True, "$not": {"$size": 0}}},
-        {"_id": 0}
-    ).limit(3))
-
-    if not products_with_history:
-        return []
-
-    insights = []
-    for product in products_with_history:
-        sales_history = product["sales_history"]
-        if len(sales_history) < 2:
-            continue
-        
-        X = np.arange(len(sales_history)).reshape(-1, 1)
-        y = np.array([item['sales'] for item in sales_history])
-        
-        model = LinearRegression()
-        model.fit(X, y)
-
-        trend = get_trend(model)
-        
-        insight = {
-            "product": product["name"],
-            "currentDemand": get_demand_level(sales_history),
-            "predictedTrend": trend,
-            "seasonality": "N/A", 
-            "recommendation": get_recommendation(trend),
-            "confidence": np.random.randint(85, 98)
-        }
-        insights.append(insight)
-        
-    return insights
+@versioned("products", "sales_series", cache_body=True, stale_for=analytics_staleness)
+async def get_demand_insights(
+    rank: Literal["movers", "stockout"] = "movers",
+    limit: int = Query(10, ge=1, le=1000),
+    category: Optional[str] = None,
+    supplier: Optional[str] = None,
+    run_async: bool = Query(False, alias="async"),
+):
+    if run_async:
+        params = {"rank": rank, "limit": limit, "category": category, "supplier": supplier}
+        return enqueue("insights", params, lambda progress: insights.ranked_insights(repo.analytics, insight_table(), **params))
+    return await insights.ranked_insights(repo.analytics, insight_table(), rank, limit, category, supplier)
+
+# Missing stock fields count as zero, like p.get("stock", 0)
+STOCK_LEVELS_PROJECTION = {
+    "name": 1,
+    "category": {"$ifNull": ["$category", "Uncategorized"]},
+    "stock": {"$ifNull": ["$stock", 0]},
+    "min_stock": {"$ifNull": ["$min_stock", 0]},
+    "price": {"$ifNull": ["$price", 0]},
+    "optimal_stock": {"$multiply": [{"$ifNull": ["$min_stock", 0]}, 1.5]},  # Simple heuristic
+}
 
 @app.get("/optimize")
-def get_optimization_data():
-    products = list(products_collection.find({}))
-    
-    # Chart data aggregation
-    category_data = {}
+@versioned(stamp=lambda: reorder.plan_versions(), cache_body=True, stale_for=analytics_staleness)
+async def get_optimization_data(run_async: bool = Query(False, alias="async")):
+    reorder_plan_requested.set()
+    if run_async:
+        # A fresh plan rather than the cached one
+        return enqueue("optimize", {}, lambda progress: reorder.refreshed_payload(repo.analytics))
+    # Served from the plan cached by the background refresh; already encoded
+    plan = await reorder.read_plan(repo.analytics)
+    return Response(plan["body"], media_type="application/json")
+
+@app.post("/optimize/refresh")
+async def refresh_optimization_data():
+    reorder_plan_requested.set()
+    return await reorder.refresh_plan(repo.analytics)
+
+async def attach_sales_history(products):
+    histories = await sales_store.load_histories(repo, [p["_id"] for p in products])
     for p in products:
-        category = p.get("category", "Uncategorized")
-        if category not in category_data:
-            category_data[category] = {"current": 0, "optimal": 0}
-        
-        current_stock = p.get("stock", 0)
-        min_stock = p.get("min_stock", 0)
-        optimal_stock = min_stock * 1.5 # Simple heuristic
-        
-        category_data[category]["current"] += current_stock
-        category_data[category]["optimal"] += optimal_stock
-
-    chart_data = [{"category": cat, **data} for cat, data in category_data.items()]
-
-    # Reorder recommendations
-    reorder_recommendations = []
-    for p in products:
-        current_stock = p.get("stock", 0)
-        min_stock = p.get("min_stock", 0)
-        if current_stock < min_stock:
-            optimal_stock = min_stock * 1.5
-            suggested_order = int(optimal_stock - current_stock)
-            
-            priority = "low"
-            if current_stock < (min_stock * 0.5):
-                priority = "high"
-            elif current_stock < (min_stock * 0.75):
-                priority = "medium"
-            
-            reorder_recommendations.append({
-                "product_id": str(p["_id"]),
-                "product": p["name"],
-                "currentStock": current_stock,
-                "reorderPoint": min_stock,
-                "suggestedOrder": suggested_order,
-                "priority": priority
-            })
-            
-    return {"chart_data": chart_data, "reorder_recommendations": reorder_recommendations}
+        if p["_id"] in histories:
+            p["sales_history"] = histories[p["_id"]]
 
 @app.get("/products")
-def get_products():
-    products = list(products_collection.find({}))
-    for p in products:
-        p["_id"] = str(p["_id"])
-    return products
+@versioned("products", "sales_series")
+async def get_products(params: ListParams = Depends()):
+    # Sales history lives in the series store; join it back per page unless projected out
+    enrich = attach_sales_history if not params.fields or "sales_history" in params.fields else None
+    return await list_documents(repo.products, params, enrich=enrich)
 
 @app.post("/products")
 async def add_product(request: Request):
-    data = await request.json()
-    # Ensure numeric fields are stored as numbers
-    for field in ["stock", "price", "min_stock"]:
-        if field in data:
-            try:
-                data[field] = float(data[field]) if field == "price" else int(data[field])
-            except Exception:
-                pass  # If conversion fails, leave as is
+    data = coerce_product_fields(await request.json())
     # Basic validation for required fields
-    required_fields = ["name", "sku", "category", "stock", "price", "supplier"]
-    for field in required_fields:
-        if field not in data:
-            return {"error": f"Missing required field: {field}"}
+    missing = missing_required_field(data)
+    if missing:
+        return {"error": f"Missing required field: {missing}"}
 
     # Set status based on stock and min_stock
-    stock = data.get("stock", 0)
-    min_stock = data.get("min_stock", 0)
-    if stock <= min_stock / 2:
-        data["status"] = "Critical"
-    elif stock <= min_stock:
-        data["status"] = "Low Stock"
-    else:
-        data["status"] = "In Stock"
-
-    # Add mock sales history if not present
-    if "sales_history" not in data:
-        data["sales_history"] = [
-            {"period": "Month 1", "sales": np.random.randint(50, 200)},
-            {"period": "Month 2", "sales": np.random.randint(50, 200)},
-            {"period": "Month 3", "sales": np.random.randint(50, 200)},
-            {"period": "Month 4", "sales": np.random.randint(50, 200)},
-            {"period": "Month 5", "sales": np.random.randint(50, 200)},
-            {"period": "Month 6", "sales": np.random.randint(50, 200)},
-        ]
-
-    products_collection.insert_one(data)
+    data["status"] = compute_status(data.get("stock", 0), data.get("min_stock", 0))
+
+    # Add mock sales history if not present; it's stored in the series store, not the product
+    sales_history = data.pop("sales_history") if "sales_history" in data else mock_sales_history()
+    try:
+        series = sales_store.pack_history(sales_history)
+    except ValueError as exc:
+        return {"error": str(exc)}
+
+    await repo.products.insert(data)
+    await record_change(repo, "products", None, data)
+    await sales_store.save_series(repo, data["_id"], series)
+    await backtests.refresh_backtest(repo, data["_id"], series)
+    await forecast_models.refresh_model(repo, data["_id"], series)
     # Return the inserted product (without _id)
     data.pop("_id", None)
+    data["sales_history"] = sales_store.to_history(series)
     return {"message": "Product added successfully", "product": data}
 
 @app.get("/stock-movement")
-def get_stock_movement():
-    products = list(products_collection.find({}, {"_id": 0}))
-    months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
-    movement = {m: {"inStock": 0, "sold": 0, "restocked": 0} for m in months}
-
-    for p in products:
-        # Simulate monthly stock, sales, and restocking from sales_history if available
-        sales_history = p.get("sales_history", [])
-        for i, month in enumerate(months):
-            if i < len(sales_history):
-                movement[month]["sold"] += sales_history[i]["sales"]
-                # Simulate restocking as a random value (or 0 if not available)
-                movement[month]["restocked"] += np.random.randint(20, 80)
-                # Simulate inStock as last known stock or sum
-                movement[month]["inStock"] += max(0, p.get("stock", 0) - sales_history[i]["sales"] + movement[month]["restocked"])
-            else:
-                # If not enough history, just use current stock
-                movement[month]["inStock"] += p.get("stock", 0)
-
-    # Convert to list for chart
-    chart_data = []
-    for m in months:
-        chart_data.append({"month": m, **movement[m]})
-    return chart_data 
+@versioned(
+    "products", "orders", "shipments", "purchase_orders", "stock_transfers", "warehouse_stock",
+    cache_body=True, stale_for=analytics_staleness,
+)
+async def get_stock_movement(
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    warehouse_id: Optional[str] = None,
+):
+    try:
+        start, end = resolve_range(start, end)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # Repeats are replayed by ConditionalGetMiddleware until one of these collections is written
+    return await stock_movement(repo.analytics, start, end, warehouse_id)
 
 @app.put("/products/{product_id}")
 async def update_product(product_id: str, data: dict = Body(...)):
@@ -295,75 +378,112 @@ async def update_product(product_id: str, data: dict = Body(...)):
     except Exception:
         raise HTTPException(status_code=404, detail="Product not found")
     data.pop("_id", None)  # Remove _id if present to avoid immutable field error
-    # Set status based on stock and min_stock
-    stock = data.get("stock", 0)
-    min_stock = data.get("min_stock", 0)
-    if stock <= min_stock / 2:
-        data["status"] = "Critical"
-    elif stock <= min_stock:
-        data["status"] = "Low Stock"
-    else:
-        data["status"] = "In Stock"
-    result = products_collection.update_one({"_id": obj_id}, {"$set": data})
-    if result.matched_count == 0:
+    data.pop("status", None)
+    series = None
+    if "sales_history" in data:
+        try:
+            series = sales_store.pack_history(data.pop("sales_history"))
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+    coerce_product_fields(data)
+    # A relative change applied atomically, unlike "stock", which overwrites concurrent reservations
+    adjustment = data.pop("stock_adjustment", None)
+    if adjustment is not None:
+        if "stock" in data or not isinstance(adjustment, int):
+            raise HTTPException(status_code=400, detail="stock_adjustment must be an integer and can't be sent with stock")
+    query = {"_id": obj_id}
+    if adjustment and adjustment < 0:
+        query["stock"] = {"$gte": -adjustment}
+    # Status is derived from the stored stock and min_stock in the same update
+    result = await repo.products.update_one(query, update_pipeline(data, adjustment))
+    forecast_cache.invalidate(str(obj_id))
+    if not result.matched_count:
+        if "stock" in query and await repo.products.get(obj_id, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="Insufficient stock for this adjustment")
         raise HTTPException(status_code=404, detail="Product not found")
+    if series is not None:
+        await sales_store.save_series(repo, obj_id, series)
+        await backtests.refresh_backtest(repo, obj_id, series)
+        await forecast_models.refresh_model(repo, obj_id, series)
     return {"message": "Product updated successfully"}
 
-@app.get("/forecast-accuracy")
-def get_forecast_accuracy():
-    products = list(products_collection.find({"sales_history": {"$exists": True, "$not": {"$size": 0}}}))
-    total_accuracy = 0
-    count = 0
-    for product in products:
-        sales_history = product.get("sales_history", [])
-        if len(sales_history) < 3:
-            continue
-        # Use last 3 months for accuracy
-        actuals = [item["sales"] for item in sales_history[-3:]]
-        # Predict last 3 months using earlier data
-        if len(sales_history) > 3:
-            X = np.arange(len(sales_history) - 3).reshape(-1, 1)
-            y = np.array([item['sales'] for item in sales_history[:-3]])
-            model = LinearRegression()
-            model.fit(X, y)
-            future_X = np.arange(len(sales_history) - 3, len(sales_history)).reshape(-1, 1)
-            preds = model.predict(future_X)
-            for actual, pred in zip(actuals, preds):
-                if actual > 0:
-                    acc = 100 - (abs(pred - actual) / actual * 100)
-                    total_accuracy += max(0, min(acc, 100))
-                    count += 1
-    avg_accuracy = round(total_accuracy / count, 2) if count else 0
-    return {"accuracy": avg_accuracy}
+async def forecast_accuracy(window, progress=None):
+    return {"accuracy": await backtests.read_accuracy(repo, window, progress)}
 
-@app.get("/cost-savings")
-def get_cost_savings():
+@app.get("/forecast-accuracy")
+@versioned("backtests", "backtest_totals", cache_body=True)
+async def get_forecast_accuracy(window: int = 3, run_async: bool = Query(False, alias="async")):
+    # Predict the last `window` months from the earlier data; backtests are precomputed per product
+    if window not in forecasting.BACKTEST_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window must be one of {list(forecasting.BACKTEST_WINDOWS)}")
+    if run_async:
+        return enqueue("forecast_accuracy", {"window": window}, lambda progress: forecast_accuracy(window, progress))
+    return await forecast_accuracy(window)
+
+@app.get("/forecast-accuracy/products/{product_id}")
+@versioned("backtests")
+async def get_product_forecast_accuracy(product_id: str):
+    try:
+        obj_id = ObjectId(product_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Product not found")
+    backtest = await repo.backtests.get(obj_id, {"_id": 0})
+    if not backtest:
+        raise HTTPException(status_code=404, detail="No backtest for this product")
+    return backtest
+
+@app.post("/forecast-accuracy/recompute")
+async def recompute_forecast_accuracy(run_async: bool = Query(False, alias="async")):
+    if run_async:
+        return enqueue("forecast_accuracy_recompute", {}, lambda progress: backtests.recompute_all(repo, progress))
+    return await backtests.recompute_all(repo)
+
+async def cost_savings():
     # Simple heuristic: savings from not overstocking and not running out
-    products = list(products_collection.find({}))
-    overstock_savings = 0
-    stockout_savings = 0
-    for p in products:
-        stock = p.get("stock", 0)
-        min_stock = p.get("min_stock", 0)
-        price = p.get("price", 0)
-        # Overstock: if stock > 1.5 * min_stock, assume excess is saved
-        if stock > 1.5 * min_stock:
-            overstock_savings += (stock - 1.5 * min_stock) * price * 0.1  # 10% of value
-        # Stockout: if stock < min_stock, assume lost profit
-        if stock < min_stock:
-            stockout_savings += (min_stock - stock) * price * 0.2  # 20% of value
-    total_savings = int(overstock_savings + stockout_savings)
+    totals = await repo.analytics.products.aggregate_list([
+        {"$project": STOCK_LEVELS_PROJECTION},
+        {"$group": {
+            "_id": None,
+            # Overstock: if stock > 1.5 * min_stock, assume excess is saved (10% of value)
+            "overstock": {"$sum": {"$cond": [
+                {"$gt": ["$stock", "$optimal_stock"]},
+                {"$multiply": [{"$subtract": ["$stock", "$optimal_stock"]}, "$price", 0.1]},
+                0,
+            ]}},
+            # Stockout: if stock < min_stock, assume lost profit (20% of value)
+            "stockout": {"$sum": {"$cond": [
+                {"$lt": ["$stock", "$min_stock"]},
+                {"$multiply": [{"$subtract": ["$min_stock", "$stock"]}, "$price", 0.2]},
+                0,
+            ]}},
+        }},
+    ])
+    if not totals:
+        return {"savings": 0}
+    total_savings = int(totals[0]["overstock"] + totals[0]["stockout"])
     return {"savings": total_savings}
 
+@app.get("/cost-savings")
+@versioned("products", cache_body=True, stale_for=analytics_staleness)
+async def get_cost_savings(run_async: bool = Query(False, alias="async")):
+    if run_async:
+        return enqueue("cost_savings", {}, lambda progress: cost_savings())
+    return await cost_savings()
+
 @app.delete("/products/{product_id}")
-def delete_product(product_id: str):
+async def delete_product(product_id: str):
     try:
         obj_id = ObjectId(product_id)
     except Exception:
         raise HTTPException(status_code=404, detail="Product not found")
-    result = products_collection.delete_one({"_id": obj_id})
-    if result.deleted_count == 0:
+    previous = await repo.products.delete_and_get(obj_id, {"_id": 1})
+    forecast_cache.invalidate(str(obj_id))
+    if previous is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    await record_change(repo, "products", previous, None)
+    await sales_store.delete_history(repo, obj_id)
+    await backtests.remove_backtest(repo, obj_id)
+    await forecast_models.remove_model(repo, obj_id)
     return {"message": "Product deleted successfully"}
 
 # --- SUPPLIER MANAGEMENT ---
@@ -376,38 +496,33 @@ class Supplier(BaseModel):
     reliability_score: float
 
 @app.get("/suppliers")
-def get_suppliers():
-    suppliers = list(suppliers_collection.find())
-    for s in suppliers:
-        s["id"] = str(s["_id"])
-        del s["_id"]
-    return suppliers
+@versioned("suppliers")
+async def get_suppliers(params: ListParams = Depends()):
+    return await list_documents(repo.suppliers, params, serialize_document)
 
 @app.post("/suppliers")
-def add_supplier(supplier: Supplier):
+async def add_supplier(supplier: Supplier):
     data = supplier.dict(exclude_unset=True)
     data.pop("id", None)
-    result = suppliers_collection.insert_one(data)
-    # Fetch the inserted supplier and format the response
-    new_supplier = suppliers_collection.find_one({"_id": result.inserted_id})
-    new_supplier["id"] = str(new_supplier["_id"])
-    del new_supplier["_id"]
-    return new_supplier
+    await repo.suppliers.insert(data)
+    await record_change(repo, "suppliers", None, data)
+    # insert() sets data["_id"], so the payload is the stored document
+    return APIResponse(serialize_document(data))
 
 @app.put("/suppliers/{supplier_id}")
-def update_supplier(supplier_id: str, supplier: Supplier):
+async def update_supplier(supplier_id: str, supplier: Supplier):
     data = supplier.dict(exclude_unset=True)
     data.pop("id", None)
-    result = suppliers_collection.update_one({"_id": ObjectId(supplier_id)}, {"$set": data})
-    if result.matched_count == 0:
+    if not await repo.suppliers.update(ObjectId(supplier_id), data):
         raise HTTPException(status_code=404, detail="Supplier not found")
     return {"id": supplier_id, **data}
 
 @app.delete("/suppliers/{supplier_id}")
-def delete_supplier(supplier_id: str):
-    result = suppliers_collection.delete_one({"_id": ObjectId(supplier_id)})
-    if result.deleted_count == 0:
+async def delete_supplier(supplier_id: str):
+    previous = await repo.suppliers.delete_and_get(ObjectId(supplier_id), {"_id": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Supplier not found")
+    await record_change(repo, "suppliers", previous, None)
     return {"id": supplier_id, "deleted": True}
 
 # --- PURCHASE ORDER MANAGEMENT ---
@@ -426,102 +541,98 @@ class PurchaseOrder(BaseModel):
     expected_delivery: str
 
 @app.get("/purchase-orders")
-def get_purchase_orders():
-    orders = list(purchase_orders_collection.find())
-    for o in orders:
-        o["id"] = str(o["_id"])
-        del o["_id"]
-        # Convert supplier_id to string if it's an ObjectId
-        if "supplier_id" in o and isinstance(o["supplier_id"], ObjectId):
-            o["supplier_id"] = str(o["supplier_id"])
-        # Convert product_id in each item to string if it's an ObjectId
-        for item in o.get("items", []):
-            if "product_id" in item and isinstance(item["product_id"], ObjectId):
-                item["product_id"] = str(item["product_id"])
-    return orders
+@versioned("purchase_orders")
+async def get_purchase_orders(params: ListParams = Depends()):
+    return await list_documents(repo.purchase_orders, params, serialize_document)
 
-@app.post("/purchase-orders")
-def add_purchase_order(order: PurchaseOrder):
-    data = order.dict(exclude_unset=True)
-    data.pop("id", None)
-    
+def purchase_order_product_ids(data):
     # Convert product_id strings back to ObjectId for database query
     for item in data.get("items", []):
         try:
             item["product_id"] = ObjectId(item["product_id"])
         except Exception:
-            raise HTTPException(status_code=400, detail=f"Invalid product_id format: {item['product_id']}")
+            raise ValueError(f"Invalid product_id format: {item['product_id']}")
 
-    result = purchase_orders_collection.insert_one(data)
-    
-    new_order = purchase_orders_collection.find_one({"_id": result.inserted_id})
+@app.post("/purchase-orders")
+async def add_purchase_order(order: PurchaseOrder):
+    data = order.dict(exclude_unset=True)
+    data.pop("id", None)
     
-    # Convert all ObjectId fields to strings for the response
-    new_order["id"] = str(new_order["_id"])
-    del new_order["_id"]
+    try:
+        purchase_order_product_ids(data)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    await repo.purchase_orders.insert(data)
+    await record_change(repo, "purchase_orders", None, data)
+    return APIResponse(serialize_document(data))
 
-    for item in new_order.get("items", []):
-        if "product_id" in item and isinstance(item["product_id"], ObjectId):
-            item["product_id"] = str(item["product_id"])
-            
-    return JSONResponse(content=new_order)
+@app.post("/purchase-orders/bulk")
+async def bulk_purchase_orders(request: Request):
+    return await bulk_upsert(request, repo, "purchase_orders", PurchaseOrder, purchase_order_product_ids)
 
 @app.put("/purchase-orders/{order_id}")
-def update_purchase_order(order_id: str, order: PurchaseOrder):
+async def update_purchase_order(order_id: str, order: PurchaseOrder):
     data = order.dict(exclude_unset=True)
     data.pop("id", None)
-    result = purchase_orders_collection.update_one({"_id": ObjectId(order_id)}, {"$set": data})
-    if result.matched_count == 0:
+    previous = await repo.purchase_orders.update_and_get_previous(ObjectId(order_id), data, {"status": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Purchase order not found")
+    await record_change(repo, "purchase_orders", previous, {**previous, **data})
+    # Received shipments post this order's items to the ledger
+    async for shipment in repo.shipments.find({"purchase_order_id": order_id, "status": "received"}, {"_id": 1}):
+        await sync_ledger(repo, "shipments", shipment["_id"])
     return {"id": order_id, **data}
 
 @app.delete("/purchase-orders/{order_id}")
-def delete_purchase_order(order_id: str):
-    result = purchase_orders_collection.delete_one({"_id": ObjectId(order_id)})
-    if result.deleted_count == 0:
+async def delete_purchase_order(order_id: str):
+    previous = await repo.purchase_orders.delete_and_get(ObjectId(order_id), {"status": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Purchase order not found")
+    await record_change(repo, "purchase_orders", previous, None)
     return {"id": order_id, "deleted": True}
 
 # --- WAREHOUSE MANAGEMENT ---
 
+class GeoPoint(BaseModel):
+    lat: float
+    lng: float
+
 class Warehouse(BaseModel):
     id: Optional[str] = None
     name: str
     address: str
+    # Depot for route planning
+    location: Optional[GeoPoint] = None
 
 @app.get("/warehouses")
-def get_warehouses():
-    warehouses = list(warehouses_collection.find())
-    for w in warehouses:
-        w["id"] = str(w["_id"])
-        del w["_id"]
-    return warehouses
+@versioned("warehouses")
+async def get_warehouses(params: ListParams = Depends()):
+    return await list_documents(repo.warehouses, params, serialize_document)
 
 @app.post("/warehouses")
-def add_warehouse(warehouse: Warehouse):
+async def add_warehouse(warehouse: Warehouse):
     data = warehouse.dict(exclude_unset=True)
     data.pop("id", None)
-    result = warehouses_collection.insert_one(data)
-    # Fetch the inserted warehouse and format the response
-    new_warehouse = warehouses_collection.find_one({"_id": result.inserted_id})
-    new_warehouse["id"] = str(new_warehouse["_id"])
-    del new_warehouse["_id"]
-    return new_warehouse
+    await repo.warehouses.insert(data)
+    await record_change(repo, "warehouses", None, data)
+    return APIResponse(serialize_document(data))
 
 @app.put("/warehouses/{warehouse_id}")
-def update_warehouse(warehouse_id: str, warehouse: Warehouse):
+async def update_warehouse(warehouse_id: str, warehouse: Warehouse):
     data = warehouse.dict(exclude_unset=True)
     data.pop("id", None)
-    result = warehouses_collection.update_one({"_id": ObjectId(warehouse_id)}, {"$set": data})
-    if result.matched_count == 0:
+    if not await repo.warehouses.update(ObjectId(warehouse_id), data):
         raise HTTPException(status_code=404, detail="Warehouse not found")
     return {"id": warehouse_id, **data}
 
 @app.delete("/warehouses/{warehouse_id}")
-def delete_warehouse(warehouse_id: str):
-    result = warehouses_collection.delete_one({"_id": ObjectId(warehouse_id)})
-    if result.deleted_count == 0:
+async def delete_warehouse(warehouse_id: str):
+    previous = await repo.warehouses.delete_and_get(ObjectId(warehouse_id), {"_id": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Warehouse not found")
+    await record_change(repo, "warehouses", previous, None)
+    await repo.route_plans.delete(warehouse_id)
     return {"id": warehouse_id, "deleted": True}
 
 # --- STOCK TRANSFER MANAGEMENT ---
@@ -539,38 +650,37 @@ class StockTransfer(BaseModel):
     transfer_date: str
 
 @app.get("/stock-transfers")
-def get_stock_transfers():
-    transfers = list(stock_transfers_collection.find())
-    for t in transfers:
-        t["id"] = str(t["_id"])
-        del t["_id"]
-    return transfers
+@versioned("stock_transfers")
+async def get_stock_transfers(params: ListParams = Depends()):
+    return await list_documents(repo.stock_transfers, params, serialize_document)
 
 @app.post("/stock-transfers")
-def add_stock_transfer(transfer: StockTransfer):
+async def add_stock_transfer(transfer: StockTransfer):
     data = transfer.dict(exclude_unset=True)
     data.pop("id", None)
-    result = stock_transfers_collection.insert_one(data)
-    # Fetch the inserted stock transfer and format the response
-    new_transfer = stock_transfers_collection.find_one({"_id": result.inserted_id})
-    new_transfer["id"] = str(new_transfer["_id"])
-    del new_transfer["_id"]
-    return new_transfer
+    await repo.stock_transfers.insert(data)
+    await sync_ledger(repo, "stock_transfers", data["_id"])
+    return APIResponse(serialize_document(data))
+
+@app.post("/stock-transfers/bulk")
+async def bulk_stock_transfers(request: Request):
+    return await bulk_upsert(request, repo, "stock_transfers", StockTransfer)
 
 @app.put("/stock-transfers/{transfer_id}")
-def update_stock_transfer(transfer_id: str, transfer: StockTransfer):
+async def update_stock_transfer(transfer_id: str, transfer: StockTransfer):
     data = transfer.dict(exclude_unset=True)
     data.pop("id", None)
-    result = stock_transfers_collection.update_one({"_id": ObjectId(transfer_id)}, {"$set": data})
-    if result.matched_count == 0:
+    if not await repo.stock_transfers.update(ObjectId(transfer_id), data):
         raise HTTPException(status_code=404, detail="Stock transfer not found")
+    await sync_ledger(repo, "stock_transfers", ObjectId(transfer_id))
     return {"id": transfer_id, **data}
 
 @app.delete("/stock-transfers/{transfer_id}")
-def delete_stock_transfer(transfer_id: str):
-    result = stock_transfers_collection.delete_one({"_id": ObjectId(transfer_id)})
-    if result.deleted_count == 0:
+async def delete_stock_transfer(transfer_id: str):
+    previous = await repo.stock_transfers.delete_and_get(ObjectId(transfer_id), {"ledger_lines": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Stock transfer not found")
+    await reverse_deleted(repo, "stock_transfers", previous)
     return {"id": transfer_id, "deleted": True}
 
 # --- INBOUND SHIPMENT MANAGEMENT ---
@@ -584,35 +694,41 @@ class Shipment(BaseModel):
     actual_delivery: str
 
 @app.get("/shipments")
-def get_shipments():
-    shipments = list(shipments_collection.find())
-    for s in shipments:
-        s["id"] = str(s["_id"])
-        del s["_id"]
-    return shipments
+@versioned("shipments")
+async def get_shipments(params: ListParams = Depends()):
+    return await list_documents(repo.shipments, params, serialize_document)
 
 @app.post("/shipments")
-def add_shipment(shipment: Shipment):
+async def add_shipment(shipment: Shipment):
     data = shipment.dict(exclude_unset=True)
     data.pop("id", None)
-    result = shipments_collection.insert_one(data)
-    data["id"] = str(result.inserted_id)
-    return data
+    await repo.shipments.insert(data)
+    await record_change(repo, "shipments", None, data)
+    await sync_ledger(repo, "shipments", data["_id"])
+    return APIResponse(serialize_document(data))
+
+@app.post("/shipments/bulk")
+async def bulk_shipments(request: Request):
+    return await bulk_upsert(request, repo, "shipments", Shipment)
 
 @app.put("/shipments/{shipment_id}")
-def update_shipment(shipment_id: str, shipment: Shipment):
+async def update_shipment(shipment_id: str, shipment: Shipment):
     data = shipment.dict(exclude_unset=True)
     data.pop("id", None)
-    result = shipments_collection.update_one({"_id": ObjectId(shipment_id)}, {"$set": data})
-    if result.matched_count == 0:
+    previous = await repo.shipments.update_and_get_previous(ObjectId(shipment_id), data, {"status": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Shipment not found")
+    await record_change(repo, "shipments", previous, {**previous, **data})
+    await sync_ledger(repo, "shipments", previous["_id"])
     return {"id": shipment_id, **data}
 
 @app.delete("/shipments/{shipment_id}")
-def delete_shipment(shipment_id: str):
-    result = shipments_collection.delete_one({"_id": ObjectId(shipment_id)})
-    if result.deleted_count == 0:
+async def delete_shipment(shipment_id: str):
+    previous = await repo.shipments.delete_and_get(ObjectId(shipment_id), {"status": 1, "ledger_lines": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Shipment not found")
+    await record_change(repo, "shipments", previous, None)
+    await reverse_deleted(repo, "shipments", previous)
     return {"id": shipment_id, "deleted": True}
 
 # --- CUSTOMER ORDER MANAGEMENT ---
@@ -634,37 +750,73 @@ class CustomerOrder(BaseModel):
     status: str
     delivery_address: str
     placed_date: str
+    # Fulfilling warehouse, used to filter stock movement per warehouse
+    warehouse_id: Optional[str] = None
 
 @app.get("/orders")
-def get_orders():
-    orders = list(orders_collection.find())
-    for o in orders:
-        o["id"] = str(o["_id"])
-        del o["_id"]
-    return orders
+@versioned("orders")
+async def get_orders(params: ListParams = Depends()):
+    return await list_documents(repo.orders, params, serialize_document)
 
 @app.post("/orders")
-def add_order(order: CustomerOrder):
+async def add_order(order: CustomerOrder):
     data = order.dict(exclude_unset=True)
     data.pop("id", None)
-    result = orders_collection.insert_one(data)
-    data["id"] = str(result.inserted_id)
-    return data
+    # Placing an order takes its items out of stock; a cancelled one holds nothing
+    data["stock_reserved"] = data["status"] != "cancelled"
+    quantities = {}
+    if data["stock_reserved"]:
+        try:
+            quantities = order_quantities(data["items"])
+            await reserve(repo, quantities)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        except StockShortage as exc:
+            raise HTTPException(status_code=409, detail=str(exc))
+    try:
+        await repo.orders.insert(data)
+    except PyMongoError:
+        await release(repo, quantities)
+        raise
+    await record_change(repo, "orders", None, data)
+    await sync_ledger(repo, "orders", data["_id"])
+    return APIResponse(serialize_document(data))
+
+@app.post("/orders/bulk")
+async def bulk_orders(request: Request):
+    return await bulk_upsert(request, repo, "orders", CustomerOrder)
 
 @app.put("/orders/{order_id}")
-def update_order(order_id: str, order: CustomerOrder):
+async def update_order(order_id: str, order: CustomerOrder):
     data = order.dict(exclude_unset=True)
     data.pop("id", None)
-    result = orders_collection.update_one({"_id": ObjectId(order_id)}, {"$set": data})
-    if result.matched_count == 0:
+    previous = await repo.orders.get(ObjectId(order_id), RESERVATION_FIELDS)
+    if previous is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    try:
+        applied = await update_reserved_order(repo, previous, data)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except StockShortage as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    if not applied:
+        raise HTTPException(status_code=409, detail="Order was changed concurrently; reload and retry")
+    await record_change(repo, "orders", previous, {**previous, **data})
+    await sync_ledger(repo, "orders", previous["_id"])
     return {"id": order_id, **data}
 
 @app.delete("/orders/{order_id}")
-def delete_order(order_id: str):
-    result = orders_collection.delete_one({"_id": ObjectId(order_id)})
-    if result.deleted_count == 0:
+async def delete_order(order_id: str):
+    previous = await repo.orders.delete_and_get(ObjectId(order_id), {**RESERVATION_FIELDS, "ledger_lines": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    if previous.get("stock_reserved") and previous.get("status") not in FULFILLED_ORDER_STATUSES:
+        # Deleting an unfulfilled order gives its stock back
+        await release(repo, order_quantities(previous["items"]))
+    await record_change(repo, "orders", previous, None)
+    if previous.get("status") not in FULFILLED_ORDER_STATUSES:
+        # Like the product stock above, a fulfilled order's goods don't come back into its warehouse
+        await reverse_deleted(repo, "orders", previous)
     return {"id": order_id, "deleted": True}
 
 # --- DELIVERY MANAGEMENT ---
@@ -675,88 +827,221 @@ class Delivery(BaseModel):
     status: str
     delivery_date: str
     proof_of_delivery: Optional[str] = None
+    # Defaults to the order's warehouse
+    warehouse_id: Optional[str] = None
+    location: Optional[GeoPoint] = None
 
 @app.get("/deliveries")
-def get_deliveries():
-    deliveries = list(deliveries_collection.find())
-    for d in deliveries:
-        d["id"] = str(d["_id"])
-        del d["_id"]
-    return deliveries
+@versioned("deliveries")
+async def get_deliveries(params: ListParams = Depends()):
+    return await list_documents(repo.deliveries, params, serialize_document)
 
 @app.post("/deliveries")
-def add_delivery(delivery: Delivery):
+async def add_delivery(delivery: Delivery):
     data = delivery.dict(exclude_unset=True)
     data.pop("id", None)
-    result = deliveries_collection.insert_one(data)
-    data["id"] = str(result.inserted_id)
-    return data
+    await routing.resolve_depot(repo, data)
+    await repo.deliveries.insert(data)
+    await record_change(repo, "deliveries", None, data)
+    await routing.sync_route(repo, data["_id"])
+    return APIResponse(serialize_document(data))
+
+@app.post("/deliveries/bulk")
+async def bulk_deliveries(request: Request):
+    return await bulk_upsert(request, repo, "deliveries", Delivery)
 
 @app.put("/deliveries/{delivery_id}")
-def update_delivery(delivery_id: str, delivery: Delivery):
+async def update_delivery(delivery_id: str, delivery: Delivery):
     data = delivery.dict(exclude_unset=True)
     data.pop("id", None)
-    result = deliveries_collection.update_one({"_id": ObjectId(delivery_id)}, {"$set": data})
-    if result.matched_count == 0:
+    await routing.resolve_depot(repo, data)
+    previous = await repo.deliveries.update_and_get_previous(ObjectId(delivery_id), data, {"status": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Delivery not found")
+    await record_change(repo, "deliveries", previous, {**previous, **data})
+    await routing.sync_route(repo, delivery_id)
     return {"id": delivery_id, **data}
 
 @app.delete("/deliveries/{delivery_id}")
-def delete_delivery(delivery_id: str):
-    result = deliveries_collection.delete_one({"_id": ObjectId(delivery_id)})
-    if result.deleted_count == 0:
+async def delete_delivery(delivery_id: str):
+    previous = await repo.deliveries.delete_and_get(ObjectId(delivery_id), {"status": 1})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Delivery not found")
+    await record_change(repo, "deliveries", previous, None)
+    await routing.sync_route(repo, delivery_id)
     return {"id": delivery_id, "deleted": True}
 
+# --- DRIVERS AND ROUTES ---
+
+class Driver(BaseModel):
+    id: Optional[str] = None
+    name: str
+    avatar: Optional[str] = None
+    warehouse_id: str
+    # Most stops per route
+    capacity: Optional[int] = None
+    # Where the driver's route starts; defaults to the warehouse
+    location: Optional[GeoPoint] = None
+
+@app.get("/drivers")
+@versioned("drivers")
+async def get_drivers(params: ListParams = Depends()):
+    return await list_documents(repo.drivers, params, serialize_document)
+
+@app.post("/drivers")
+async def add_driver(driver: Driver):
+    data = driver.dict(exclude_unset=True)
+    data.pop("id", None)
+    await repo.drivers.insert(data)
+    return APIResponse(serialize_document(data))
+
+@app.put("/drivers/{driver_id}")
+async def update_driver(driver_id: str, driver: Driver):
+    data = driver.dict(exclude_unset=True)
+    data.pop("id", None)
+    if not await repo.drivers.update(ObjectId(driver_id), data):
+        raise HTTPException(status_code=404, detail="Driver not found")
+    return {"id": driver_id, **data}
+
+@app.delete("/drivers/{driver_id}")
+async def delete_driver(driver_id: str):
+    if not await repo.drivers.delete(ObjectId(driver_id)):
+        raise HTTPException(status_code=404, detail="Driver not found")
+    return {"id": driver_id, "deleted": True}
+
+@app.post("/routes/plan")
+async def plan_delivery_routes(warehouse_id: Optional[str] = None, run_async: bool = Query(False, alias="async")):
+    if warehouse_id is not None and not ObjectId.is_valid(warehouse_id):
+        raise HTTPException(status_code=404, detail="Warehouse not found")
+    if run_async:
+        return enqueue("route_plan", {"warehouse_id": warehouse_id}, lambda progress: routing.plan_routes(repo, warehouse_id, progress))
+    return await routing.plan_routes(repo, warehouse_id)
+
+@app.get("/routes/{warehouse_id}")
+@versioned("route_plans")
+async def get_delivery_routes(warehouse_id: str):
+    plan = await routing.read_routes(repo, warehouse_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="No route plan for this warehouse")
+    return APIResponse(plan)
+
+# --- INVENTORY LEDGER ---
+
+class InventoryAdjustment(BaseModel):
+    product_id: str
+    warehouse_id: str
+    quantity: int
+    reason: Optional[str] = None
+
+def object_id_or_404(value, detail):
+    try:
+        return ObjectId(value)
+    except Exception:
+        raise HTTPException(status_code=404, detail=detail)
+
+@app.get("/inventory/products/{product_id}")
+@versioned("stock_positions")
+async def get_product_inventory(product_id: str):
+    obj_id = object_id_or_404(product_id, "Product not found")
+    positions = await repo.stock_positions.find({"product_id": obj_id}, {"_id": 0, "warehouse_id": 1, "on_hand": 1}).to_list()
+    return {
+        "product_id": product_id,
+        "on_hand": sum(position["on_hand"] for position in positions),
+        "warehouses": positions,
+    }
+
+@app.get("/warehouses/{warehouse_id}/inventory")
+@versioned("warehouse_stock")
+async def get_warehouse_inventory(warehouse_id: str):
+    totals = await repo.warehouse_stock.find_one({"_id": warehouse_id}) or {}
+    return {"warehouse_id": warehouse_id, "units": totals.get("units", 0), "value": round(totals.get("value", 0), 2)}
+
+@app.get("/inventory/positions")
+@versioned("stock_positions")
+async def get_stock_positions(
+    product_id: Optional[str] = None, warehouse_id: Optional[str] = None, params: ListParams = Depends()
+):
+    query = {}
+    if product_id:
+        query["product_id"] = object_id_or_404(product_id, "Product not found")
+    if warehouse_id:
+        query["warehouse_id"] = warehouse_id
+    return await list_documents(repo.stock_positions, params, serialize_document, query=query)
+
+@app.get("/inventory/ledger")
+@versioned("inventory_ledger")
+async def get_inventory_ledger(
+    product_id: Optional[str] = None, warehouse_id: Optional[str] = None, params: ListParams = Depends()
+):
+    query = {}
+    if product_id:
+        query["product_id"] = object_id_or_404(product_id, "Product not found")
+    if warehouse_id:
+        query["warehouse_id"] = warehouse_id
+    return await list_documents(repo.inventory_ledger, params, serialize_document, query=query)
+
+@app.post("/inventory/adjustments")
+async def add_inventory_adjustment(adjustment: InventoryAdjustment):
+    product_id = object_id_or_404(adjustment.product_id, "Product not found")
+    if not await repo.products.get(product_id, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    if not adjustment.quantity:
+        raise HTTPException(status_code=400, detail="quantity must not be 0")
+    entry = await adjust(repo, product_id, adjustment.warehouse_id, adjustment.quantity, adjustment.reason)
+    return APIResponse(serialize_document(entry))
+
+@app.post("/inventory/compact")
+async def compact_inventory_ledger():
+    return await compact(repo)
+
+@app.post("/inventory/reconcile")
+async def reconcile_inventory():
+    return await reconcile_positions(repo)
+
 @app.get("/last-mile-deliveries")
-def get_last_mile_deliveries():
-    import random
-    drivers = [
-        {"name": "Alex Green", "avatar": "https://i.pravatar.cc/150?img=1"},
-        {"name": "Maria Rodriguez", "avatar": "https://i.pravatar.cc/150?img=2"},
-        {"name": "David Chen", "avatar": "https://i.pravatar.cc/150?img=3"},
-        {"name": "Fatima Al-Jamil", "avatar": "https://i.pravatar.cc/150?img=4"},
-    ]
-    statuses = ["In Transit", "Delayed", "Nearing Destination", "Delivered"]
-    deliveries = []
-    for i in range(10):
-        driver = random.choice(drivers)
-        status = random.choice(statuses)
-        eta = random.randint(5, 60) if status != "Delivered" else 0
-        deliveries.append({
-            "id": f"DELIV{1001 + i}",
-            "orderId": f"ORD{9500 + i}",
-            "driver": driver,
-            "status": status,
-            "etaMinutes": eta,
-            "currentLocation": {
-                "lat": 34.0522 + (random.random() - 0.5) * 0.1,
-                "lng": -118.2437 + (random.random() - 0.5) * 0.1,
-            }
-        })
-    return deliveries
+@versioned("route_plans")
+async def get_last_mile_deliveries(warehouse_id: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    return await routing.last_mile(repo, warehouse_id, limit)
 
 @app.get("/supply-chain-summary")
-def get_supply_chain_summary():
-    total_suppliers = suppliers_collection.count_documents({})
-    total_warehouses = warehouses_collection.count_documents({})
-    total_products = products_collection.count_documents({})
-    open_purchase_orders = purchase_orders_collection.count_documents({"status": {"$nin": ["received", "cancelled"]}})
-    open_customer_orders = orders_collection.count_documents({"status": {"$nin": ["delivered", "cancelled"]}})
-    open_deliveries = deliveries_collection.count_documents({"status": {"$nin": ["delivered", "cancelled"]}})
-    open_shipments = shipments_collection.count_documents({"status": {"$nin": ["received", "cancelled"]}})
-    return {
-        "total_suppliers": total_suppliers,
-        "total_warehouses": total_warehouses,
-        "total_products": total_products,
-        "open_purchase_orders": open_purchase_orders,
-        "open_customer_orders": open_customer_orders,
-        "open_deliveries": open_deliveries,
-        "open_shipments": open_shipments
+@versioned("summary", cache_body=True)
+async def get_supply_chain_summary():
+    return await read_summary(repo)
+
+@app.post("/supply-chain-summary/reconcile")
+async def reconcile_supply_chain_summary():
+    return await reconcile(repo)
+
+# --- BACKGROUND JOBS ---
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return APIResponse(job.to_dict())
+
+@app.get("/diagnostics/query-plans")
+async def get_query_plans():
+    return await explain_hot_queries(repo.database)
+
+@app.get("/diagnostics/connection-pools")
+async def get_connection_pools():
+    pools = {name: pool_metrics[name].report(client) for name, client in repo.clients().items()}
+    analytics = {
+        "pool": "analytics" if "analytics" in pools else "crud",
+        "read_preference": repo.analytics.database.read_preference.document,
+        "staleness_seconds": repo.analytics.staleness_seconds,
     }
+    return {"pools": pools, "analytics": analytics}
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text format; counts are per process
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", "1.0"))
+UNMATCHED_ROUTE = "unmatched"
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status", ["method", "route", "status"])
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", ["method", "route"])
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by command and collection", ["command", "collection"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+MONGO_COMMAND_FAILURES = Counter("mongodb_command_failures_total", "Failed MongoDB commands", ["command", "collection"])
+MONGO_POOL_CONNECTIONS = Gauge("mongodb_pool_connections", "Open MongoDB connections", ["pool", "address"])
+MONGO_POOL_CHECKED_OUT = Gauge("mongodb_pool_checked_out", "MongoDB connections in use", ["pool", "address"])
+MONGO_POOL_WAITING = Gauge("mongodb_pool_waiting", "Operations waiting for a MongoDB connection", ["pool", "address"])
+MONGO_POOL_WAIT_SECONDS = Histogram(
+    "mongodb_pool_wait_seconds", "Time to check a MongoDB connection out of the pool", ["pool"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongodb_pool_checkout_failures_total", "Failed MongoDB connection checkouts", ["pool", "reason"],
+)
+MODEL_FIT_SECONDS = Histogram(
+    "model_fit_duration_seconds", "Time spent fitting or backtesting forecast models", ["operation"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120),
+)
+MODEL_FIT_SERIES = Counter("model_fit_series_total", "Series fitted or backtested", ["operation"])
+
+# (command, collection) -> [count, total seconds] for the request being served, if any
+_request_commands = contextvars.ContextVar("request_commands", default=None)
+
+
+def timed_fit(operation, series, fn, *args):
+    """Call ``fn(*args)`` and record it as a model fit over ``series`` series."""
+    with MODEL_FIT_SECONDS.labels(operation).time():
+        result = fn(*args)
+    MODEL_FIT_SERIES.labels(operation).inc(series)
+    return result
+
+
+def command_collection(event):
+    target = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+    return target if isinstance(target, str) else ""
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command and attributes it to the current request."""
+
+    def __init__(self):
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = command_collection(event)
+
+    def _finish(self, event):
+        with self._lock:
+            collection = self._started.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.labels(event.command_name, collection).observe(seconds)
+        commands = _request_commands.get()
+        if commands is not None:
+            entry = commands.setdefault((event.command_name, collection), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        return collection
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.labels(event.command_name, self._finish(event)).inc()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Tracks how busy one client's connection pools are, per server."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.servers = {}  # "host:port" -> counters
+        self._lock = threading.Lock()
+
+    def _update(self, event, **changes):
+        address = "%s:%s" % event.address
+        with self._lock:
+            stats = self.servers.setdefault(
+                address, {"open": 0, "checked_out": 0, "waiting": 0, "checkouts": 0, "failures": 0, "wait_seconds": 0.0},
+            )
+            for key, change in changes.items():
+                stats[key] += change
+            MONGO_POOL_CONNECTIONS.labels(self.pool, address).set(stats["open"])
+            MONGO_POOL_CHECKED_OUT.labels(self.pool, address).set(stats["checked_out"])
+            MONGO_POOL_WAITING.labels(self.pool, address).set(stats["waiting"])
+
+    def pool_created(self, event):
+        self._update(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._update(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event, waiting=-1, failures=1)
+        MONGO_POOL_CHECKOUT_FAILURES.labels(self.pool, event.reason).inc()
+
+    def connection_checked_out(self, event):
+        seconds = event.duration or 0.0
+        self._update(event, waiting=-1, checked_out=1, checkouts=1, wait_seconds=seconds)
+        MONGO_POOL_WAIT_SECONDS.labels(self.pool).observe(seconds)
+
+    def connection_checked_in(self, event):
+        self._update(event, checked_out=-1)
+
+    def report(self, client):
+        """The client's pool settings with the current usage of each server's pool."""
+        options = client.options.pool_options
+        with self._lock:
+            servers = {
+                address: {
+                    **stats,
+                    "wait_seconds": round(stats["wait_seconds"], 6),
+                    "utilization": round(stats["checked_out"] / options.max_pool_size, 3) if options.max_pool_size else None,
+                    "mean_wait_ms": round(stats["wait_seconds"] / stats["checkouts"] * 1000, 3) if stats["checkouts"] else 0,
+                }
+                for address, stats in self.servers.items()
+            }
+        return {
+            "max_pool_size": options.max_pool_size,
+            "min_pool_size": options.min_pool_size,
+            "max_connecting": options.max_connecting,
+            "wait_queue_timeout": options.wait_queue_timeout,
+            "read_preference": client.read_preference.document,
+            "servers": servers,
+        }
+
+
+def format_commands(commands):
+    ranked = sorted(commands.items(), key=lambda item: item[1][1], reverse=True)
+    return ", ".join(f"{name} {collection or '-'} x{count} {seconds * 1000:.1f}ms" for (name, collection), (count, seconds) in ranked)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and in-flight gauges per route template.
+
+    Requests slower than ``SLOW_REQUEST_SECONDS`` are logged with the MongoDB
+    commands they issued. Streaming responses are timed until the last chunk.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        # The router's live route list; templates keep label cardinality bounded where raw paths would not
+        self.routes = routes
+        self.route_template = lru_cache(maxsize=4096)(self._route_template)
+
+    def _route_template(self, method, path):
+        # Resolved like the router does: the first route matching path and method, else the first matching the path
+        scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or UNMATCHED_ROUTE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self.route_template(method, scope["path"])
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        commands = {}
+        token = _request_commands.set(commands)
+        in_flight = IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            _request_commands.reset(token)
+            REQUEST_SECONDS.labels(method, route).observe(elapsed)
+            REQUESTS.labels(method, route, str(status[0])).inc()
+            if elapsed >= SLOW_REQUEST_SECONDS:
+                logger.warning(
+                    "Slow request: %s %s took %.0fms (status %s); MongoDB: %s",
+                    method, scope["path"], elapsed * 1000, status[0], format_commands(commands) or "no commands",
+                )
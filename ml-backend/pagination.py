@@ -0,0 +1,95 @@
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from serialization import APIResponse, dumps
+
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Documents per chunk written to an NDJSON stream
+NDJSON_CHUNK_SIZE = 500
+
+
+class ListParams:
+    """Query parameters shared by the collection list endpoints.
+
+    ``after`` is the ``_id`` of the last document on the previous page, ``limit``
+    the page size and ``fields`` a comma-separated projection. Sending
+    ``Accept: application/x-ndjson`` (or ``?format=ndjson``) streams the
+    documents one per line instead of returning a JSON array.
+    """
+
+    def __init__(
+        self,
+        request: Request,
+        after: Optional[str] = None,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        fields: Optional[str] = None,
+        format: Optional[str] = None,
+    ):
+        try:
+            self.after = ObjectId(after) if after else None
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        self.limit = limit
+        self.fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        self.stream = format == "ndjson" or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def ndjson_chunk(docs, transform, enrich):
+    if enrich:
+        await enrich(docs)
+    if transform:
+        docs = [transform(doc) for doc in docs]
+    return b"\n".join(dumps(doc) for doc in docs) + b"\n"
+
+
+async def iter_ndjson(cursor, transform=None, enrich=None):
+    docs = []
+    async for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= NDJSON_CHUNK_SIZE:
+            yield await ndjson_chunk(docs, transform, enrich)
+            docs = []
+    if docs:
+        yield await ndjson_chunk(docs, transform, enrich)
+
+
+async def list_documents(collection, params, transform=None, enrich=None, query=None):
+    """Run a list endpoint's query with the paging, projection and format in ``params``.
+
+    ``enrich`` is an optional coroutine called with each batch of raw documents
+    (a page, or an NDJSON chunk) before ``transform``, for joining in data
+    stored elsewhere. ``query`` is an optional filter. ObjectIds are left for
+    the encoder to convert.
+    """
+    query = dict(query or {})
+    if params.after:
+        query["_id"] = {"$gt": params.after}
+    projection = dict.fromkeys(params.fields, 1) if params.fields else None
+    cursor = collection.find(query, projection)
+    if params.after or params.limit:
+        cursor = cursor.sort("_id", 1)
+
+    if params.stream:
+        # The next cursor isn't known until the stream ends; clients page on the last _id they read
+        if params.limit:
+            cursor = cursor.limit(params.limit)
+        return StreamingResponse(iter_ndjson(cursor, transform, enrich), media_type=NDJSON_MEDIA_TYPE)
+
+    headers = {}
+    if params.limit:
+        docs = await cursor.limit(params.limit + 1).to_list()
+        if len(docs) > params.limit:
+            docs = docs[:params.limit]
+            headers[NEXT_CURSOR_HEADER] = str(docs[-1]["_id"])
+    else:
+        docs = await cursor.to_list()
+    if enrich:
+        await enrich(docs)
+    if transform:
+        docs = [transform(doc) for doc in docs]
+    return APIResponse(docs, headers=headers)
@@ -1,64 +1,354 @@
+"""Bulk-load seeded synthetic supply chain data into MongoDB.
+
+With no arguments this loads a small demo dataset. Counts accept
+scientific notation, e.g.::
+
+    python populate_sample_data.py --products 1e6 --orders 5e6 --history-months 36 --drop
+
+The same ``--seed``, counts and ``--batch-size`` always produce the same
+documents, including their ``_id`` values, so benchmark runs can be compared.
+Dates are laid out relative to the current month.
+"""
+import argparse
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
 import pymongo
-from datetime import datetime, timedelta
-import random
-
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["inventory_db"]
-
-# Sample Suppliers
-db.suppliers.insert_many([
-    {"name": "Acme Corp", "contact_info": "acme@example.com", "lead_time_days": 5, "reliability_score": 0.95},
-    {"name": "Global Widgets", "contact_info": "widgets@example.com", "lead_time_days": 7, "reliability_score": 0.9},
-    {"name": "SupplyCo", "contact_info": "supplyco@example.com", "lead_time_days": 3, "reliability_score": 0.98},
-])
-
-# Sample Warehouses
-db.warehouses.insert_many([
-    {"name": "Central Warehouse", "address": "123 Main St"},
-    {"name": "East Warehouse", "address": "456 East Ave"},
-    {"name": "West Warehouse", "address": "789 West Blvd"},
-])
-
-# Sample Products
-db.products.insert_many([
-    {"name": "Widget A", "sku": "WIDGET-A", "category": "Widgets", "stock": 120, "min_stock": 30, "price": 10.5},
-    {"name": "Widget B", "sku": "WIDGET-B", "category": "Widgets", "stock": 80, "min_stock": 20, "price": 12.0},
-    {"name": "Gadget X", "sku": "GADGET-X", "category": "Gadgets", "stock": 200, "min_stock": 50, "price": 8.75},
-])
-
-# Sample Purchase Orders
-db["purchase_orders"].insert_many([
-    {"supplier_id": str(db.suppliers.find_one({"name": "Acme Corp"})["_id"]),
-     "items": [{"product_id": str(db.products.find_one({"name": "Widget A"})["_id"]), "quantity": 50, "price": 10.5}],
-     "status": "pending", "order_date": datetime.now().isoformat(), "expected_delivery": (datetime.now() + timedelta(days=5)).isoformat()},
-])
-
-# Sample Stock Transfers
-db["stock_transfers"].insert_many([
-    {"from_warehouse": str(db.warehouses.find_one({"name": "Central Warehouse"})["_id"]),
-     "to_warehouse": str(db.warehouses.find_one({"name": "East Warehouse"})["_id"]),
-     "items": [{"product_id": str(db.products.find_one({"name": "Widget B"})["_id"]), "quantity": 10}],
-     "status": "in transit", "transfer_date": datetime.now().isoformat()},
-])
-
-# Sample Shipments
-db["shipments"].insert_many([
-    {"purchase_order_id": str(db.purchase_orders.find_one()["_id"]),
-     "warehouse_id": str(db.warehouses.find_one({"name": "Central Warehouse"})["_id"]),
-     "status": "shipped", "expected_delivery": (datetime.now() + timedelta(days=3)).isoformat(), "actual_delivery": ""},
-])
-
-# Sample Orders
-db["orders"].insert_many([
-    {"customer_info": {"name": "John Doe", "email": "john@example.com", "phone": "1234567890"},
-     "items": [{"product_id": str(db.products.find_one({"name": "Gadget X"})["_id"]), "quantity": 2, "price": 8.75}],
-     "status": "processing", "delivery_address": "789 Customer Rd", "placed_date": datetime.now().isoformat()},
-])
-
-# Sample Deliveries
-db["deliveries"].insert_many([
-    {"order_id": str(db.orders.find_one()["_id"]),
-     "status": "pending", "delivery_date": (datetime.now() + timedelta(days=2)).isoformat(), "proof_of_delivery": ""},
-])
-
-print("Sample data inserted successfully!") 
\ No newline at end of file
+from bson import Binary, ObjectId
+
+from products import compute_status
+from repository import COLLECTIONS, DB_NAME, MONGO_URI
+from sales_store import INT_DTYPE
+from versions import VERSIONS_COLLECTION
+
+CATEGORIES = ["Widgets", "Gadgets", "Tools", "Electronics", "Hardware", "Office", "Outdoor", "Kitchen"]
+FIRST_NAMES = ["John", "Maria", "David", "Fatima", "Alex", "Priya", "Chen", "Sofia", "Omar", "Lena"]
+LAST_NAMES = ["Doe", "Rodriguez", "Chen", "Al-Jamil", "Green", "Patel", "Wang", "Rossi", "Haddad", "Novak"]
+# Warehouses are spread around this point and deliveries around their warehouse
+SERVICE_AREA = (34.05, -118.24)
+STREETS = ["Main St", "East Ave", "West Blvd", "Oak Rd", "Harbor Way", "Mill Ln", "Park Dr", "Lake St"]
+
+ORDER_STATUSES = (["pending", "processing", "shipped", "delivered", "cancelled"], [0.08, 0.07, 0.1, 0.7, 0.05])
+PURCHASE_ORDER_STATUSES = (["pending", "shipped", "received", "cancelled"], [0.1, 0.1, 0.75, 0.05])
+TRANSFER_STATUSES = (["pending", "completed", "cancelled"], [0.1, 0.85, 0.05])
+
+# Derived from the loaded data; the API rebuilds them on first read
+DERIVED_COLLECTIONS = ["summary", "backtests", "backtest_totals", "forecast_models", "route_plans"]
+
+# Fixed ObjectId timestamp plus a per-collection byte keeps generated ids reproducible
+ID_EPOCH = 1_700_000_000
+ID_KINDS = {
+    "suppliers": 1,
+    "warehouses": 2,
+    "products": 3,
+    "purchase_orders": 4,
+    "shipments": 5,
+    "orders": 6,
+    "deliveries": 7,
+    "stock_transfers": 8,
+    "drivers": 9,
+}
+
+
+def count(value):
+    return int(float(value))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=MONGO_URI)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--suppliers", type=count, default=5)
+    parser.add_argument("--warehouses", type=count, default=3)
+    parser.add_argument("--drivers-per-warehouse", type=count, default=4)
+    parser.add_argument("--products", type=count, default=50)
+    parser.add_argument("--orders", type=count, default=500)
+    parser.add_argument("--purchase-orders", type=count, help="default: orders / 10")
+    parser.add_argument("--transfers", type=count, help="default: orders / 50")
+    parser.add_argument("--history-months", type=int, default=12)
+    parser.add_argument("--batch-size", type=count, default=10000)
+    parser.add_argument("--drop", action="store_true", help="drop the existing collections first")
+    args = parser.parse_args(argv)
+    if args.purchase_orders is None:
+        args.purchase_orders = max(1, args.orders // 10)
+    if args.transfers is None:
+        args.transfers = max(1, args.orders // 50)
+    if args.history_months < 1 or min(args.suppliers, args.warehouses, args.products) < 1:
+        parser.error("--history-months, --suppliers, --warehouses and --products must be at least 1")
+    return args
+
+
+def object_id(kind, index):
+    return ObjectId(ID_EPOCH.to_bytes(4, "big") + bytes([ID_KINDS[kind]]) + int(index).to_bytes(7, "big"))
+
+
+def batches(total, size):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def iso_dates(first_day, offsets):
+    return [(first_day + timedelta(days=int(offset))).isoformat() for offset in offsets]
+
+
+def choose(rng, statuses, size):
+    names, weights = statuses
+    return np.asarray(names)[rng.choice(len(names), size=size, p=weights)]
+
+
+class Generator:
+    def __init__(self, db, args):
+        self.db = db
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        # Coordinates draw from their own stream so they never shift any other generated value
+        self.geo_rng = np.random.default_rng([args.seed, 1])
+        today = date.today()
+        # History covers whole calendar months ending with the current one
+        first_month = today.year * 12 + today.month - 1 - (args.history_months - 1)
+        self.first_day = date(first_month // 12, first_month % 12 + 1, 1)
+        self.span_days = (today - self.first_day).days + 1
+        self.prices = None
+        self.depots = None
+        self.supplier_names = [f"Supplier {i + 1:04d}" for i in range(args.suppliers)]
+
+    def insert(self, collection, docs):
+        if docs:
+            self.db[COLLECTIONS[collection]].insert_many(docs, ordered=False)
+
+    def load(self, collection, total, make_batch):
+        started = time.perf_counter()
+        for start, end in batches(total, self.args.batch_size):
+            make_batch(start, end)
+        print(f"{collection}: {total:,} in {time.perf_counter() - started:.1f}s")
+
+    def suppliers(self, start, end):
+        n = end - start
+        lead_times = self.rng.integers(2, 21, size=n)
+        reliability = np.round(self.rng.uniform(0.8, 0.99, size=n), 2)
+        self.insert("suppliers", [
+            {
+                "_id": object_id("suppliers", i),
+                "name": self.supplier_names[i],
+                "contact_info": f"orders@supplier{i + 1}.example.com",
+                "lead_time_days": int(lead_times[k]),
+                "reliability_score": float(reliability[k]),
+            }
+            for k, i in enumerate(range(start, end))
+        ])
+
+    def warehouses(self, start, end):
+        self.depots[start:end] = np.array(SERVICE_AREA) + self.geo_rng.uniform(-0.3, 0.3, size=(end - start, 2))
+        self.insert("warehouses", [
+            {
+                "_id": object_id("warehouses", i),
+                "name": f"Warehouse {i + 1}",
+                "address": f"{100 + i} {STREETS[i % len(STREETS)]}",
+                "location": {"lat": float(self.depots[i, 0]), "lng": float(self.depots[i, 1])},
+            }
+            for i in range(start, end)
+        ])
+
+    def drivers(self, start, end):
+        per_warehouse = self.args.drivers_per_warehouse
+        self.insert("drivers", [
+            {
+                "_id": object_id("drivers", i),
+                "name": f"{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]}",
+                "avatar": f"https://i.pravatar.cc/150?img={i % 70 + 1}",
+                "warehouse_id": str(object_id("warehouses", i // per_warehouse)),
+                "capacity": 40,
+            }
+            for i in range(start, end)
+        ])
+
+    def products(self, start, end):
+        n, months = end - start, self.args.history_months
+        categories = self.rng.integers(0, len(CATEGORIES), size=n)
+        prices = np.round(self.rng.lognormal(3, 0.8, size=n), 2)
+        self.prices[start:end] = prices
+        min_stock = self.rng.integers(10, 100, size=n)
+        stock = self.rng.integers(0, 400, size=n)
+        suppliers = self.rng.integers(0, self.args.suppliers, size=n)
+
+        # Monthly demand: a base level with a linear trend, yearly seasonality and Poisson noise
+        lengths = self.rng.integers(max(1, months // 3), months + 1, size=n)
+        t = np.arange(months)
+        base = self.rng.lognormal(4.5, 0.6, size=(n, 1))
+        trend = self.rng.normal(0, 0.02, size=(n, 1))
+        season = self.rng.uniform(0, 0.3, size=(n, 1)) * np.sin(2 * np.pi * (t + self.rng.integers(0, 12, size=(n, 1))) / 12)
+        sales = self.rng.poisson(np.clip(base * (1 + trend * t + season), 0, None)).astype(INT_DTYPE)
+
+        products, series = [], []
+        now = datetime.now(timezone.utc)
+        for k, i in enumerate(range(start, end)):
+            product_id = object_id("products", i)
+            category = CATEGORIES[categories[k]]
+            products.append({
+                "_id": product_id,
+                "name": f"{category[:-1]} {i + 1:07d}",
+                "sku": f"SKU-{i + 1:08d}",
+                "category": category,
+                "stock": int(stock[k]),
+                "min_stock": int(min_stock[k]),
+                "price": float(prices[k]),
+                "supplier": self.supplier_names[suppliers[k]],
+                "status": compute_status(int(stock[k]), int(min_stock[k])),
+            })
+            # The newest months of a shorter history line up with the current month
+            series.append({
+                "_id": product_id,
+                "length": int(lengths[k]),
+                "dtype": INT_DTYPE,
+                "sales": Binary(sales[k, months - lengths[k]:].tobytes()),
+                "updated_at": now,
+            })
+        self.insert("products", products)
+        self.insert("sales_series", series)
+
+    def order_items(self, n, max_items, quantity_range):
+        counts = self.rng.integers(1, max_items + 1, size=n)
+        product_indexes = self.rng.integers(0, self.args.products, size=int(counts.sum()))
+        quantities = self.rng.integers(*quantity_range, size=len(product_indexes))
+        return np.split(product_indexes, np.cumsum(counts)[:-1]), np.split(quantities, np.cumsum(counts)[:-1])
+
+    def orders(self, start, end):
+        n = end - start
+        statuses = choose(self.rng, ORDER_STATUSES, n)
+        placed = self.rng.integers(0, self.span_days, size=n)
+        warehouses = self.rng.integers(0, self.args.warehouses, size=n)
+        first = self.rng.integers(0, len(FIRST_NAMES), size=n)
+        last = self.rng.integers(0, len(LAST_NAMES), size=n)
+        delivery_lag = self.rng.integers(1, 6, size=n)
+        product_indexes, quantities = self.order_items(n, 3, (1, 6))
+        placed_dates = iso_dates(self.first_day, placed)
+        delivery_dates = iso_dates(self.first_day, placed + delivery_lag)
+        destinations = self.depots[warehouses] + self.geo_rng.normal(0, 0.05, size=(n, 2))
+
+        orders, deliveries = [], []
+        for k, i in enumerate(range(start, end)):
+            name = f"{FIRST_NAMES[first[k]]} {LAST_NAMES[last[k]]}"
+            order_id = object_id("orders", i)
+            orders.append({
+                "_id": order_id,
+                "customer_info": {"name": name, "email": f"customer{i + 1}@example.com", "phone": f"555{i % 10_000_000:07d}"},
+                "items": [
+                    {"product_id": str(object_id("products", p)), "quantity": int(q), "price": float(self.prices[p])}
+                    for p, q in zip(product_indexes[k], quantities[k])
+                ],
+                "status": str(statuses[k]),
+                "delivery_address": f"{i % 9000 + 100} {STREETS[i % len(STREETS)]}",
+                "placed_date": placed_dates[k],
+                "warehouse_id": str(object_id("warehouses", warehouses[k])),
+            })
+            if statuses[k] in ("shipped", "delivered"):
+                deliveries.append({
+                    "_id": object_id("deliveries", i),
+                    "order_id": str(order_id),
+                    "status": "delivered" if statuses[k] == "delivered" else "in_transit",
+                    "delivery_date": delivery_dates[k],
+                    "proof_of_delivery": f"POD-{i + 1:09d}" if statuses[k] == "delivered" else "",
+                    "warehouse_id": str(object_id("warehouses", warehouses[k])),
+                    "location": {"lat": float(destinations[k, 0]), "lng": float(destinations[k, 1])},
+                })
+        self.insert("orders", orders)
+        self.insert("deliveries", deliveries)
+
+    def purchase_orders(self, start, end):
+        n = end - start
+        statuses = choose(self.rng, PURCHASE_ORDER_STATUSES, n)
+        ordered = self.rng.integers(0, self.span_days, size=n)
+        lead_times = self.rng.integers(3, 21, size=n)
+        suppliers = self.rng.integers(0, self.args.suppliers, size=n)
+        warehouses = self.rng.integers(0, self.args.warehouses, size=n)
+        product_indexes, quantities = self.order_items(n, 4, (50, 501))
+        order_dates = iso_dates(self.first_day, ordered)
+        expected = iso_dates(self.first_day, ordered + lead_times)
+
+        purchase_orders, shipments = [], []
+        for k, i in enumerate(range(start, end)):
+            po_id = object_id("purchase_orders", i)
+            purchase_orders.append({
+                "_id": po_id,
+                "supplier_id": str(object_id("suppliers", suppliers[k])),
+                "items": [
+                    {"product_id": object_id("products", p), "quantity": int(q), "price": float(self.prices[p])}
+                    for p, q in zip(product_indexes[k], quantities[k])
+                ],
+                "status": str(statuses[k]),
+                "order_date": order_dates[k],
+                "expected_delivery": expected[k],
+            })
+            if statuses[k] in ("shipped", "received"):
+                received = statuses[k] == "received"
+                shipments.append({
+                    "_id": object_id("shipments", i),
+                    "purchase_order_id": str(po_id),
+                    "warehouse_id": str(object_id("warehouses", warehouses[k])),
+                    "status": "received" if received else "in_transit",
+                    "expected_delivery": expected[k],
+                    "actual_delivery": expected[k] if received else "",
+                })
+        self.insert("purchase_orders", purchase_orders)
+        self.insert("shipments", shipments)
+
+    def stock_transfers(self, start, end):
+        n = end - start
+        statuses = choose(self.rng, TRANSFER_STATUSES, n)
+        days = self.rng.integers(0, self.span_days, size=n)
+        source = self.rng.integers(0, self.args.warehouses, size=n)
+        # Offset by 1..warehouses-1 so the destination differs from the source whenever possible
+        target = (source + self.rng.integers(1, max(2, self.args.warehouses), size=n)) % self.args.warehouses
+        product_indexes, quantities = self.order_items(n, 2, (5, 51))
+        transfer_dates = iso_dates(self.first_day, days)
+        self.insert("stock_transfers", [
+            {
+                "_id": object_id("stock_transfers", i),
+                "from_warehouse": str(object_id("warehouses", source[k])),
+                "to_warehouse": str(object_id("warehouses", target[k])),
+                "items": [{"product_id": str(object_id("products", p)), "quantity": int(q)} for p, q in zip(product_indexes[k], quantities[k])],
+                "status": str(statuses[k]),
+                "transfer_date": transfer_dates[k],
+            }
+            for k, i in enumerate(range(start, end))
+        ])
+
+    def run(self):
+        args = self.args
+        self.prices = np.zeros(args.products)
+        self.depots = np.zeros((args.warehouses, 2))
+        self.load("suppliers", args.suppliers, self.suppliers)
+        self.load("warehouses", args.warehouses, self.warehouses)
+        self.load("drivers", args.warehouses * args.drivers_per_warehouse, self.drivers)
+        self.load("products", args.products, self.products)
+        self.load("orders", args.orders, self.orders)
+        self.load("purchase_orders", args.purchase_orders, self.purchase_orders)
+        self.load("stock_transfers", args.transfers, self.stock_transfers)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    client = pymongo.MongoClient(args.uri)
+    db = client[args.db]
+    if args.drop:
+        for name in COLLECTIONS.values():
+            db.drop_collection(name)
+    elif db[COLLECTIONS["products"]].estimated_document_count():
+        sys.exit(f"{args.db} already has products; rerun with --drop to replace them")
+
+    started = time.perf_counter()
+    Generator(db, args).run()
+    for attr in DERIVED_COLLECTIONS:
+        db.drop_collection(COLLECTIONS[attr])
+    # Written behind the API's back, so ETags handed out before the load must stop matching
+    for attr in COLLECTIONS:
+        db[VERSIONS_COLLECTION].update_one({"_id": attr}, {"$inc": {"version": 1}}, upsert=True)
+    client.close()
+    print(f"Sample data inserted successfully in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+REQUIRED_FIELDS = ["name", "sku", "category", "stock", "price", "supplier"]
+
+
+def coerce_product_fields(data):
+    # Ensure numeric fields are stored as numbers
+    for field in ["stock", "price", "min_stock"]:
+        if field in data:
+            try:
+                data[field] = float(data[field]) if field == "price" else int(data[field])
+            except Exception:
+                pass  # If conversion fails, leave as is
+    return data
+
+
+def missing_required_field(data):
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            return field
+    return None
+
+
+def compute_status(stock, min_stock):
+    if stock <= min_stock / 2:
+        return "Critical"
+    elif stock <= min_stock:
+        return "Low Stock"
+    return "In Stock"
+
+
+# compute_status as an aggregation expression, so pipeline updates derive status from the stored stock
+STATUS_EXPRESSION = {"$switch": {
+    "branches": [
+        {"case": {"$lte": ["$stock", {"$divide": [{"$ifNull": ["$min_stock", 0]}, 2]}]}, "then": "Critical"},
+        {"case": {"$lte": ["$stock", {"$ifNull": ["$min_stock", 0]}]}, "then": "Low Stock"},
+    ],
+    "default": "In Stock",
+}}
+
+
+def update_pipeline(data, stock_adjustment=None):
+    """Pipeline update that sets ``data``, optionally adds ``stock_adjustment`` and recomputes status."""
+    # $literal so client values that look like expressions ("$price", {"$add": ...}) are stored as given
+    stages = [{"$set": {field: {"$literal": value} for field, value in data.items()}}] if data else []
+    if stock_adjustment:
+        stages.append({"$set": {"stock": {"$add": ["$stock", stock_adjustment]}}})
+    stages.append({"$set": {"status": STATUS_EXPRESSION}})
+    return stages
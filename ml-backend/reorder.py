@@ -0,0 +1,221 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from pymongo.errors import PyMongoError
+
+from metrics import timed_fit
+from sales_store import load_series
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_SECONDS = 900
+# Sales series are monthly; demand is estimated from the most recent periods
+DAYS_PER_PERIOD = 30
+DEMAND_WINDOW = 12
+SERVICE_LEVEL_Z = 1.645  # 95% of replenishment cycles without a stockout
+ORDER_COST = 50.0  # Fixed cost of placing one purchase order
+HOLDING_COST_RATE = 0.25  # Yearly holding cost as a fraction of unit price
+# Used for products whose supplier isn't on file
+DEFAULT_LEAD_TIME_DAYS = 14
+DEFAULT_RELIABILITY = 0.9
+CLOSED_PURCHASE_ORDER_STATUSES = ["received", "cancelled"]
+PRIORITIES = ("high", "medium", "low")
+
+# Everything build_plan reads; the plan records their versions
+PLAN_COLLECTIONS = ("products", "suppliers", "purchase_orders", "sales_series")
+PRODUCT_FIELDS = {"name": 1, "category": 1, "stock": 1, "min_stock": 1, "price": 1, "supplier": 1}
+
+_plan = None
+_refresh_lock = asyncio.Lock()
+
+
+def demand_stats(matrix, lengths, window=DEMAND_WINDOW):
+    """Mean and sample variance of each row's last ``window`` periods, with the number of periods used."""
+    columns = np.arange(matrix.shape[1])
+    recent = (columns >= lengths[:, None] - window) & (columns < lengths[:, None])
+    counts = recent.sum(axis=1)
+    mean = np.where(recent, matrix, 0).sum(axis=1) / np.maximum(counts, 1)
+    squares = np.where(recent, (matrix - mean[:, None]) ** 2, 0).sum(axis=1)
+    return mean, squares / np.maximum(counts - 1, 1), counts
+
+
+def reorder_plan(mean, variance, periods, stock, on_order, min_stock, price, lead_time, reliability):
+    """Safety stock, reorder point and EOQ for every product, one array element per product.
+
+    ``mean`` and ``variance`` are per-period demand. Lead time is ``lead_time``
+    days on average, and its standard deviation grows as the supplier's
+    ``reliability`` (share of on-time deliveries) falls. A product is reordered
+    when stock plus open purchase orders is at or below its reorder point,
+    bringing it up to reorder point + EOQ. Products without sales history
+    keep the ``min_stock`` rule: reorder at ``min_stock``, up to 1.5x.
+    """
+    daily_mean = mean / DAYS_PER_PERIOD
+    daily_variance = variance / DAYS_PER_PERIOD
+    lead_time_sd = lead_time * (1 - reliability)
+    safety_stock = SERVICE_LEVEL_Z * np.sqrt(lead_time * daily_variance + (daily_mean * lead_time_sd) ** 2)
+    reorder_point = daily_mean * lead_time + safety_stock
+
+    holding_cost = HOLDING_COST_RATE * price
+    yearly_demand = daily_mean * 365
+    priced = holding_cost > 0
+    # Without a holding cost, order one period of demand at a time
+    eoq = np.where(priced, np.sqrt(2 * yearly_demand * ORDER_COST / np.where(priced, holding_cost, 1)), mean)
+
+    history = periods > 0
+    safety_stock = np.ceil(np.where(history, safety_stock, 0))
+    reorder_point = np.ceil(np.where(history, reorder_point, min_stock))
+    eoq = np.ceil(np.where(history, eoq, min_stock * 0.5))
+
+    position = stock + on_order
+    reorder = (position <= reorder_point) & (reorder_point + eoq > 0)
+    halfway = safety_stock + (reorder_point - safety_stock) / 2
+    priority = np.select([stock <= safety_stock, stock <= halfway], [0, 1], 2)
+    return {
+        "safety_stock": safety_stock,
+        "reorder_point": reorder_point,
+        "eoq": eoq,
+        "target_stock": reorder_point + eoq,
+        "suggested_order": np.maximum(reorder_point + eoq - position, 0),
+        "reorder": reorder,
+        "priority": priority,
+    }
+
+
+def number(value):
+    # Fields left unconverted by coerce_product_fields count as zero
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def open_order_quantities(repo):
+    rows = await repo.purchase_orders.aggregate_list([
+        {"$match": {"status": {"$nin": CLOSED_PURCHASE_ORDER_STATUSES}}},
+        {"$unwind": "$items"},
+        {"$group": {"_id": "$items.product_id", "quantity": {"$sum": "$items.quantity"}}},
+    ])
+    return {row["_id"]: row["quantity"] for row in rows}
+
+
+async def build_plan(repo):
+    """Compute the reorder plan for the whole catalog and encode the ``/optimize`` response."""
+    # Read first, so a write racing the build makes the plan look older, never newer
+    versions = await repo.versions.current(PLAN_COLLECTIONS)
+    products = await repo.products.find({}, PRODUCT_FIELDS).sort("_id", 1).to_list()
+    suppliers = {
+        doc["name"]: (number(doc.get("lead_time_days")), number(doc.get("reliability_score")))
+        async for doc in repo.suppliers.find({}, {"name": 1, "lead_time_days": 1, "reliability_score": 1})
+    }
+    on_order = await open_order_quantities(repo)
+    ids, matrix, lengths, _ = await load_series(repo)
+
+    n = len(products)
+    mean, variance, periods = np.zeros(n), np.zeros(n), np.zeros(n, dtype=np.int64)
+    if ids:
+        rows = {pid: i for i, pid in enumerate(p["_id"] for p in products)}
+        found = [(rows[pid], i) for i, pid in enumerate(ids) if pid in rows]
+        if found:
+            target, source = map(list, zip(*found))
+            series_mean, series_variance, series_periods = demand_stats(matrix[source], lengths[source])
+            mean[target], variance[target], periods[target] = series_mean, series_variance, series_periods
+    lead_times = [suppliers.get(p.get("supplier"), (DEFAULT_LEAD_TIME_DAYS, DEFAULT_RELIABILITY)) for p in products]
+    lead_time = np.array([lead for lead, _ in lead_times], dtype=np.float64)
+    reliability = np.clip(np.array([score for _, score in lead_times], dtype=np.float64), 0, 1)
+    stock = np.array([number(p.get("stock")) for p in products])
+    ordered = np.array([number(on_order.get(p["_id"])) for p in products])
+    min_stock = np.array([number(p.get("min_stock")) for p in products])
+    price = np.array([number(p.get("price")) for p in products])
+
+    plan = await run_in_threadpool(
+        timed_fit, "reorder", n, reorder_plan, mean, variance, periods, stock, ordered, min_stock, price, lead_time, reliability
+    )
+
+    categories, category_index = np.unique([str(p.get("category") or "Uncategorized") for p in products], return_inverse=True)
+    current = np.bincount(category_index, weights=stock, minlength=len(categories))
+    optimal = np.bincount(category_index, weights=plan["target_stock"], minlength=len(categories))
+    chart_data = [
+        {"category": category, "current": float(current[i]), "optimal": float(optimal[i])}
+        for i, category in enumerate(categories.tolist())
+    ]
+
+    selected = np.flatnonzero(plan["reorder"])
+    # Most urgent first
+    selected = selected[np.argsort(plan["priority"][selected], kind="stable")]
+    recommendations = [
+        {
+            "product_id": str(products[i]["_id"]),
+            "product": products[i].get("name"),
+            "currentStock": int(stock[i]),
+            "onOrder": int(ordered[i]),
+            "safetyStock": int(plan["safety_stock"][i]),
+            "reorderPoint": int(plan["reorder_point"][i]),
+            "eoq": int(plan["eoq"][i]),
+            "leadTimeDays": int(lead_time[i]),
+            "suggestedOrder": int(plan["suggested_order"][i]),
+            "priority": PRIORITIES[int(plan["priority"][i])],
+        }
+        for i in selected.tolist()
+    ]
+    generated_at = datetime.now(timezone.utc)
+    body = dumps({
+        "chart_data": chart_data,
+        "reorder_recommendations": recommendations,
+        "generated_at": generated_at,
+    })
+    return {"body": body, "generated_at": generated_at, "products": n, "reorders": len(recommendations), "versions": versions}
+
+
+async def compute_plan(repo):
+    # Callers hold _refresh_lock
+    global _plan
+    _plan = await build_plan(repo)
+
+
+async def refresh_plan(repo, if_changed=False):
+    """Recompute the cached plan; concurrent calls wait for the run already in progress.
+
+    With ``if_changed`` the plan is kept when none of its inputs were written since it was built,
+    unless ``repo`` reads from secondaries that may not have had those writes yet.
+    """
+    async with _refresh_lock:
+        if not (
+            if_changed and not repo.staleness_seconds and _plan is not None
+            and _plan["versions"] == await repo.versions.current(PLAN_COLLECTIONS)
+        ):
+            await compute_plan(repo)
+    return {key: _plan[key] for key in ("generated_at", "products", "reorders")}
+
+
+async def refreshed_payload(repo):
+    """Recompute the plan and return the ``/optimize`` response decoded, e.g. as a job result."""
+    await refresh_plan(repo)
+    return orjson.loads(_plan["body"])
+
+
+def plan_versions():
+    """Versions of the inputs the cached plan was built from, or None before the first run."""
+    return None if _plan is None else _plan["versions"]
+
+
+async def read_plan(repo):
+    """The cached plan, computing it first if no run has finished yet."""
+    if _plan is None:
+        async with _refresh_lock:
+            if _plan is None:
+                await compute_plan(repo)
+    return _plan
+
+
+async def refresh_periodically(repo, interval=REFRESH_INTERVAL_SECONDS):
+    while True:
+        try:
+            await refresh_plan(repo, if_changed=True)
+        except PyMongoError as exc:
+            logger.warning("Reorder plan refresh failed: %s", exc)
+        await asyncio.sleep(interval)
@@ -0,0 +1,196 @@
+import os
+from functools import wraps
+
+from pymongo import AsyncMongoClient
+from pymongo.read_preferences import ReadPreference, make_read_preference, read_pref_mode_from_name
+
+from versions import CollectionVersions
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("MONGO_DB", "inventory_db")
+
+# Environment variable (after MONGO_ or MONGO_ANALYTICS_) -> (client option, type)
+CLIENT_SETTINGS = {
+    "MIN_POOL_SIZE": ("minPoolSize", int),
+    "MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MAX_CONNECTING": ("maxConnecting", int),
+    "MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "COMPRESSORS": ("compressors", str),
+    "APP_NAME": ("appname", str),
+}
+# The smallest maxStalenessSeconds MongoDB accepts; also assumed when a secondary read sets none
+MIN_MAX_STALENESS_SECONDS = 90
+
+# Attribute name on Repository -> MongoDB collection name
+COLLECTIONS = {
+    "products": "products",
+    "suppliers": "suppliers",
+    "purchase_orders": "purchase_orders",
+    "warehouses": "warehouses",
+    "stock_transfers": "stock_transfers",
+    "shipments": "shipments",
+    "orders": "orders",
+    "deliveries": "deliveries",
+    "drivers": "drivers",
+    "route_plans": "route_plans",
+    "summary": "supply_chain_summary",
+    "backtests": "backtests",
+    "backtest_totals": "backtest_totals",
+    "sales_series": "sales_series",
+    "forecast_models": "forecast_models",
+    "inventory_ledger": "inventory_ledger",
+    "stock_positions": "stock_positions",
+    "stock_snapshots": "stock_snapshots",
+    "warehouse_stock": "warehouse_stock",
+}
+
+# Collection methods that write; each call bumps the collection's version
+WRITE_METHODS = {
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+    "bulk_write", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+}
+
+
+def client_settings(prefix, environ=os.environ):
+    """Client options set through ``<prefix><SETTING>`` environment variables."""
+    return {
+        option: cast(environ[prefix + name]) for name, (option, cast) in CLIENT_SETTINGS.items() if environ.get(prefix + name)
+    }
+
+
+def analytics_read_preference(environ=os.environ):
+    """The read preference for analytics reads, or None to read like everything else."""
+    mode = environ.get("MONGO_ANALYTICS_READ_PREFERENCE")
+    if not mode or mode == "primary":
+        return None
+    staleness = int(environ.get("MONGO_ANALYTICS_MAX_STALENESS_SECONDS", MIN_MAX_STALENESS_SECONDS))
+    return make_read_preference(read_pref_mode_from_name(mode), None, staleness)
+
+
+class CollectionRepository:
+    """Async access to one collection.
+
+    Adds the CRUD helpers the route handlers share; any other attribute
+    (``find``, ``count_documents``, ``bulk_write``...) is passed through to
+    the underlying ``AsyncCollection``. Writes bump the collection's entry in
+    ``versions`` once per request, or as they return outside one.
+    """
+
+    def __init__(self, collection, name=None, versions=None):
+        self.collection = collection
+        self.name = name
+        self.versions = versions
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name not in WRITE_METHODS or self.versions is None:
+            return attr
+
+        @wraps(attr)
+        async def write(*args, **kwargs):
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                # Also after a partial failure, e.g. an unordered bulk write with some errors
+                await self.versions.written(self.name)
+        return write
+
+    async def get(self, doc_id, projection=None):
+        return await self.collection.find_one({"_id": doc_id}, projection)
+
+    async def insert(self, data):
+        result = await self.insert_one(data)
+        return result.inserted_id
+
+    async def update(self, doc_id, data):
+        result = await self.update_one({"_id": doc_id}, {"$set": data})
+        return result.matched_count > 0
+
+    async def delete(self, doc_id):
+        result = await self.delete_one({"_id": doc_id})
+        return result.deleted_count > 0
+
+    async def update_and_get_previous(self, doc_id, data, projection=None):
+        """Atomically ``$set`` fields and return the document as it was before, or None if missing."""
+        return await self.find_one_and_update({"_id": doc_id}, {"$set": data}, projection=projection)
+
+    async def delete_and_get(self, doc_id, projection=None):
+        return await self.find_one_and_delete({"_id": doc_id}, projection=projection)
+
+    async def aggregate_list(self, pipeline):
+        cursor = await self.collection.aggregate(pipeline)
+        return await cursor.to_list()
+
+
+class Repository:
+    """Holds the async client and one CollectionRepository per collection.
+
+    The client is created in ``connect`` and closed in ``close``; both are
+    driven by the app's lifespan so nothing touches the network at import time.
+    ``analytics`` is where catalog-wide scans read from: this repository
+    unless ``MONGO_ANALYTICS_*`` settings give them their own read preference
+    or their own client, and with it their own connection pool.
+    """
+
+    def __init__(self, versions=None):
+        self.client = None
+        self.database = None
+        self.versions = versions or CollectionVersions()
+        self.analytics = self
+        # How far reads through this repository may lag behind the primary
+        self.staleness_seconds = 0
+
+    def bind(self, database):
+        self.database = database
+        for attr, name in COLLECTIONS.items():
+            setattr(self, attr, CollectionRepository(database[name], attr, self.versions))
+
+    async def connect(self, uri=MONGO_URI, db_name=DB_NAME, listeners=None):
+        """Create the clients; ``listeners(pool)`` gives the event listeners for the "crud" or "analytics" client."""
+        listeners = listeners or (lambda pool: [])
+        options = client_settings("MONGO_")
+        self.client = AsyncMongoClient(uri, event_listeners=listeners("crud"), **options)
+        self.bind(self.client[db_name])
+        self.versions.bind(self.database)
+
+        read_preference = analytics_read_preference()
+        analytics_uri = os.environ.get("MONGO_ANALYTICS_URI")
+        analytics_options = client_settings("MONGO_ANALYTICS_")
+        if read_preference is None and not analytics_uri and not analytics_options:
+            self.analytics = self
+            return
+        self.analytics = Repository(self.versions)
+        if analytics_uri or analytics_options:
+            self.analytics.client = AsyncMongoClient(
+                analytics_uri or uri, event_listeners=listeners("analytics"), **{**options, **analytics_options},
+            )
+        client = self.analytics.client or self.client
+        self.analytics.bind(client.get_database(db_name, read_preference=read_preference))
+        read_preference = self.analytics.database.read_preference
+        if read_preference != ReadPreference.PRIMARY:
+            # Without a bound (e.g. one set in the URI), assume the smallest MongoDB allows
+            staleness = read_preference.max_staleness
+            self.analytics.staleness_seconds = staleness if staleness > 0 else MIN_MAX_STALENESS_SECONDS
+
+    def clients(self):
+        """Client per pool name, for reporting pool usage."""
+        clients = {"crud": self.client}
+        if self.analytics.client is not None and self.analytics.client is not self.client:
+            clients["analytics"] = self.analytics.client
+        return clients
+
+    async def close(self):
+        if self.analytics is not self and self.analytics.client is not None:
+            await self.analytics.client.close()
+        self.analytics = self
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+            self.database = None
+
+
+repo = Repository()
@@ -0,0 +1,98 @@
+import asyncio
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from products import update_pipeline
+
+# Statuses where the reserved stock has already left, so deleting the order doesn't return it
+FULFILLED_ORDER_STATUSES = ("shipped", "delivered")
+RESERVATION_FIELDS = {"status": 1, "items": 1, "stock_reserved": 1}
+
+
+class StockShortage(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__("Insufficient stock for product(s): " + ", ".join(map(str, product_ids)))
+
+
+def order_quantities(items):
+    """Total quantity per product ObjectId across an order's items; raises ValueError on a bad line."""
+    quantities = {}
+    for item in items:
+        try:
+            product_id = ObjectId(item["product_id"])
+        except Exception:
+            raise ValueError(f"Invalid product_id format: {item['product_id']}")
+        if item["quantity"] <= 0:
+            raise ValueError(f"Quantity must be positive for product {item['product_id']}")
+        quantities[product_id] = quantities.get(product_id, 0) + item["quantity"]
+    return quantities
+
+
+async def release(repo, quantities):
+    """Put ``quantities`` back into stock."""
+    if quantities:
+        ops = [UpdateOne({"_id": pid}, update_pipeline({}, quantity)) for pid, quantity in quantities.items()]
+        await repo.products.bulk_write(ops, ordered=False)
+
+
+async def reserve(repo, quantities):
+    """Take ``quantities`` out of stock for every product or for none.
+
+    Each line is a conditional decrement (``stock >= quantity``) that recomputes
+    status in the same update; the lines are sent concurrently so each one's
+    match count tells whether it was taken. If any line isn't matched (short
+    or unknown product) what was taken is put back and StockShortage names
+    the products that couldn't be reserved. Write errors are raised as they
+    are, also after putting back what was taken.
+    """
+    if not quantities:
+        return
+    product_ids = list(quantities)
+    results = await asyncio.gather(*(
+        repo.products.update_one({"_id": pid, "stock": {"$gte": quantities[pid]}}, update_pipeline({}, -quantities[pid]))
+        for pid in product_ids
+    ), return_exceptions=True)
+    taken = [
+        pid for pid, result in zip(product_ids, results) if not isinstance(result, BaseException) and result.matched_count
+    ]
+    if len(taken) == len(product_ids):
+        return
+
+    await release(repo, {pid: quantities[pid] for pid in taken})
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    raise StockShortage([pid for pid in product_ids if pid not in taken])
+
+
+async def update_reserved_order(repo, previous, data):
+    """Write ``data`` over the order ``previous`` (read with RESERVATION_FIELDS), moving reserved stock to match.
+
+    A cancelled order holds nothing; any other holds its items. Orders recorded
+    without a reservation (``stock_reserved`` missing) are updated as they are.
+    Returns False, with any stock taken put back, if the order's items or
+    reservation changed since ``previous`` was read.
+    """
+    if "stock_reserved" not in previous:
+        return await repo.orders.update(previous["_id"], data)
+
+    held = order_quantities(previous["items"]) if previous["stock_reserved"] else {}
+    active = data.get("status", previous.get("status")) != "cancelled"
+    wanted = order_quantities(data.get("items", previous["items"])) if active else {}
+    take = {pid: quantity - held.get(pid, 0) for pid, quantity in wanted.items() if quantity > held.get(pid, 0)}
+    give = {pid: quantity - wanted.get(pid, 0) for pid, quantity in held.items() if quantity > wanted.get(pid, 0)}
+
+    await reserve(repo, take)
+    data["stock_reserved"] = active
+    # Compare-and-set on what the reservation was computed from, so concurrent edits can't release twice
+    result = await repo.orders.update_one(
+        {"_id": previous["_id"], "items": previous["items"], "stock_reserved": previous["stock_reserved"]},
+        {"$set": data},
+    )
+    if not result.matched_count:
+        await release(repo, take)
+        return False
+    await release(repo, give)
+    return True
@@ -0,0 +1,454 @@
+import asyncio
+import logging
+import math
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import timed_fit
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE = 111.32
+AVERAGE_SPEED_KMH = 30
+SERVICE_MINUTES = 5
+NEARING_MINUTES = 10
+DEFAULT_DRIVER_CAPACITY = 40
+CLOSED_STATUSES = ("delivered", "cancelled")
+# Improvement passes per route; each pass is O(stops^2)
+MAX_IMPROVEMENT_ROUNDS = 25
+# Below this many points left, nearest-neighbour queries scan them directly
+BRUTE_FORCE_BELOW = 64
+# Attempts at a compare-and-set plan update before giving up until the next full plan
+PLAN_WRITE_RETRIES = 5
+EPSILON = 1e-9
+STOP_FIELDS = {"order_id": 1, "status": 1, "location": 1, "warehouse_id": 1}
+
+_plan_lock = asyncio.Lock()
+
+
+def project(locations, origin):
+    """``{lat, lng}`` points as ``(n, 2)`` kilometres east and north of ``origin``.
+
+    An equirectangular projection, accurate enough for one depot's delivery area.
+    """
+    lat = np.array([point["lat"] for point in locations], dtype=np.float64).reshape(-1)
+    lng = np.array([point["lng"] for point in locations], dtype=np.float64).reshape(-1)
+    x = (lng - origin["lng"]) * KM_PER_DEGREE * math.cos(math.radians(origin["lat"]))
+    y = (lat - origin["lat"]) * KM_PER_DEGREE
+    return np.column_stack([x, y])
+
+
+def distance(a, b):
+    difference = np.asarray(a) - np.asarray(b)
+    return np.hypot(difference[..., 0], difference[..., 1])
+
+
+class GridIndex:
+    """Uniform grid over 2-D points answering nearest-neighbour queries, with removal.
+
+    Cells are sized for about two points each; a query searches rings of
+    cells outwards until no unsearched cell can hold a closer point.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.alive = np.ones(len(points), dtype=bool)
+        self.remaining = len(points)
+        self.cells = {}
+        if not len(points):
+            return
+        self.origin = points.min(axis=0)
+        span = points.max(axis=0) - self.origin
+        self.size = max(math.sqrt(span[0] * span[1] * 2 / len(points)), span.max() / len(points), 1e-3)
+        keys = np.floor((points - self.origin) / self.size).astype(np.int64)
+        self.extent = keys.max(axis=0)
+        order = np.lexsort((keys[:, 1], keys[:, 0]))
+        bounds = np.flatnonzero(np.any(np.diff(keys[order], axis=0), axis=1)) + 1
+        for members in np.split(order, bounds):
+            self.cells[tuple(keys[members[0]].tolist())] = members
+
+    def remove(self, i):
+        if self.alive[i]:
+            self.alive[i] = False
+            self.remaining -= 1
+
+    def nearest(self, point):
+        """Index of the closest remaining point to ``point``, or None when none are left."""
+        if not self.remaining:
+            return None
+        if self.remaining <= BRUTE_FORCE_BELOW:
+            candidates = np.flatnonzero(self.alive)
+            return int(candidates[np.argmin(distance(self.points[candidates], point))])
+        cx, cy = np.floor((point - self.origin) / self.size).astype(np.int64).tolist()
+        last_ring = max(abs(cx), abs(cy), abs(self.extent[0] - cx), abs(self.extent[1] - cy))
+        best, best_distance = None, math.inf
+        for ring in range(last_ring + 1):
+            # Every point in this ring or beyond is at least (ring - 1) cells away
+            if best_distance <= (ring - 1) * self.size:
+                break
+            for key in ring_cells(cx, cy, ring):
+                members = self.cells.get(key)
+                if members is None:
+                    continue
+                members = members[self.alive[members]]
+                if not len(members):
+                    del self.cells[key]
+                    continue
+                distances = distance(self.points[members], point)
+                closest = int(np.argmin(distances))
+                if distances[closest] < best_distance:
+                    best, best_distance = int(members[closest]), float(distances[closest])
+        return best
+
+
+def ring_cells(cx, cy, ring):
+    if ring == 0:
+        yield cx, cy
+        return
+    for dx in range(-ring, ring + 1):
+        yield cx + dx, cy - ring
+        yield cx + dx, cy + ring
+    for dy in range(-ring + 1, ring):
+        yield cx - ring, cy + dy
+        yield cx + ring, cy + dy
+
+
+def assign_stops(starts, capacities, points):
+    """Split ``points`` between drivers by parallel nearest neighbour.
+
+    Drivers take turns claiming the remaining stop closest to their last
+    one until every stop is claimed or every driver is full. Returns one
+    index array per driver and the indices left unassigned.
+    """
+    index = GridIndex(points)
+    positions = [np.asarray(start, dtype=np.float64) for start in starts]
+    routes = [[] for _ in starts]
+    active = [d for d, capacity in enumerate(capacities) if capacity > 0]
+    while active and index.remaining:
+        for d in list(active):
+            stop = index.nearest(positions[d])
+            if stop is None:
+                break
+            index.remove(stop)
+            routes[d].append(stop)
+            positions[d] = points[stop]
+            if len(routes[d]) >= capacities[d]:
+                active.remove(d)
+    routes = [np.array(route, dtype=np.int64) for route in routes]
+    return routes, np.flatnonzero(index.alive)
+
+
+def route_legs(start, points):
+    """Length of each leg of the open route from ``start`` through ``points`` in order."""
+    return distance(np.vstack([start, points])[:-1], points) if len(points) else np.zeros(0)
+
+
+def two_opt(start, points, order):
+    """Reverse stretches of the route wherever that shortens it; returns ``(order, improved)``.
+
+    Routes are open: they start at ``start`` and end at the last stop.
+    """
+    n = len(order)
+    improved = False
+    if n < 2:
+        return order, improved
+    path = np.vstack([start, points[order]])
+    for i in range(1, n):
+        # Reverse path[i..j] for every j > i at once: edges (a, b) and (c, d) become (a, c) and (b, d)
+        a, b = path[i - 1], path[i]
+        c, d = path[i + 1:], path[i + 2:]
+        before = distance(a, b) + np.append(distance(c[:-1], d), 0)
+        after = distance(a, c) + np.append(distance(b, d), 0)
+        delta = after - before
+        k = int(np.argmin(delta))
+        if delta[k] < -EPSILON:
+            j = i + 1 + k
+            path[i:j + 1] = path[i:j + 1][::-1].copy()
+            order[i - 1:j] = order[i - 1:j][::-1].copy()
+            improved = True
+    return order, improved
+
+
+def or_opt(start, points, order):
+    """Move runs of one to three stops, either way round, to wherever they fit best; returns ``(order, improved)``."""
+    improved = False
+    for length in (1, 2, 3):
+        path = np.vstack([start, points[order]])
+        edges = np.append(distance(path[:-1], path[1:]), 0)
+        n = len(order)
+        i = 1
+        while n > length and i + length - 1 <= n:
+            # The run is path[i..i+length-1]; it can go between path[k] and path[k + 1] (or after the last stop)
+            saved = edges[i - 1]
+            if i + length <= n:
+                saved += edges[i + length - 1] - distance(path[i - 1], path[i + length])
+            to_first = distance(path, path[i])
+            to_last = distance(path, path[i + length - 1])
+            forward = to_first + np.append(to_last[1:], 0) - edges
+            backward = to_last + np.append(to_first[1:], 0) - edges
+            cost = np.minimum(forward, backward)
+            cost[i - 1:i + length] = np.inf  # where the run already is
+            k = int(np.argmin(cost))
+            if cost[k] < saved - EPSILON:
+                run = order[i - 1:i - 1 + length]
+                if backward[k] < forward[k]:
+                    run = run[::-1]
+                remaining = np.concatenate([order[:i - 1], order[i - 1 + length:]])
+                at = k if k < i else k - length
+                order = np.concatenate([remaining[:at], run, remaining[at:]])
+                path = np.vstack([start, points[order]])
+                edges = np.append(distance(path[:-1], path[1:]), 0)
+                improved = True
+            else:
+                i += 1
+    return order, improved
+
+
+def improve(start, points, order=None):
+    """Shorten an open route with alternating 2-opt and Or-opt passes; returns the new stop order."""
+    order = np.arange(len(points)) if order is None else np.array(order, dtype=np.int64)
+    for _ in range(MAX_IMPROVEMENT_ROUNDS):
+        order, reversed_any = two_opt(start, points, order)
+        order, moved_any = or_opt(start, points, order)
+        if not (reversed_any or moved_any):
+            break
+    return order
+
+
+def cheapest_insertion(start, points, candidates):
+    """Cheapest way to add one of ``candidates`` to the route, as ``(added km, position, candidate)``."""
+    path = np.vstack([start, points])
+    added = distance(path[:, None], candidates[None])
+    if len(points):
+        added[:-1] += distance(candidates[None], path[1:, None]) - distance(path[:-1], path[1:])[:, None]
+    position, candidate = np.unravel_index(int(np.argmin(added)), added.shape)
+    return float(added[position, candidate]), int(position), int(candidate)
+
+
+def route_stop(delivery):
+    """The plan entry for a delivery, or None when it is closed or has no location or depot."""
+    if delivery is None or delivery.get("status") in CLOSED_STATUSES:
+        return None
+    location = delivery.get("location")
+    if not location or not delivery.get("warehouse_id"):
+        return None
+    return {
+        "delivery_id": str(delivery["_id"]),
+        "order_id": delivery.get("order_id"),
+        "status": delivery.get("status"),
+        "lat": float(location["lat"]),
+        "lng": float(location["lng"]),
+    }
+
+
+def driver_route(driver, depot):
+    start = driver.get("location") or depot
+    capacity = driver.get("capacity")
+    return {
+        "driver_id": str(driver["_id"]),
+        "name": driver.get("name"),
+        "avatar": driver.get("avatar"),
+        "start": {"lat": float(start["lat"]), "lng": float(start["lng"])},
+        "capacity": DEFAULT_DRIVER_CAPACITY if capacity is None else int(capacity),
+        "stops": [],
+        "distance_km": 0.0,
+    }
+
+
+def measure(route, depot):
+    points = project(route["stops"], depot)
+    route["distance_km"] = round(float(route_legs(project([route["start"]], depot)[0], points).sum()), 3)
+
+
+def plan_depot(depot, routes, stops):
+    """Fill ``routes`` (see ``driver_route``) with ``stops``; returns the stops left unassigned."""
+    points = project(stops, depot)
+    starts = project([route["start"] for route in routes], depot)
+    assigned, unassigned = assign_stops(starts, [route["capacity"] for route in routes], points)
+    for route, start, members in zip(routes, starts, assigned):
+        order = members[improve(start, points[members])] if len(members) else members
+        route["stops"] = [stops[i] for i in order.tolist()]
+        measure(route, depot)
+    return [stops[i] for i in unassigned.tolist()]
+
+
+async def plan_routes(repo, warehouse_id=None, progress=None):
+    """Plan every depot's routes from scratch and store them, one ``route_plans`` document per warehouse.
+
+    Only warehouses with a ``location`` are planned; their open deliveries
+    with a location are split between the warehouse's drivers.
+    """
+    async with _plan_lock:
+        query = {"location": {"$exists": True}}
+        if warehouse_id is not None:
+            query["_id"] = ObjectId(warehouse_id)
+        warehouses = await repo.warehouses.find(query, {"location": 1}).to_list()
+        ids = [str(warehouse["_id"]) for warehouse in warehouses]
+        drivers, stops = {}, {}
+        async for driver in repo.drivers.find({"warehouse_id": {"$in": ids}}):
+            drivers.setdefault(driver["warehouse_id"], []).append(driver)
+        open_query = {"warehouse_id": {"$in": ids}, "status": {"$nin": list(CLOSED_STATUSES)}, "location": {"$exists": True}}
+        async for delivery in repo.deliveries.find(open_query, STOP_FIELDS):
+            stop = route_stop(delivery)
+            if stop is not None:
+                stops.setdefault(delivery["warehouse_id"], []).append(stop)
+
+        totals = {"warehouses": len(ids), "stops": 0, "assigned": 0, "unassigned": 0, "distance_km": 0.0}
+        for done, (depot_id, warehouse) in enumerate(zip(ids, warehouses), 1):
+            depot = warehouse["location"]
+            routes = [driver_route(driver, depot) for driver in drivers.get(depot_id, [])]
+            depot_stops = stops.get(depot_id, [])
+            unassigned = await run_in_threadpool(timed_fit, "route_plan", len(depot_stops), plan_depot, depot, routes, depot_stops)
+            await repo.route_plans.update_one({"_id": depot_id}, {
+                "$set": {"depot": depot, "routes": routes, "unassigned": unassigned, "updated_at": datetime.now(timezone.utc)},
+                "$inc": {"version": 1},
+            }, upsert=True)
+            totals["stops"] += len(depot_stops)
+            totals["unassigned"] += len(unassigned)
+            totals["distance_km"] += sum(route["distance_km"] for route in routes)
+            if progress:
+                progress(done, len(ids))
+        totals["assigned"] = totals["stops"] - totals["unassigned"]
+        totals["distance_km"] = round(totals["distance_km"], 3)
+        return totals
+
+
+def replan_stop(plan, delivery_id, stop):
+    """Apply one delivery's change to a stored plan in place.
+
+    The delivery leaves whichever route held it; ``stop``, if given, goes
+    back in at the cheapest position among drivers with room. Only the
+    routes touched are re-optimized. Returns whether the plan changed.
+    """
+    depot = plan["depot"]
+    touched, found = [], None
+    for route in plan["routes"] + [None]:
+        entries = route["stops"] if route is not None else plan["unassigned"]
+        for position, entry in enumerate(entries):
+            if entry["delivery_id"] == delivery_id:
+                found = (route, entries, position)
+                break
+        if found:
+            break
+    if found and stop is not None and (found[1][found[2]]["lat"], found[1][found[2]]["lng"]) == (stop["lat"], stop["lng"]):
+        # Same place: a status change only
+        changed = found[1][found[2]] != stop
+        found[1][found[2]] = stop
+        return changed
+    if found:
+        route, entries, position = found
+        del entries[position]
+        if route is not None:
+            touched.append(route)
+    if stop is not None:
+        plan["unassigned"].append(stop)
+
+    # Fill free capacity from the unassigned stops, cheapest insertion first
+    while plan["unassigned"]:
+        candidates = project(plan["unassigned"], depot)
+        best = None
+        for route in plan["routes"]:
+            if len(route["stops"]) < route["capacity"]:
+                start = project([route["start"]], depot)[0]
+                option = cheapest_insertion(start, project(route["stops"], depot), candidates)
+                if best is None or option[0] < best[0][0]:
+                    best = (option, route)
+        if best is None:
+            break
+        (_, position, candidate), route = best
+        route["stops"].insert(position, plan["unassigned"].pop(candidate))
+        if route not in touched:
+            touched.append(route)
+
+    for route in touched:
+        start = project([route["start"]], depot)[0]
+        order = improve(start, project(route["stops"], depot))
+        route["stops"] = [route["stops"][i] for i in order.tolist()]
+        measure(route, depot)
+    return bool(found) or stop is not None
+
+
+async def update_plan(repo, depot_id, change):
+    """Apply ``change(plan)`` to one stored plan with a compare-and-set on its version."""
+    for _ in range(PLAN_WRITE_RETRIES):
+        plan = await repo.route_plans.get(depot_id)
+        if plan is None:
+            return False
+        version = plan.get("version", 0)
+        if not await run_in_threadpool(timed_fit, "route_update", 1, change, plan):
+            return False
+        plan["version"] = version + 1
+        plan["updated_at"] = datetime.now(timezone.utc)
+        result = await repo.route_plans.replace_one({"_id": depot_id, "version": version}, plan)
+        if result.matched_count:
+            return True
+    logger.warning("Route plan %s kept changing; delivery update left for the next full plan", depot_id)
+    return False
+
+
+async def sync_route(repo, delivery_id):
+    """Bring the stored route plans in line with one delivery after it was written or deleted.
+
+    Plans that don't exist yet are left alone; the first full plan picks the delivery up.
+    """
+    delivery_id = str(delivery_id)
+    delivery = await repo.deliveries.get(ObjectId(delivery_id), STOP_FIELDS)
+    stop = route_stop(delivery)
+    depot_id = delivery["warehouse_id"] if stop is not None else None
+    holding = {"$or": [{"routes.stops.delivery_id": delivery_id}, {"unassigned.delivery_id": delivery_id}]}
+    depots = {doc["_id"] async for doc in repo.route_plans.find(holding, {"_id": 1})}
+    if depot_id is not None:
+        depots.add(depot_id)
+    for depot in depots:
+        await update_plan(repo, depot, lambda plan: replan_stop(plan, delivery_id, stop if depot == depot_id else None))
+
+
+async def resolve_depot(repo, data):
+    """Fill in a delivery's ``warehouse_id`` from its order when it wasn't given."""
+    if data.get("warehouse_id") or not ObjectId.is_valid(data.get("order_id", "")):
+        return
+    order = await repo.orders.get(ObjectId(data["order_id"]), {"warehouse_id": 1})
+    if order and order.get("warehouse_id"):
+        data["warehouse_id"] = order["warehouse_id"]
+
+
+def with_etas(route):
+    """Minutes until each stop of a route: driving time at ``AVERAGE_SPEED_KMH`` plus time at earlier stops."""
+    legs = route_legs(np.zeros(2), project(route["stops"], route["start"]))
+    minutes = np.cumsum(legs) / AVERAGE_SPEED_KMH * 60 + SERVICE_MINUTES * np.arange(len(legs))
+    return [{**stop, "eta_minutes": int(round(eta))} for stop, eta in zip(route["stops"], minutes.tolist())]
+
+
+async def read_routes(repo, warehouse_id):
+    plan = await repo.route_plans.get(warehouse_id)
+    if plan is not None:
+        plan["routes"] = [{**route, "stops": with_etas(route)} for route in plan["routes"]]
+    return plan
+
+
+async def last_mile(repo, warehouse_id=None, limit=100):
+    """Open planned deliveries soonest first, in the dashboard's last-mile shape."""
+    query = {} if warehouse_id is None else {"_id": warehouse_id}
+    deliveries = []
+    async for plan in repo.route_plans.find(query, {"routes": 1}):
+        for route in plan["routes"]:
+            driver = {"name": route["name"], "avatar": route["avatar"]}
+            for sequence, stop in enumerate(with_etas(route), 1):
+                eta = stop["eta_minutes"]
+                status = "Delayed" if stop["status"] == "delayed" else "Nearing Destination" if eta <= NEARING_MINUTES else "In Transit"
+                deliveries.append({
+                    "id": stop["delivery_id"],
+                    "orderId": stop["order_id"],
+                    "warehouseId": plan["_id"],
+                    "driver": driver,
+                    "status": status,
+                    "etaMinutes": eta,
+                    "sequence": sequence,
+                    "currentLocation": route["start"],
+                    "destination": {"lat": stop["lat"], "lng": stop["lng"]},
+                })
+    deliveries.sort(key=lambda delivery: delivery["etaMinutes"])
+    return deliveries[:limit]
@@ -0,0 +1,130 @@
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import Binary
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+# Sales are packed little-endian: whole-number series as int64, anything else as float64
+INT_DTYPE = "<i8"
+FLOAT_DTYPE = "<f8"
+MIGRATION_CHUNK_SIZE = 1000
+
+
+def default_periods(length):
+    return [f"Month {i + 1}" for i in range(length)]
+
+
+def period_labels(periods, length):
+    return periods or default_periods(length)
+
+
+def pack_history(sales_history):
+    """Turn an API ``[{"period", "sales"}]`` list into a stored series document.
+
+    Period labels are only stored when they differ from "Month 1".."Month N".
+    Raises ValueError for anything that isn't a list of numeric sales.
+    """
+    try:
+        sales = np.array([item["sales"] for item in sales_history], dtype=np.float64)
+        periods = [str(item["period"]) for item in sales_history]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("sales_history must be a list of {period, sales} objects")
+    dtype = INT_DTYPE if np.array_equal(sales, np.round(sales)) else FLOAT_DTYPE
+    doc = {"length": len(sales), "dtype": dtype, "sales": Binary(sales.astype(dtype).tobytes())}
+    if periods != default_periods(len(sales)):
+        doc["periods"] = periods
+    return doc
+
+
+def unpack_sales(doc):
+    return np.frombuffer(doc["sales"], dtype=doc["dtype"])
+
+
+def to_history(doc):
+    """Rebuild the API's ``[{"period", "sales"}]`` list from a stored series."""
+    sales = unpack_sales(doc).tolist()
+    return [{"period": period, "sales": value} for period, value in zip(period_labels(doc.get("periods"), len(sales)), sales)]
+
+
+def series_matrix(docs):
+    """Stack stored series into a contiguous zero-padded ``(n_series, max_len)`` float matrix.
+
+    Returns the matrix and the length of each row.
+    """
+    rows = [unpack_sales(doc) for doc in docs]
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+    width = int(lengths.max()) if rows else 0
+    matrix = np.zeros((len(rows), width), dtype=np.float64)
+    if rows:
+        matrix[np.arange(width) < lengths[:, None]] = np.concatenate(rows)
+    return matrix, lengths
+
+
+async def load_series(repo, product_ids=None, min_length=1, limit=0):
+    """Load sales series as ``(ids, matrix, lengths, periods)``, ordered by product id.
+
+    ``product_ids`` restricts the load (products without a series are simply
+    absent from ``ids``); ``None`` loads every series at least ``min_length``
+    long. ``periods`` holds each row's stored labels, or None for the defaults.
+    """
+    query = {"length": {"$gte": min_length}}
+    if product_ids is not None:
+        query["_id"] = {"$in": list(product_ids)}
+    docs = await repo.sales_series.find(query, {"updated_at": 0}).sort("_id", 1).limit(limit).to_list()
+    matrix, lengths = series_matrix(docs)
+    return [doc["_id"] for doc in docs], matrix, lengths, [doc.get("periods") for doc in docs]
+
+
+async def load_histories(repo, product_ids):
+    """Map each product id that has a series to its API-shaped sales history."""
+    docs = await repo.sales_series.find({"_id": {"$in": list(product_ids)}}, {"updated_at": 0}).to_list()
+    return {doc["_id"]: to_history(doc) for doc in docs}
+
+
+async def save_series(repo, product_id, doc):
+    await repo.sales_series.replace_one({"_id": product_id}, {**doc, "updated_at": datetime.now(timezone.utc)}, upsert=True)
+
+
+async def save_history(repo, product_id, sales_history):
+    """Replace a product's series and return the stored document."""
+    doc = pack_history(sales_history)
+    await save_series(repo, product_id, doc)
+    return doc
+
+
+async def delete_history(repo, product_id):
+    await repo.sales_series.delete(product_id)
+
+
+async def migrate_embedded_history(repo, chunk_size=MIGRATION_CHUNK_SIZE):
+    """Move ``sales_history`` arrays still embedded in product documents into the series store.
+
+    Malformed histories are logged and left in place. Returns how many were moved.
+    """
+    moved = 0
+    chunk = []
+
+    async def flush():
+        now = datetime.now(timezone.utc)
+        await repo.sales_series.bulk_write(
+            [ReplaceOne({"_id": pid}, {**doc, "updated_at": now}, upsert=True) for pid, doc in chunk], ordered=False
+        )
+        await repo.products.update_many({"_id": {"$in": [pid for pid, _ in chunk]}}, {"$unset": {"sales_history": ""}})
+
+    async for product in repo.products.find({"sales_history": {"$exists": True}}, {"sales_history": 1}):
+        try:
+            chunk.append((product["_id"], pack_history(product["sales_history"] or [])))
+        except ValueError as exc:
+            logger.warning("Skipping sales history of product %s: %s", product["_id"], exc)
+            continue
+        if len(chunk) >= chunk_size:
+            await flush()
+            moved += len(chunk)
+            chunk = []
+    if chunk:
+        await flush()
+        moved += len(chunk)
+    return moved
@@ -0,0 +1,38 @@
+import sys
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+NUMPY_DUMPS_OPTIONS = DUMPS_OPTIONS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def encode_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """Encode ``content`` as JSON bytes, turning ObjectIds (at any depth) into strings."""
+    # orjson imports numpy to check for arrays when asked to encode them; before numpy is loaded there can't be any
+    option = NUMPY_DUMPS_OPTIONS if "numpy" in sys.modules else DUMPS_OPTIONS
+    return orjson.dumps(content, default=encode_default, option=option)
+
+
+class APIResponse(JSONResponse):
+    """JSON response encoded with orjson.
+
+    Returning it from a handler also skips FastAPI's ``jsonable_encoder`` pass,
+    so documents can be returned straight from MongoDB.
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+def serialize_document(doc):
+    # The ObjectId itself is converted when the response is encoded
+    doc["id"] = doc.pop("_id")
+    return doc
@@ -0,0 +1,172 @@
+"""Measure how long the API takes to import and to start serving.
+
+Imports ``main`` in fresh interpreters under ``python -X importtime`` and
+reports the median import time with the slowest top-level imports, plus
+which heavy optional libraries got loaded::
+
+    python startup_benchmark.py --runs 10 --output startup.json
+    python startup_benchmark.py --spawn --baseline startup.json --output startup-new.json
+
+``--spawn`` also starts uvicorn (against the local mongod) and times how
+long until ``/health`` answers; ``--prewarm`` does so with
+``PREWARM_ANALYTICS=1``. Prewarming happens in the app's lifespan, so it
+doesn't change the import measurements.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Libraries worth knowing about when they load at import time
+HEAVY_MODULES = ["numpy", "pandas", "sklearn", "scipy", "pyarrow", "openpyxl"]
+TOP_IMPORTS = 15
+
+
+def parse_importtime(stderr):
+    """``{module: cumulative microseconds}`` for ``main`` and the modules it imports directly."""
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is two spaces per level and a module is listed after everything it imports
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == "main":
+                return {**children, "main": int(cumulative)}
+            children = {}
+    return {}
+
+
+def import_run(env):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=HERE, env=env, capture_output=True, text=True, check=True,
+    )
+    return time.perf_counter() - started, parse_importtime(result.stderr)
+
+
+def loaded_heavy_modules(env):
+    code = f"import json, sys, main; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def serve_run(port, env):
+    # Imported here so the import measurements don't need httpx
+    import httpx
+    from benchmark import STARTUP_TIMEOUT_SECONDS
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env,
+    )
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                sys.exit("uvicorn exited during startup")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        sys.exit("uvicorn did not become ready in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def measure(args):
+    env = dict(os.environ, PREWARM_ANALYTICS="0")
+    runs = [import_run(env) for _ in range(args.runs)]
+    modules = {name for _, times in runs for name in times}
+    cumulative = {name: statistics.median(times.get(name, 0) for _, times in runs) / 1000 for name in modules}
+    results = {
+        "interpreter_ms": round(statistics.median(seconds for seconds, _ in runs) * 1000, 1),
+        "import_main_ms": round(cumulative.pop("main", 0), 1),
+        "top_imports_ms": {
+            name: round(ms, 1) for name, ms in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:TOP_IMPORTS]
+        },
+        "heavy_modules_loaded": loaded_heavy_modules(env),
+    }
+    if args.spawn:
+        env["PREWARM_ANALYTICS"] = "1" if args.prewarm else "0"
+        results["ready_ms"] = round(statistics.median(serve_run(args.port, env) for _ in range(args.runs)) * 1000, 1)
+    return results
+
+
+def report(results):
+    print(f"{'interpreter + import main':<40} {results['interpreter_ms']:>9.1f}ms")
+    print(f"{'import main (importtime)':<40} {results['import_main_ms']:>9.1f}ms")
+    if "ready_ms" in results:
+        print(f"{'uvicorn start until /health':<40} {results['ready_ms']:>9.1f}ms")
+    print(f"Heavy libraries loaded by import: {', '.join(results['heavy_modules_loaded']) or 'none'}")
+    print("\nSlowest imports (cumulative):")
+    for name, ms in results["top_imports_ms"].items():
+        print(f"  {name:<38} {ms:>9.1f}ms")
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nCompared with {baseline_path} (increases over {threshold:.0%} flagged):")
+    for key in ("interpreter_ms", "import_main_ms", "ready_ms"):
+        before, after = baseline.get(key), results.get(key)
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{key:<40} {before:>9.1f} -> {after:>9.1f}ms ({change:+.0%}){flag}")
+    added = sorted(set(results["heavy_modules_loaded"]) - set(baseline.get("heavy_modules_loaded", [])))
+    if added:
+        print(f"Newly loaded at import: {', '.join(added)}  REGRESSION")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement; medians are reported")
+    parser.add_argument("--spawn", action="store_true", help="also time uvicorn until /health answers")
+    parser.add_argument(
+        "--prewarm", action="store_true", help="start uvicorn with PREWARM_ANALYTICS=1 (with --spawn; imports are unaffected)",
+    )
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", default="startup-results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative increase reported as a regression")
+    args = parser.parse_args(argv)
+    if args.prewarm and not args.spawn:
+        parser.error("--prewarm only affects the --spawn measurement")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = measure(args)
+    report(results)
+    meta = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "runs": args.runs,
+        "prewarm": args.prewarm,
+        "python": platform.python_version(),
+    }
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
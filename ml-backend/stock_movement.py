@@ -0,0 +1,157 @@
+import asyncio
+import re
+from datetime import datetime, timezone
+
+DEFAULT_MONTHS = 6
+MAX_MONTHS = 120
+MONTH_PATTERN = re.compile(r"^(\d{4})-(0[1-9]|1[0-2])$")
+
+
+def parse_month(value):
+    """Validate a ``YYYY-MM`` month, returning it or raising ValueError."""
+    if not MONTH_PATTERN.match(value):
+        raise ValueError(f"Invalid month {value!r} (expected YYYY-MM)")
+    return value
+
+
+def shift_month(month, delta):
+    year, mon = int(month[:4]), int(month[5:7])
+    index = year * 12 + mon - 1 + delta
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_range(start, end):
+    months = [start]
+    while months[-1] < end:
+        months.append(shift_month(months[-1], 1))
+    return months
+
+
+def resolve_range(start=None, end=None, now=None):
+    """Fill in a missing ``from``/``to`` (default: the last six months up to now)."""
+    end = parse_month(end) if end else (now or datetime.now(timezone.utc)).strftime("%Y-%m")
+    start = parse_month(start) if start else shift_month(end, -(DEFAULT_MONTHS - 1))
+    if start > end:
+        raise ValueError("from must not be after to")
+    if len(month_range(start, end)) > MAX_MONTHS:
+        raise ValueError(f"Range is limited to {MAX_MONTHS} months")
+    return start, end
+
+
+def by_month(date_field):
+    # Dates are stored as ISO strings ("YYYY-MM-DD"), so the month is their first 7 characters
+    return {"$substrBytes": [f"${date_field}", 0, 7]}
+
+
+def date_filter(date_field, start):
+    # Open-ended so in-stock levels can be rolled back from today's stock
+    return {date_field: {"$gte": start}}
+
+
+def sold_pipeline(start, warehouse_id):
+    match = {**date_filter("placed_date", start), "status": {"$ne": "cancelled"}}
+    if warehouse_id:
+        match["warehouse_id"] = warehouse_id
+    return [
+        {"$match": match},
+        {"$unwind": "$items"},
+        {"$group": {"_id": by_month("placed_date"), "quantity": {"$sum": "$items.quantity"}}},
+    ]
+
+
+def restocked_pipeline(start, warehouse_id):
+    # A purchase order is received into stock by its received shipment, which carries the date and warehouse
+    match = {**date_filter("actual_delivery", start), "status": "received"}
+    if warehouse_id:
+        match["warehouse_id"] = warehouse_id
+    return [
+        {"$match": match},
+        # Shipments store the purchase order id as a string
+        {"$addFields": {"purchase_order_oid": {"$convert": {
+            "input": "$purchase_order_id", "to": "objectId", "onError": None, "onNull": None,
+        }}}},
+        {"$lookup": {
+            "from": "purchase_orders",
+            "localField": "purchase_order_oid",
+            "foreignField": "_id",
+            "as": "purchase_order",
+        }},
+        {"$unwind": "$purchase_order"},
+        {"$unwind": "$purchase_order.items"},
+        {"$group": {"_id": by_month("actual_delivery"), "quantity": {"$sum": "$purchase_order.items.quantity"}}},
+    ]
+
+
+def transfers_pipeline(start, warehouse_id):
+    match = {**date_filter("transfer_date", start), "status": "completed"}
+    if warehouse_id:
+        match["$or"] = [{"from_warehouse": warehouse_id}, {"to_warehouse": warehouse_id}]
+    # Without a warehouse every transfer counts as both in and out
+    inbound = {"$eq": ["$to_warehouse", warehouse_id]} if warehouse_id else True
+    outbound = {"$eq": ["$from_warehouse", warehouse_id]} if warehouse_id else True
+    return [
+        {"$match": match},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": by_month("transfer_date"),
+            "transferredIn": {"$sum": {"$cond": [inbound, "$items.quantity", 0]}},
+            "transferredOut": {"$sum": {"$cond": [outbound, "$items.quantity", 0]}},
+        }},
+    ]
+
+
+async def total_stock(repo):
+    rows = await repo.products.aggregate_list([{"$group": {"_id": None, "stock": {"$sum": "$stock"}}}])
+    return rows[0]["stock"] if rows else 0
+
+
+async def warehouse_units(repo, warehouse_id):
+    doc = await repo.warehouse_stock.find_one({"_id": warehouse_id}, {"units": 1})
+    return doc["units"] if doc else 0
+
+
+async def stock_movement(repo, start, end, warehouse_id=None):
+    """Monthly units sold, restocked and transferred from ``start`` to ``end`` (``YYYY-MM``, inclusive).
+
+    Sold counts non-cancelled customer orders by ``placed_date``; restocked
+    counts purchase-order items received by a shipment, by its
+    ``actual_delivery``; transfers count completed stock transfers. Without a
+    warehouse, ``inStock`` is the end-of-month total rolled back from the
+    current product stock; with one, from the warehouse's ledger position,
+    counting its transfers too.
+    """
+    sold, restocked, transfers, stock = await asyncio.gather(
+        repo.orders.aggregate_list(sold_pipeline(start, warehouse_id)),
+        repo.shipments.aggregate_list(restocked_pipeline(start, warehouse_id)),
+        repo.stock_transfers.aggregate_list(transfers_pipeline(start, warehouse_id)),
+        warehouse_units(repo, warehouse_id) if warehouse_id else total_stock(repo),
+    )
+    sold = {row["_id"]: row["quantity"] for row in sold}
+    restocked = {row["_id"]: row["quantity"] for row in restocked}
+    transfers = {row["_id"]: row for row in transfers}
+
+    months = month_range(start, end)
+    def net_change(month):
+        change = restocked.get(month, 0) - sold.get(month, 0)
+        if warehouse_id:
+            row = transfers.get(month, {})
+            change += row.get("transferredIn", 0) - row.get("transferredOut", 0)
+        return change
+
+    # Net change of every month after ``end`` that has events, to roll today's stock back to ``end``
+    later = set(sold) | set(restocked) | set(transfers)
+    in_stock = stock - sum(net_change(month) for month in later if month > end)
+
+    chart_data = []
+    for month in reversed(months):
+        chart_data.append({
+            "month": month,
+            "inStock": max(0, in_stock),
+            "sold": sold.get(month, 0),
+            "restocked": restocked.get(month, 0),
+            "transferredIn": transfers.get(month, {}).get("transferredIn", 0),
+            "transferredOut": transfers.get(month, {}).get("transferredOut", 0),
+        })
+        in_stock -= net_change(month)
+    chart_data.reverse()
+    return chart_data
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_ID = "supply_chain"
+RECONCILE_INTERVAL_SECONDS = 300
+
+# Summary field -> (repository collection, statuses that close a document).
+# Collections without closing statuses count every document.
+COUNTERS = {
+    "total_suppliers": ("suppliers", None),
+    "total_warehouses": ("warehouses", None),
+    "total_products": ("products", None),
+    "open_purchase_orders": ("purchase_orders", ("received", "cancelled")),
+    "open_customer_orders": ("orders", ("delivered", "cancelled")),
+    "open_deliveries": ("deliveries", ("delivered", "cancelled")),
+    "open_shipments": ("shipments", ("received", "cancelled")),
+}
+COLLECTION_COUNTERS = {collection: (field, closed) for field, (collection, closed) in COUNTERS.items()}
+
+
+def counts_toward(doc, closed):
+    return doc is not None and (closed is None or doc.get("status") not in closed)
+
+
+async def increment(repo, field, delta):
+    await repo.summary.update_one({"_id": SUMMARY_ID}, {"$inc": {field: delta}}, upsert=True)
+
+
+async def record_change(repo, collection, before, after):
+    """Adjust the counter for ``collection`` after a write.
+
+    ``before`` and ``after`` are the document (at least its ``status``) before
+    and after the write, or None when it didn't exist: an insert is
+    ``(None, doc)`` and a delete ``(doc, None)``.
+    """
+    field, closed = COLLECTION_COUNTERS[collection]
+    delta = counts_toward(after, closed) - counts_toward(before, closed)
+    if delta:
+        await increment(repo, field, delta)
+
+
+async def record_changes(repo, collection, changes):
+    """``record_change`` for many ``(before, after)`` pairs, applied as a single increment."""
+    field, closed = COLLECTION_COUNTERS[collection]
+    delta = sum(counts_toward(after, closed) - counts_toward(before, closed) for before, after in changes)
+    if delta:
+        await increment(repo, field, delta)
+
+
+async def recount(repo):
+    counts = {}
+    for field, (collection, closed) in COUNTERS.items():
+        query = {"status": {"$nin": list(closed)}} if closed else {}
+        counts[field] = await getattr(repo, collection).count_documents(query)
+    return counts
+
+
+async def reconcile(repo):
+    """Recount every counter from scratch and overwrite the summary, reporting any drift."""
+    counts = await recount(repo)
+    previous = await repo.summary.find_one_and_update(
+        {"_id": SUMMARY_ID}, {"$set": counts}, upsert=True, return_document=ReturnDocument.BEFORE
+    ) or {}
+    drift = {field: count - previous.get(field, 0) for field, count in counts.items() if previous.get(field, 0) != count}
+    if drift and previous:
+        logger.warning("Supply chain summary drifted, corrected by: %s", drift)
+    return {"summary": counts, "drift": drift}
+
+
+async def read_summary(repo):
+    doc = await repo.summary.find_one({"_id": SUMMARY_ID}, {"_id": 0})
+    if doc is None or any(field not in doc for field in COUNTERS):
+        # Not materialized yet (first start, or the startup reconcile couldn't reach Mongo)
+        return (await reconcile(repo))["summary"]
+    return doc
+
+
+async def reconcile_periodically(repo, interval=RECONCILE_INTERVAL_SECONDS):
+    while True:
+        try:
+            await reconcile(repo)
+        except PyMongoError as exc:
+            logger.warning("Supply chain summary reconcile failed: %s", exc)
+        await asyncio.sleep(interval)
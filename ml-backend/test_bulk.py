@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+import bulk
+
+
+def matches(doc, query):
+    for field, condition in query.items():
+        if isinstance(condition, dict) and "$ne" in condition:
+            if doc.get(field) == condition["$ne"]:
+                return False
+        elif isinstance(condition, dict) and "$in" in condition:
+            if doc.get(field) not in condition["$in"]:
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+
+class Orders:
+    """The part of ``repo.orders`` that ``write_chunk`` uses, over a dict of documents.
+
+    ``bulk.UpdateOne``/``InsertOne`` are replaced by tuples in these tests, so
+    ``bulk_write`` receives ``("update", query, update)`` and ``("insert", doc)``.
+    """
+
+    def __init__(self, docs, before_write=None):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.before_write = before_write
+
+    async def find(self, query, projection=None):
+        for doc in list(self.docs.values()):
+            if matches(doc, query):
+                yield dict(doc)
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.before_write:
+            self.before_write(self.docs)
+        matched = 0
+        for op in ops:
+            if op[0] == "insert":
+                self.docs[op[1]["_id"]] = op[1]
+                continue
+            _, query, update = op
+            doc = next((doc for doc in self.docs.values() if matches(doc, query)), None)
+            if doc is not None:
+                doc.update(update["$set"])
+                matched += 1
+        return SimpleNamespace(matched_count=matched)
+
+
+def write_orders(monkeypatch, orders, entries):
+    monkeypatch.setattr(bulk, "UpdateOne", lambda query, update: ("update", query, update))
+    monkeypatch.setattr(bulk, "InsertOne", lambda doc: ("insert", doc))
+    recorded = []
+
+    async def record_changes(repo, name, changes):
+        recorded.extend(changes)
+    monkeypatch.setattr(bulk, "record_changes", record_changes)
+    results = asyncio.run(bulk.write_chunk(SimpleNamespace(orders=orders), "orders", entries))
+    return {result["index"]: result for result in results}, recorded
+
+
+def test_bulk_updates_cancelled_orders_but_not_reserved_ones(monkeypatch):
+    cancelled, reserved = ObjectId(), ObjectId()
+    orders = Orders([
+        {"_id": cancelled, "status": "cancelled", "stock_reserved": False},
+        {"_id": reserved, "status": "pending", "stock_reserved": True},
+    ])
+    results, recorded = write_orders(monkeypatch, orders, [
+        (0, cancelled, {"delivery_address": "new"}),
+        (1, reserved, {"status": "cancelled"}),
+    ])
+    assert results[0]["status"] == "updated"
+    assert orders.docs[cancelled]["delivery_address"] == "new"
+    assert results[1] == {"index": 1, "status": "error", "error": bulk.SINGLE_UPDATE_FIELDS["orders"][1]}
+    assert orders.docs[reserved]["status"] == "pending"
+    assert [new["_id"] for _, new in recorded] == [cancelled]
+
+
+def test_bulk_update_reports_orders_reserved_after_the_check(monkeypatch):
+    order = ObjectId()
+
+    def reserve(docs):
+        docs[order]["stock_reserved"] = True
+
+    orders = Orders([{"_id": order, "status": "cancelled", "stock_reserved": False}], before_write=reserve)
+    results, recorded = write_orders(monkeypatch, orders, [(0, order, {"status": "cancelled"})])
+    assert results[0]["status"] == "error"
+    assert recorded == []
@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+
+import forecast_models
+from forecasting import MODELS
+from sales_store import pack_history
+
+
+class ModelStore:
+    """The part of ``repo.forecast_models`` that ``remove_model`` uses."""
+
+    def __init__(self, models=None):
+        self.models = dict(models or {})
+
+    async def delete(self, doc_id):
+        return self.models.pop(doc_id, None) is not None
+
+
+def capture_saves(monkeypatch):
+    saved = {}
+
+    async def save_models(repo, ids, models, lengths):
+        for i, pid in enumerate(ids):
+            saved[pid] = {"model": MODELS[int(models["model"][i])], "length": int(lengths[i])}
+    monkeypatch.setattr(forecast_models, "save_models", save_models)
+    return saved
+
+
+def test_refresh_model_stores_a_model_for_a_series(monkeypatch):
+    saved = capture_saves(monkeypatch)
+    repo = SimpleNamespace(forecast_models=ModelStore())
+    history = [{"period": f"Month {i + 1}", "sales": 100 + i} for i in range(12)]
+    asyncio.run(forecast_models.refresh_model(repo, "p1", pack_history(history)))
+    assert saved["p1"]["length"] == 12
+    assert saved["p1"]["model"] in MODELS
+
+
+def test_refresh_model_drops_the_model_of_an_empty_series(monkeypatch):
+    saved = capture_saves(monkeypatch)
+    repo = SimpleNamespace(forecast_models=ModelStore({"p1": {"model": "linear", "length": 3}}))
+    asyncio.run(forecast_models.refresh_model(repo, "p1", pack_history([])))
+    assert "p1" not in repo.forecast_models.models
+    assert saved == {}
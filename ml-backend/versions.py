@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import time
+
+from pymongo import UpdateOne
+
+VERSIONS_COLLECTION = "collection_versions"
+# How stale another process's writes may look to this one
+VERSION_CHECK_SECONDS = 1.0
+
+# Collections written by the request being served, bumped once when it responds
+_request_writes = contextvars.ContextVar("request_writes", default=None)
+
+
+class CollectionVersions:
+    """A counter per collection, increased by every write through the repository.
+
+    The counters live in MongoDB so every worker process sees the same
+    values; reads are served from a copy refreshed at most once every
+    ``VERSION_CHECK_SECONDS``, and after each of this process's own bumps.
+    """
+
+    def __init__(self):
+        self.collection = None
+        self.known = {}  # collection -> version
+        self.checked_at = None  # monotonic time of the last refresh
+        self._lock = asyncio.Lock()
+
+    def bind(self, database):
+        self.collection = database[VERSIONS_COLLECTION]
+        self.known = {}
+        self.checked_at = None
+
+    async def written(self, name):
+        """Record a write to ``name``: bumped when the current request responds, or now outside one."""
+        writes = _request_writes.get()
+        if writes is not None and writes.open:
+            writes.names.add(name)
+        else:
+            await self.bump(name)
+
+    async def bump(self, *names):
+        if len(names) == 1:
+            await self.collection.update_one({"_id": names[0]}, {"$inc": {"version": 1}}, upsert=True)
+        elif names:
+            await self.collection.bulk_write(
+                [UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True) for name in names], ordered=False,
+            )
+        # Read back on the next current()
+        self.checked_at = None
+
+    async def current(self, names):
+        """The versions of ``names``, in order; collections never written are at 0."""
+        if self.checked_at is None or time.monotonic() - self.checked_at >= VERSION_CHECK_SECONDS:
+            async with self._lock:
+                if self.checked_at is None or time.monotonic() - self.checked_at >= VERSION_CHECK_SECONDS:
+                    async for doc in self.collection.find():
+                        self.known[doc["_id"]] = max(self.known.get(doc["_id"], 0), doc["version"])
+                    self.checked_at = time.monotonic()
+        return tuple(self.known.get(name, 0) for name in names)
+
+
+class RequestWrites:
+    def __init__(self):
+        self.names = set()
+        self.open = True
+
+
+class BatchedVersionsMiddleware:
+    """ASGI middleware bumping each collection a request wrote once, just before it responds.
+
+    Writes made after that, e.g. by a background job the request started,
+    are bumped one by one as they happen.
+    """
+
+    def __init__(self, app, versions):
+        self.app = app
+        self.versions = versions
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        writes = RequestWrites()
+        token = _request_writes.set(writes)
+
+        async def flush():
+            if writes.open:
+                writes.open = False
+                if writes.names:
+                    await self.versions.bump(*sorted(writes.names))
+
+        async def send_after_bump(message):
+            # Before the response goes out, so a client's next GET already sees the new versions
+            if message["type"] == "http.response.start":
+                await flush()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_after_bump)
+        finally:
+            _request_writes.reset(token)
+            await flush()